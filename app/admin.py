@@ -1,7 +1,14 @@
 from django import forms
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.db import transaction
 from django.utils.html import format_html
+from .authentication import invalidate_user_tokens
+from .live import invalidate_live_events
+from .queue import invalidate_event_queues
+from .search import search_songs
+from .songs import song_ids
+from .spotify import parse_track_id
 from .models import (
     CustomUser,
     DjProfile,
@@ -11,7 +18,8 @@ from .models import (
     SongRequest
 )
 
-IMAGE_TAG = '<img src="data:image/png;base64,{}" width="320" height="320"/>'
+IMAGE_TAG = '<img src="{}" width="320" height="320"/>'
+IMAGE_RENDITION = 'medium'
 
 
 class SoftDeletionModelAdmin(admin.ModelAdmin):
@@ -22,7 +30,7 @@ class SoftDeletionModelAdmin(admin.ModelAdmin):
         obj.save()
 
     def delete_queryset(self, request, queryset):
-        queryset.update(is_active=False)
+        self.soft_delete_queryset(queryset)
 
     def get_actions(self, request):
         actions = super().get_actions(request)
@@ -32,6 +40,9 @@ class SoftDeletionModelAdmin(admin.ModelAdmin):
     actions = ['soft_delete_selected']
     
     def soft_delete_selected(self, request, queryset):
+        self.soft_delete_queryset(queryset)
+
+    def soft_delete_queryset(self, queryset):
         queryset.update(is_active=False)
 
     soft_delete_selected.short_description = "Soft delete selected objects"
@@ -51,13 +62,13 @@ class DjProfileForm(forms.ModelForm):
     
     def clean_upload(self):
         image = self.cleaned_data.get('upload')
-        instance = self.instance
-        instance.encode_image(image)
-        return instance.image
+        if image:
+            self.instance.set_image(image)
+        return image
     
     def display_image(self):
-        if self.instance.image:
-            return format_html(IMAGE_TAG, self.image)
+        if self.instance.image_file:
+            return format_html(IMAGE_TAG, self.instance.image_url(IMAGE_RENDITION))
         return '(No image)'
     
     display_image.short_description = 'Image Preview'
@@ -73,8 +84,8 @@ class DjProfileInline(admin.StackedInline):
 
     @admin.display(description='Image')
     def display_image(self, instance):
-        if instance.id and instance.image:
-            return format_html(IMAGE_TAG, instance.image)
+        if instance.id and instance.image_file:
+            return format_html(IMAGE_TAG, instance.image_url(IMAGE_RENDITION))
         return "(No image)"
     
     display_image.short_description = 'Image Preview'
@@ -89,10 +100,13 @@ class DjProfileAdmin(SoftDeletionModelAdmin):
     
     @admin.display(description='Image')
     def display_image(self, obj):
-        return format_html(IMAGE_TAG, obj.image)
+        if obj.image_file:
+            return format_html(IMAGE_TAG, obj.image_url(IMAGE_RENDITION))
+        return "(No image)"
 
     list_display = ('name', 'dj_email', 'image_name')
-    search_fields = ('name', 'dj_email')
+    list_select_related = ('user',)
+    search_fields = ('name', 'user__email')
     autocomplete_fields = ('user',)
 
     def get_readonly_fields(self, request, obj=None):
@@ -103,6 +117,11 @@ class DjProfileAdmin(SoftDeletionModelAdmin):
 
     dj_email.short_description = 'Dj Email'
 
+    def soft_delete_queryset(self, queryset):
+        user_ids = [user_id for user_id in queryset.values_list('user_id', flat=True) if user_id is not None]
+        super().soft_delete_queryset(queryset)
+        invalidate_user_tokens(user_ids)
+
 
 @admin.register(CustomUser)
 class CustomUserAdmin(UserAdmin, SoftDeletionModelAdmin):
@@ -111,6 +130,8 @@ class CustomUserAdmin(UserAdmin, SoftDeletionModelAdmin):
     ordering = ('email',)
 
     list_display = ('email', 'is_dj','is_staff', 'is_active')
+    # is_dj reads the cached profile instead of querying it for every row
+    list_select_related = ('djprofile',)
 
     # Update the fields used in the user creation form in the admin site
     add_fieldsets = (
@@ -143,12 +164,31 @@ class CustomUserAdmin(UserAdmin, SoftDeletionModelAdmin):
 
         return form
 
+    def soft_delete_queryset(self, queryset):
+        user_ids = list(queryset.values_list('pk', flat=True))
+        super().soft_delete_queryset(queryset)
+        invalidate_user_tokens(user_ids)
+
 
 @admin.register(Location)
 class LocationAdmin(SoftDeletionModelAdmin):
     list_display = ('name', 'latitude', 'longitude', 'created_at')
     search_fields = ('name',)
 
+
+class LiveEventFilter(admin.SimpleListFilter):
+    title = 'live'
+    parameter_name = 'live'
+
+    def lookups(self, request, model_admin):
+        return (('yes', 'Yes'),)
+
+    def queryset(self, request, queryset):
+        if self.value() == 'yes':
+            return queryset.live()
+        return queryset
+
+
 @admin.register(Event)
 class EventAdmin(SoftDeletionModelAdmin):
     def dj_email(self, obj):
@@ -165,7 +205,9 @@ class EventAdmin(SoftDeletionModelAdmin):
     location_name.short_description = 'Location Name'
 
     list_display = ('name', 'dj_email', 'dj_name', 'location_name', 'start', 'end', 'is_live')
-    search_fields = ('name', 'dj_email', 'dj_name', 'location_name', 'start', 'end', 'is_live')
+    list_select_related = ('dj__djprofile', 'location')
+    list_filter = (LiveEventFilter,)
+    search_fields = ('name', 'dj__email', 'dj__djprofile__name', 'location__name')
     autocomplete_fields = ('dj', 'location')
 
     add_fieldsets = (
@@ -180,11 +222,35 @@ class EventAdmin(SoftDeletionModelAdmin):
         (None, {'fields': ('name', 'dj', 'location', 'start', 'end')}),
     )
 
+    def soft_delete_queryset(self, queryset):
+        super().soft_delete_queryset(queryset)
+        invalidate_live_events()
+
+
 @admin.register(Song)
 class SongAdmin(SoftDeletionModelAdmin):
-    list_display = ('artist', 'name', 'spotify_url', 'created_at')
+    list_display = ('artist', 'name', 'spotify_url', 'request_count', 'created_at')
     search_fields = ('artist', 'name', 'spotify_url')
 
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        track_id = parse_track_id(search_term)
+        if track_id:
+            # Any shape of Spotify link finds the song by its unique track id
+            return queryset.filter(spotify_id=track_id), False
+        if search_term.startswith(('http://', 'https://')):
+            return queryset.filter(spotify_url=search_term), False
+        return search_songs(search_term, queryset), False
+
+    def soft_delete_queryset(self, queryset):
+        spotify_ids = [spotify_id for spotify_id in queryset.values_list('spotify_id', flat=True) if spotify_id]
+        super().soft_delete_queryset(queryset)
+        # Like a save would, so song requests stop resolving to the deleted songs here
+        for spotify_id in spotify_ids:
+            song_ids.discard(spotify_id)
+
 @admin.register(SongRequest)
 class SongRequestAdmin(SoftDeletionModelAdmin):
     def song_name(self, obj):
@@ -202,5 +268,19 @@ class SongRequestAdmin(SoftDeletionModelAdmin):
     def event_name(self, obj):
         return obj.event.name
 
-    list_display = ('song', 'user', 'dj', 'event', 'status', 'last_status_timestamp')
-    search_fields = ('song_name', 'user_email', 'dj_email', 'dj_name', 'event_name')
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            invalidate_event_queues([obj.event_id])
+
+    def soft_delete_queryset(self, queryset):
+        # In one transaction, so the versions move with the rows
+        with transaction.atomic():
+            event_ids = set(queryset.values_list('event_id', flat=True))
+            super().soft_delete_queryset(queryset)
+            # Song requests leave the queues of their events without a signal
+            invalidate_event_queues(event_ids)
+
+    list_display = ('song', 'user', 'dj', 'event', 'status', 'votes', 'last_status_timestamp')
+    list_select_related = ('song', 'user', 'dj__djprofile', 'event')
+    search_fields = ('song__name', 'user__email', 'dj__email', 'dj__djprofile__name', 'event__name')
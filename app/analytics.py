@@ -0,0 +1,178 @@
+"""
+Per-event song request analytics.
+
+SongRequestRollup counts song requests per (event, song, status), EventSummary holds
+the per-status totals of an event and EventPlayDelay a histogram of the time from
+request to PLAYED. Counts are weighted by votes, so an open song request requested by
+three users counts three times. They are updated incrementally, with one upsert per table and batch,
+whenever song requests are created or change state, so the dashboard reads below only
+touch the rollups. `manage.py rebuild_analytics` recomputes the rollups from the
+active song requests if they drift, and drops soft-deleted song requests.
+"""
+import bisect
+from collections import Counter, defaultdict
+
+from django.apps import apps as global_apps
+from django.db import transaction
+from django.db.models import F, Sum
+from django.dispatch import receiver
+
+# Imported first so its receivers, which lock the events of a write, run before the ones below
+from app import queue  # noqa: F401
+from app.models import EventPlayDelay, EventSummary, SongRequest, SongRequestRollup
+from app.signals import song_requests_created, song_requests_status_changed
+from app.utils import increment_counters
+
+# Upper bounds in seconds of the play delay buckets; the last bucket holds everything slower
+PLAY_DELAY_BUCKETS = (60, 120, 300, 600, 900, 1200, 1800, 2700, 3600, 5400, 7200, 10800, 21600)
+
+
+def play_delay_bucket(seconds):
+    return bisect.bisect_left(PLAY_DELAY_BUCKETS, seconds)
+
+
+def play_delay(song_request):
+    return max(0.0, (song_request.last_status_timestamp - song_request.created_at).total_seconds())
+
+
+def apply_changes(song_requests, previous_statuses=None, votes=None):
+    """
+    Update the rollups for the `votes` song requests gained, or for ones that moved from
+    `previous_statuses`. Every rollup table takes a single upsert, however many song requests changed.
+    """
+    status_fields = [status.lower() for status, _ in SongRequest.STATUS_CHOICES]
+    rollups = Counter()
+    summaries = defaultdict(lambda: Counter(dict.fromkeys(['total', 'played_seconds', *status_fields], 0)))
+    delays = Counter()
+    for song_request in song_requests:
+        event_id, song_id, status = song_request.event_id, song_request.song_id, song_request.status
+        # Created song requests count the votes they gained; a status change moves all their votes
+        weight = votes[song_request.id] if previous_statuses is None else song_request.votes
+        rollups[event_id, song_id, status] += weight
+        summaries[event_id][status.lower()] += weight
+        if previous_statuses is None:
+            summaries[event_id]['total'] += weight
+        else:
+            previous = previous_statuses[song_request.id]
+            rollups[event_id, song_id, previous] -= weight
+            summaries[event_id][previous.lower()] -= weight
+        if status == SongRequest.PLAYED:
+            seconds = play_delay(song_request)
+            summaries[event_id]['played_seconds'] += seconds * weight
+            delays[event_id, play_delay_bucket(seconds)] += weight
+
+    increment_counters(SongRequestRollup, ('event', 'song', 'status'), [
+        {'event_id': event_id, 'song_id': song_id, 'status': status, 'count': count}
+        for (event_id, song_id, status), count in rollups.items()
+    ])
+    increment_counters(EventSummary, ('event',), [
+        {'event_id': event_id, **counts, 'updated_at': None} for event_id, counts in summaries.items()
+    ], overwrite_fields=('updated_at',))
+    increment_counters(EventPlayDelay, ('event', 'bucket'), [
+        {'event_id': event_id, 'bucket': bucket, 'count': count} for (event_id, bucket), count in delays.items()
+    ])
+
+
+@receiver(song_requests_created, sender=SongRequest)
+def song_requests_created_handler(sender, instances, votes, **kwargs):
+    apply_changes(instances, votes=votes)
+
+
+@receiver(song_requests_status_changed, sender=SongRequest)
+def song_requests_status_changed_handler(sender, instances, previous_statuses, **kwargs):
+    apply_changes(instances, previous_statuses)
+
+
+def rebuild(event_ids, apps=global_apps):
+    """
+    Recompute the rollups of `event_ids` from their song requests, in one transaction. Migrations
+    pass their historical `apps`.
+
+    The events are locked FOR UPDATE first. Song request writes lock their events in the queue
+    receivers, which run before the ones above increment the rollups, so no write can change
+    the rollups of these events until the rebuild commits, and the song requests it reads are final.
+    """
+    Event, SongRequest, SongRequestRollup, EventSummary, EventPlayDelay = (
+        apps.get_model('app', name)
+        for name in ('Event', 'SongRequest', 'SongRequestRollup', 'EventSummary', 'EventPlayDelay')
+    )
+    event_ids = sorted(set(event_ids))
+    song_requests = SongRequest._base_manager.filter(event_id__in=event_ids, is_active=True)
+    summaries = {event_id: EventSummary(event_id=event_id) for event_id in event_ids}
+
+    with transaction.atomic():
+        list(Event._base_manager.select_for_update().filter(id__in=event_ids).order_by('id').values_list('id'))
+        for model in (SongRequestRollup, EventSummary, EventPlayDelay):
+            model.objects.filter(event_id__in=event_ids).delete()
+
+        rollups = []
+        for row in song_requests.values('event_id', 'song_id', 'status').annotate(count=Sum('votes')).order_by():
+            rollups.append(SongRequestRollup(**row))
+            summary = summaries[row['event_id']]
+            summary.total += row['count']
+            status = row['status'].lower()
+            setattr(summary, status, getattr(summary, status) + row['count'])
+
+        delays = Counter()
+        # Historical models have no status constants
+        played = song_requests.filter(status='PLAYED').values_list(
+            'event_id', 'created_at', 'last_status_timestamp', 'votes',
+        )
+        for event_id, created_at, played_at, votes in played.iterator():
+            seconds = max(0.0, (played_at - created_at).total_seconds())
+            summaries[event_id].played_seconds += seconds * votes
+            delays[event_id, play_delay_bucket(seconds)] += votes
+
+        SongRequestRollup.objects.bulk_create(rollups)
+        EventSummary.objects.bulk_create(summaries.values())
+        EventPlayDelay.objects.bulk_create([
+            EventPlayDelay(event_id=event_id, bucket=bucket, count=count)
+            for (event_id, bucket), count in delays.items()
+        ])
+
+
+def event_stats(event_id):
+    """
+    Song request totals per status of an event, with the median and mean time from request to PLAYED.
+    The median is interpolated inside its histogram bucket.
+    """
+    summary = EventSummary.objects.filter(event_id=event_id).first() or EventSummary(event_id=event_id)
+    buckets = dict(EventPlayDelay.objects.filter(event_id=event_id).values_list('bucket', 'count'))
+    return {
+        'total': summary.total,
+        'statuses': {status: getattr(summary, status.lower()) for status, _ in SongRequest.STATUS_CHOICES},
+        'seconds_to_played': {
+            'median': histogram_median(buckets),
+            'mean': summary.played_seconds / summary.played if summary.played else None,
+        },
+    }
+
+
+def histogram_median(buckets):
+    total = sum(buckets.values())
+    if not total:
+        return None
+    seen = 0
+    for bucket in range(len(PLAY_DELAY_BUCKETS) + 1):
+        count = buckets.get(bucket, 0)
+        if count and seen + count >= total / 2:
+            lower = PLAY_DELAY_BUCKETS[bucket - 1] if bucket else 0
+            if bucket == len(PLAY_DELAY_BUCKETS):
+                return float(lower)
+            return lower + (PLAY_DELAY_BUCKETS[bucket] - lower) * (total / 2 - seen) / count
+        seen += count
+
+
+def top_songs(event_id, limit=10, status=None):
+    """
+    The most requested songs of an event, optionally only counting song requests in `status`.
+    """
+    rollups = SongRequestRollup.objects.filter(event_id=event_id)
+    if status is not None:
+        rollups = rollups.filter(status=status)
+    return list(
+        rollups.values('song_id', name=F('song__name'), artist=F('song__artist'))
+        .annotate(requests=Sum('count'))
+        .filter(requests__gt=0)
+        .order_by('-requests', 'name')[:limit]
+    )
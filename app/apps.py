@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app'
+
+    def ready(self):
+        # Connect the signal receivers that keep the read models up to date, and register the checks
+        from app import analytics, authentication, checks, hub, live, queue, search, songs  # noqa: F401
@@ -0,0 +1,284 @@
+"""
+Archival of soft-deleted rows and of the song requests of finished events.
+
+Soft-deleted rows stay in their tables and in every index that is not partial on
+is_active, and the song requests of past events are never read again but by the
+analytics rollups, which are kept. Both are moved into ArchivedRow, serialized, and can
+be restored exactly as they were. A row is only archived once nothing else references
+it, apart from the rows archived along with it in DEPENDENTS, so song requests go
+first, then events, and only then their locations and songs. Custom users are left
+alone, as their is_active is the login flag too.
+
+Every batch moves in its own transaction and rows are picked by their current state,
+so an interrupted run loses nothing and the next run carries on where it stopped.
+"""
+from collections import Counter, defaultdict
+
+from django.apps import apps
+from django.core import serializers
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from app.models import (
+    ArchivedRow, DjProfile, Event, EventPlayDelay, EventSummary, Location, Song, SongRequest, SongRequestRollup,
+    SongRequestVote,
+)
+from app.queue import invalidate_event_queues
+
+# Archived in this order, so the rows referencing a row are archived before it
+ARCHIVED_MODELS = (SongRequest, Event, DjProfile, Location, Song)
+
+# Rows that are archived and restored with the row they reference, through the given field
+DEPENDENTS = {
+    SongRequest: ((SongRequestVote, 'song_request'),),
+    Event: ((EventSummary, 'event'), (EventPlayDelay, 'event'), (SongRequestRollup, 'event')),
+}
+
+
+def archivable(model, finished_before):
+    """
+    Rows of `model` that can be archived: soft-deleted ones, and for song requests the ones
+    of events that ended before `finished_before`, unless a row outside DEPENDENTS references them.
+    """
+    condition = Q(is_active=False)
+    if model is SongRequest:
+        condition |= Q(event__end__lt=finished_before)
+    rows = model._base_manager.filter(condition)
+
+    dependents = {dependent for dependent, _ in DEPENDENTS.get(model, ())}
+    for relation in model._meta.get_fields(include_hidden=True):
+        if not relation.auto_created or relation.concrete or relation.many_to_many:
+            continue
+        if relation.related_model in dependents:
+            continue
+        referencing = relation.related_model._base_manager.filter(**{relation.field.name: OuterRef('pk')})
+        rows = rows.exclude(Exists(referencing))
+    return rows
+
+
+def row_event_id(instance):
+    if isinstance(instance, Event):
+        return instance.pk
+    return getattr(instance, 'event_id', None)
+
+
+def archive_rows(model, rows):
+    """
+    Move `rows` of `model` and their DEPENDENTS into ArchivedRow, in one transaction.
+    Returns the number of rows archived per model label.
+    """
+    archived = Counter()
+    with transaction.atomic():
+        # Locked and checked again, as the rows may have changed since they were picked
+        rows = list(rows.select_for_update(of=('self',)))
+        if not rows:
+            return archived
+        pks = [row.pk for row in rows]
+        events = {row.pk: row_event_id(row) for row in rows}
+
+        archive = []
+        for dependent, field_name in DEPENDENTS.get(model, ()):
+            field = dependent._meta.get_field(field_name)
+            dependent_rows = list(dependent._base_manager.filter(**{f'{field_name}__in': pks}))
+            archive += [(row, events[getattr(row, field.attname)]) for row in dependent_rows]
+        archive += [(row, events[row.pk]) for row in rows]
+
+        ArchivedRow.objects.bulk_create([
+            ArchivedRow(
+                model=row._meta.label_lower,
+                object_id=row.pk,
+                event_id=event_id,
+                data=serializers.serialize('python', [row])[0],
+            )
+            for row, event_id in archive
+        ])
+        for dependent, field_name in DEPENDENTS.get(model, ()):
+            dependent._base_manager.filter(**{f'{field_name}__in': pks}).delete()
+        model._base_manager.filter(pk__in=pks).delete()
+        if model is SongRequest:
+            invalidate_event_queues(set(events.values()))
+
+    archived.update(row._meta.label_lower for row, _ in archive)
+    return archived
+
+
+def archive(model, finished_before=None, batch_size=500, max_batches=None):
+    """
+    Archive the archivable rows of `model` in batches of `batch_size`, at most `max_batches` of them.
+    Returns the number of rows archived per model label.
+    """
+    finished_before = finished_before or timezone.now()
+    candidates = archivable(model, finished_before).order_by('pk')
+    archived = Counter()
+    last_pk = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        pks = list(candidates.filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+        last_pk = pks[-1]
+        archived += archive_rows(model, archivable(model, finished_before).filter(pk__in=pks))
+        batches += 1
+    return archived
+
+
+def insert_as_archived(model, instances):
+    """
+    Insert `instances` with the values they were archived with. The insert sets auto_now and
+    auto_now_add fields to the current time, so they are written back after it.
+    """
+    timestamp_fields = [
+        field for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    timestamps = [[getattr(instance, field.attname) for field in timestamp_fields] for instance in instances]
+    model._base_manager.bulk_create(instances)
+    if timestamp_fields:
+        for instance, values in zip(instances, timestamps):
+            for field, value in zip(timestamp_fields, values):
+                setattr(instance, field.attname, value)
+        model._base_manager.bulk_update(instances, [field.name for field in timestamp_fields])
+
+
+def insert_restorable(model, instances):
+    """
+    Insert `instances` as insert_as_archived does, skipping the ones that conflict with a live row
+    under a unique constraint, like a song request open for the same song at the same event.
+    Returns the instances inserted.
+    """
+    try:
+        with transaction.atomic():
+            insert_as_archived(model, instances)
+        return instances
+    except IntegrityError:
+        pass
+    # One by one, only once the batch failed
+    inserted = []
+    for instance in instances:
+        try:
+            with transaction.atomic():
+                insert_as_archived(model, [instance])
+        except IntegrityError:
+            continue
+        inserted.append(instance)
+    return inserted
+
+
+def restore_rows(archived_rows):
+    """
+    Put `archived_rows` back into their tables, together with the archived rows they reference
+    and their DEPENDENTS, in one transaction. A row that conflicts with a live row stays archived,
+    and so do the rows referencing it. Returns the number of rows restored per model label, and
+    the (model label, object id) of the rows skipped.
+    """
+    restored = Counter()
+    skipped = set()
+    with transaction.atomic():
+        archived_rows = list(
+            ArchivedRow.objects.select_for_update().filter(pk__in=[row.pk for row in archived_rows]).order_by('pk')
+        )
+        objects = [deserialized.object for deserialized in serializers.deserialize(
+            'python', [row.data for row in archived_rows], ignorenonexistent=True,
+        )]
+
+        # Rows referenced by the restored ones come back first
+        parents = defaultdict(set)
+        for instance in objects:
+            for field in instance._meta.concrete_fields:
+                if field.is_relation and getattr(instance, field.attname) is not None:
+                    parents[field.related_model._meta.label_lower].add(getattr(instance, field.attname))
+        # Parents that stay archived keep the rows referencing them out too
+        unrestored = set()
+        for label, pks in parents.items():
+            parent_rows = list(ArchivedRow.objects.filter(model=label, object_id__in=pks))
+            if parent_rows:
+                parent_restored, parent_skipped = restore_rows(parent_rows)
+                restored += parent_restored
+                skipped |= parent_skipped
+                unrestored.update(
+                    ArchivedRow.objects.filter(model=label, object_id__in=pks).values_list('model', 'object_id')
+                )
+
+        by_model = defaultdict(list)
+        for instance in objects:
+            references = {
+                (field.related_model._meta.label_lower, getattr(instance, field.attname))
+                for field in instance._meta.concrete_fields if field.is_relation
+            }
+            if references & unrestored:
+                skipped.add((instance._meta.label_lower, instance.pk))
+            else:
+                by_model[type(instance)].append(instance)
+        inserted = set()
+        for model, instances in by_model.items():
+            by_model[model] = insert_restorable(model, instances)
+            restored[model._meta.label_lower] += len(by_model[model])
+            keys = {(model._meta.label_lower, instance.pk) for instance in instances}
+            inserted.update((model._meta.label_lower, instance.pk) for instance in by_model[model])
+            skipped |= keys - inserted
+        if by_model.get(SongRequest):
+            invalidate_event_queues({song_request.event_id for song_request in by_model[SongRequest]})
+        ArchivedRow.objects.filter(
+            pk__in=[row.pk for row in archived_rows if (row.model, row.object_id) in inserted],
+        ).delete()
+
+        for model, instances in by_model.items():
+            if not instances:
+                continue
+            for dependent, field_name in DEPENDENTS.get(model, ()):
+                # A dependent keyed by its relation, like EventSummary, is serialized with it as its pk
+                if dependent._meta.get_field(field_name).primary_key:
+                    lookup = 'object_id'
+                else:
+                    lookup = f'data__fields__{field_name}'
+                dependent_rows = list(ArchivedRow.objects.filter(**{
+                    'model': dependent._meta.label_lower,
+                    f'{lookup}__in': [instance.pk for instance in instances],
+                }))
+                if dependent_rows:
+                    dependent_restored, dependent_skipped = restore_rows(dependent_rows)
+                    restored += dependent_restored
+                    skipped |= dependent_skipped
+    return restored, skipped
+
+
+def restore(archived_rows, batch_size=500, max_batches=None):
+    """
+    Restore the ArchivedRow queryset `archived_rows` in batches, referenced rows before the rows
+    referencing them. Returns the number of rows restored and the number skipped, per model label.
+    """
+    order = [model._meta.label_lower for model in reversed(ARCHIVED_MODELS)]
+    order += [dependent._meta.label_lower for dependents in DEPENDENTS.values() for dependent, _ in dependents]
+    labels = sorted(
+        archived_rows.values_list('model', flat=True).distinct(),
+        key=lambda label: order.index(label) if label in order else len(order),
+    )
+
+    restored = Counter()
+    skipped = set()
+    batches = 0
+    for label in labels:
+        last_pk = 0
+        while max_batches is None or batches < max_batches:
+            rows = list(archived_rows.filter(model=label, pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1].pk
+            batch_restored, batch_skipped = restore_rows(rows)
+            restored += batch_restored
+            skipped |= batch_skipped
+            batches += 1
+    return restored, Counter(label for label, _ in skipped)
+
+
+def get_archived_model(label):
+    """
+    The archived model of `label` ('app.songrequest' or 'songrequest'), or None.
+    """
+    app_label, _, model_name = label.lower().rpartition('.')
+    try:
+        model = apps.get_model(app_label or 'app', model_name)
+    except LookupError:
+        return None
+    return model if model in ARCHIVED_MODELS else None
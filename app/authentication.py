@@ -0,0 +1,119 @@
+"""
+Token authentication backed by a short-lived cached snapshot of the token's user and role.
+
+A snapshot holds the user columns the API needs plus the DJ profile id and name, so an
+authenticated request makes no queries while the snapshot is cached. Snapshots are
+dropped by the signals of the changes that matter: the token is deleted, the user is
+saved or soft deleted in the admin, or the user's DJ profile changes. A change made
+without a signal, or one that another worker's per-process cache misses, is only seen
+once the snapshot expires, so TOKEN_CACHE_TIMEOUT bounds how long a deleted token or a
+deactivated user is still accepted. Use a shared TOKEN_CACHE to drop snapshots in every
+worker at once.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from app.models import CustomUser, DjProfile
+
+SNAPSHOT_FIELDS = ('id', 'email', 'name', 'is_active', 'is_staff', 'is_superuser')
+
+
+def token_cache():
+    return caches[getattr(settings, 'TOKEN_CACHE', 'default')]
+
+
+def token_timeout():
+    return getattr(settings, 'TOKEN_CACHE_TIMEOUT', 30)
+
+
+def token_key(key):
+    return f'auth_token:{key}'
+
+
+def user_token_key(user_id):
+    return f'auth_user_token:{user_id}'
+
+
+def from_columns(model, columns):
+    """
+    Build a model instance from a subset of its columns; the remaining columns are deferred.
+    """
+    field_names = [field.attname for field in model._meta.concrete_fields if field.attname in columns]
+    return model.from_db('default', field_names, [columns[name] for name in field_names])
+
+
+def user_snapshot(user):
+    snapshot = {field: getattr(user, field) for field in SNAPSHOT_FIELDS}
+    try:
+        snapshot['djprofile'] = {'id': user.djprofile.id, 'name': user.djprofile.name}
+    except DjProfile.DoesNotExist:
+        snapshot['djprofile'] = None
+    return snapshot
+
+
+def snapshot_user(snapshot):
+    """
+    Build a user from a snapshot without touching the database.
+    Columns outside the snapshot are deferred, so saving the user only writes what it holds.
+    """
+    user = from_columns(CustomUser, {field: snapshot[field] for field in SNAPSHOT_FIELDS})
+    profile = None
+    if snapshot['djprofile'] is not None:
+        profile = from_columns(DjProfile, dict(snapshot['djprofile'], user_id=user.id))
+        DjProfile.user.field.set_cached_value(profile, user)
+    # Caching the reverse relation lets is_dj answer without a query, also when there is no profile
+    CustomUser.djprofile.related.set_cached_value(user, profile)
+    return user
+
+
+def invalidate_user_tokens(user_ids):
+    cache = token_cache()
+    user_keys = [user_token_key(user_id) for user_id in user_ids]
+    keys = cache.get_many(user_keys)
+    cache.delete_many([token_key(key) for key in keys.values()] + user_keys)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication that resolves the token from a cached user and role snapshot.
+    """
+    def authenticate_credentials(self, key):
+        cache = token_cache()
+        snapshot = cache.get(token_key(key))
+        if snapshot is None:
+            try:
+                token = Token.objects.select_related('user__djprofile').get(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            snapshot = user_snapshot(token.user)
+            cache.set_many({token_key(key): snapshot, user_token_key(token.user_id): key}, token_timeout())
+
+        if not snapshot['is_active']:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        user = snapshot_user(snapshot)
+        token = from_columns(Token, {'key': key, 'user_id': user.id})
+        Token.user.field.set_cached_value(token, user)
+        return (user, token)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted_handler(sender, instance, **kwargs):
+    token_cache().delete_many([token_key(instance.key), user_token_key(instance.user_id)])
+
+
+@receiver(post_save, sender=CustomUser)
+def user_saved_handler(sender, instance, **kwargs):
+    invalidate_user_tokens([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=DjProfile)
+def djprofile_changed_handler(sender, instance, **kwargs):
+    if instance.user_id is not None:
+        invalidate_user_tokens([instance.user_id])
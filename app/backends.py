@@ -1,15 +1,121 @@
-from django.contrib.auth.backends import ModelBackend
+"""
+Email and password authentication in a single pass.
+
+The user is looked up once and the password hashed at most once per attempt. Pairs of
+email and password that failed recently are answered from a bounded in-process cache
+without hashing, and accounts that keep failing back off exponentially, through
+LOGIN_BACKOFF_CACHE. Failures are counted with atomic cache increments, so the cache
+must be shared by the workers for concurrent attempts to all count. Successful logins
+upgrade the stored hash to the first of PASSWORD_HASHERS.
+"""
+import hashlib
+import time
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.cache import caches
+from django.core.exceptions import PermissionDenied
+from django.utils.crypto import salted_hmac
+
+from app.utils import LRUCache
+
+failed_logins = LRUCache(getattr(settings, 'FAILED_LOGIN_CACHE_SIZE', 10000))
+
+
+def get_cache():
+    return caches[getattr(settings, 'LOGIN_BACKOFF_CACHE', 'default')]
+
+
+def backoff_keys(email):
+    """
+    Return the keys of the failure count and of the time the backoff of `email` ends.
+    """
+    digest = hashlib.sha256(email.lower().encode()).hexdigest()
+    return f'login_failures:{digest}', f'login_backoff:{digest}'
+
+
+def login_backoff(email):
+    """
+    Return the seconds `email` must wait before its next login attempt, or 0.
+    """
+    until = get_cache().get(backoff_keys(email)[1])
+    return max(0, until - time.time()) if until else 0
+
+
+def record_login_failure(email):
+    cache = get_cache()
+    failures_key, backoff_key = backoff_keys(email)
+    max_seconds = getattr(settings, 'LOGIN_BACKOFF_MAX_SECONDS', 900)
+    # add and incr are atomic, so concurrent failures all count, unlike a get and a set
+    cache.add(failures_key, 0, max_seconds)
+    try:
+        failures = cache.incr(failures_key)
+    except ValueError:
+        # Expired between the add and the incr
+        cache.add(failures_key, 1, max_seconds)
+        failures = 1
+    over = failures - getattr(settings, 'LOGIN_BACKOFF_FREE_ATTEMPTS', 5)
+    if over > 0:
+        seconds = min(2 ** (over - 1), max_seconds)
+        cache.set(backoff_key, time.time() + seconds, seconds)
+
+
+def clear_login_failures(email):
+    get_cache().delete_many(backoff_keys(email))
+
+
+def verify_login(user, email, password):
+    """
+    Check `password` for `user`, which is None for unknown emails, hashing at most once.
+    Returns (verified, upgraded); upgraded means user.password was rehashed and must be saved.
+    """
+    encoded = user.password if user is not None else ''
+    # Keyed on the stored hash too, so a password change forgets the failures
+    key = salted_hmac('app.backends.verify_login', f'{email}\0{password}\0{encoded}').hexdigest()
+    expires = failed_logins.get(key)
+    if expires is not None and expires > time.monotonic():
+        record_login_failure(email)
+        return False, False
+
+    upgraded = False
+
+    def upgrade(raw_password):
+        nonlocal upgraded
+        user.set_password(raw_password)
+        upgraded = True
+
+    if user is None:
+        # Hash anyway so unknown emails take as long as wrong passwords
+        make_password(password)
+        verified = False
+    else:
+        verified = check_password(password, encoded, setter=upgrade)
+    if verified:
+        clear_login_failures(email)
+        return True, upgraded
+
+    failed_logins.set(key, time.monotonic() + getattr(settings, 'FAILED_LOGIN_CACHE_SECONDS', 300))
+    record_login_failure(email)
+    return False, False
+
 
 class EmailBackend(ModelBackend):
-    def authenticate(self, request, email=None, password=None, **kwargs):
+    def authenticate(self, request, email=None, password=None, username=None, **kwargs):
         UserModel = get_user_model()
-        try:
-            user = UserModel.objects.get(email=email)
-        except UserModel.DoesNotExist:
+        email = email or username or kwargs.get(UserModel.USERNAME_FIELD)
+        if email is None or password is None:
             return None
+        if login_backoff(email):
+            # Stops the other backends too, without hashing
+            raise PermissionDenied
 
-        if user.check_password(password):
+        user = UserModel._default_manager.filter(email=email).first()
+        verified, upgraded = verify_login(user, email, password)
+        if upgraded:
+            user.save(update_fields=['password'])
+        if verified and self.user_can_authenticate(user):
             return user
 
     def get_user(self, user_id):
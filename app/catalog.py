@@ -0,0 +1,170 @@
+"""
+Streaming bulk import of song catalogs.
+
+Catalogs are read a row at a time from CSV or JSON Lines, so memory stays flat whatever
+their size. Every row is checked against Song's field rules and keyed on its canonical
+Spotify track id, as app.songs does for single songs, and the valid rows are upserted in
+chunks: on PostgreSQL a chunk is COPYed into a temporary table and merged with one
+INSERT ... ON CONFLICT, elsewhere it is one bulk_create with update_conflicts. Each
+chunk is its own transaction and upserting a row twice leaves it as it was, so an
+interrupted import is safely run again, from the start or from where it stopped.
+"""
+import csv
+import io
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+
+from app.models import Song
+from app.renderers import loads
+from app.search import invalidate_fallback_index
+from app.songs import canonical_song_data
+from app.utils import sanitize_fields
+
+FORMATS = ('csv', 'jsonl')
+# Taken from the catalog; the other columns keep their defaults on insert and their values on update
+IMPORTED_FIELDS = ('spotify_id', 'spotify_url', 'artist', 'name', 'image_url')
+
+
+def read_csv(file):
+    """
+    Yield (line number, row) for the rows of a CSV file with a header line.
+    """
+    reader = csv.DictReader(file)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_jsonl(file):
+    """
+    Yield (line number, row) for the non-blank lines of a JSON Lines file.
+    Lines that are not JSON yield None, which validate_song_row rejects.
+    """
+    for line_number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, loads(line)
+        except ValueError:
+            yield line_number, None
+
+
+def read_catalog(file, format):
+    return read_csv(file) if format == 'csv' else read_jsonl(file)
+
+
+def validate_song_row(row):
+    """
+    Build an unsaved Song from a catalog row, or raise ValidationError with what is wrong with it.
+    """
+    if not isinstance(row, dict):
+        raise ValidationError('Expected an object with spotify_url, artist, name and image_url.')
+    # JSON Lines values can be of any JSON type, which Song's fields would turn into strings
+    wrong_types = {
+        name: 'Enter a string.' for name in IMPORTED_FIELDS[2:]
+        if row.get(name) is not None and not isinstance(row[name], str)
+    }
+    if wrong_types:
+        raise ValidationError(wrong_types)
+    data = canonical_song_data({name: row[name] for name in IMPORTED_FIELDS if name in row})
+    song = Song(**sanitize_fields(data, Song), spotify_id=data['spotify_id'])
+    # Uniqueness is what the upsert resolves, so only the field rules are checked here,
+    # and the canonical URL is built from a parsed track id, so it is valid already
+    song.clean_fields(exclude=['spotify_id', 'spotify_url'])
+    return song
+
+
+def copy_upsert_sql(connection):
+    """
+    The SQL copy_upsert_songs runs on `connection`: the statements creating the song_import
+    staging table, the COPY filling it from song_import_csv(), and the statement merging it
+    into the song table, with the parameters of the latter.
+    """
+    quote = connection.ops.quote_name
+    table = quote(Song._meta.db_table)
+    imported = [Song._meta.get_field(name) for name in IMPORTED_FIELDS]
+    defaulted = [
+        field for field in Song._meta.concrete_fields if not field.primary_key and field.name not in IMPORTED_FIELDS
+    ]
+    template = Song()
+    defaults = [field.get_db_prep_save(field.pre_save(template, True), connection) for field in defaulted]
+
+    columns = ', '.join(quote(field.column) for field in imported)
+    updated = ', '.join(f'{quote(field.column)} = EXCLUDED.{quote(field.column)}' for field in imported[1:])
+    changed = (
+        f'({", ".join(f"{table}.{quote(field.column)}" for field in imported[1:])}) IS DISTINCT FROM '
+        f'({", ".join(f"EXCLUDED.{quote(field.column)}" for field in imported[1:])})'
+    )
+    definitions = ', '.join(f'{quote(field.column)} {field.db_type(connection)}' for field in imported)
+    setup = [
+        # Left over when an outer transaction holds the previous chunk
+        'DROP TABLE IF EXISTS pg_temp.song_import',
+        f'CREATE TEMPORARY TABLE song_import ({definitions}) ON COMMIT DROP',
+    ]
+    copy = f'COPY song_import ({columns}) FROM STDIN WITH (FORMAT csv)'
+    merge = (
+        f'INSERT INTO {table} ({columns}, {", ".join(quote(field.column) for field in defaulted)}) '
+        f'SELECT {columns}, {", ".join(["%s"] * len(defaulted))} FROM song_import '
+        f'ON CONFLICT ({quote("spotify_id")}) DO UPDATE SET {updated} WHERE {changed}'
+    )
+    return setup, copy, merge, defaults
+
+
+def song_import_csv(songs):
+    """
+    `songs` as the CSV file the COPY of copy_upsert_sql() reads, one row of IMPORTED_FIELDS per song.
+    """
+    imported = [Song._meta.get_field(name) for name in IMPORTED_FIELDS]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for song in songs:
+        writer.writerow([getattr(song, field.attname) for field in imported])
+    buffer.seek(0)
+    return buffer
+
+
+def copy_upsert_songs(songs):
+    """
+    Upsert `songs` by COPYing them into a temporary table and merging it in one statement.
+    PostgreSQL only. Rows that would not change are not rewritten.
+    """
+    setup, copy, merge, defaults = copy_upsert_sql(connection)
+    with connection.cursor() as cursor:
+        for sql in setup:
+            cursor.execute(sql)
+        cursor.copy_expert(copy, song_import_csv(songs))
+        cursor.execute(merge, defaults)
+
+
+def bulk_upsert_songs(songs):
+    Song.objects.bulk_create(
+        songs,
+        update_conflicts=True,
+        unique_fields=['spotify_id'],
+        update_fields=list(IMPORTED_FIELDS[1:]),
+    )
+
+
+def upsert_songs(songs):
+    """
+    Insert or update `songs` on their Spotify track id, in one transaction. When a track
+    appears more than once the last row wins, as one statement cannot update a row twice.
+    Returns the number of distinct songs written.
+    """
+    songs = list({song.spotify_id: song for song in songs}.values())
+    if not songs:
+        return 0
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            copy_upsert_songs(songs)
+        else:
+            bulk_upsert_songs(songs)
+    return len(songs)
+
+
+def catalog_imported():
+    """
+    Catch up the song caches that follow post_save, which bulk writes do not send.
+    Row ids are kept by updates, so only the search fallback index is affected.
+    """
+    invalidate_fallback_index()
@@ -0,0 +1,29 @@
+"""
+System checks of the cache settings, run by `manage.py check --deploy`.
+"""
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Caches whose entries every worker must see, by the setting naming them
+SHARED_CACHE_SETTINGS = {
+    'LOGIN_BACKOFF_CACHE': 'Failed logins are counted per worker, so an account backs off later than configured.',
+}
+PER_PROCESS_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_caches(app_configs, **kwargs):
+    warnings = []
+    for setting, consequence in SHARED_CACHE_SETTINGS.items():
+        alias = getattr(settings, setting, 'default')
+        backend = settings.CACHES.get(alias, {}).get('BACKEND')
+        if backend in PER_PROCESS_BACKENDS:
+            warnings.append(Warning(
+                f"{setting} names the cache '{alias}', which is not shared between processes.",
+                hint=f'{consequence} Use a shared backend such as Redis, memcached or the database cache.',
+                id='app.W001',
+            ))
+    return warnings
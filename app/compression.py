@@ -0,0 +1,85 @@
+"""
+Response compression negotiated on Accept-Encoding.
+
+Brotli is preferred where the client accepts it, as it packs the JSON payloads smaller
+than gzip at a similar cost at the quality used here; gzip is the fallback. Like
+Django's GZipMiddleware, short responses and responses with an encoding are left alone,
+and so are streaming ones: the server-sent event streams must reach the client event by
+event, and the image files are compressed already. Compressed responses get a weak
+ETag, which If-None-Match still matches.
+
+Only JSON is compressed. The HTML pages carry CSRF tokens next to text an attacker can put
+in the page, which BREACH recovers from the compressed sizes; brotli has no equivalent
+of the random gzip header bytes, so HTML and any response that used the CSRF token are
+sent uncompressed.
+"""
+import brotli
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_string
+
+
+def negotiate_encoding(header, encodings):
+    """
+    The encoding of `encodings` with the highest q-value in an Accept-Encoding `header`,
+    the first one on a tie, or None if none is acceptable.
+    """
+    accepted = {}
+    for item in header.split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding:
+            accepted[coding.lower()] = q
+
+    chosen, chosen_q = None, 0.0
+    for encoding in encodings:
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > chosen_q:
+            chosen, chosen_q = encoding, q
+    return chosen
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    # In order of preference
+    ENCODINGS = ('br', 'gzip')
+    MIN_LENGTH = 200
+    # Brotli's default of 11 is meant for static files; 5 compresses about as fast as gzip
+    BROTLI_QUALITY = 5
+    # Random bytes in the gzip header, as in GZipMiddleware, against BREACH
+    GZIP_MAX_RANDOM_BYTES = 100
+    COMPRESSED_TYPES = ('application/json',)
+
+    def process_response(self, request, response):
+        if response.streaming or len(response.content) < self.MIN_LENGTH:
+            return response
+        if response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '').partition(';')[0].strip().lower()
+        if content_type not in self.COMPRESSED_TYPES or request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding', ''), self.ENCODINGS)
+        if encoding == 'br':
+            content = brotli.compress(response.content, quality=self.BROTLI_QUALITY)
+        elif encoding == 'gzip':
+            content = compress_string(response.content, max_random_bytes=self.GZIP_MAX_RANDOM_BYTES)
+        else:
+            return response
+        if len(content) >= len(response.content):
+            return response
+
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
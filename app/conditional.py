@@ -0,0 +1,52 @@
+"""
+Conditional GETs on cheap version markers.
+
+The event, DJ profile and queue endpoints tag their responses with an ETag and a
+Last-Modified derived from a version marker instead of from the payload: the updated_at
+of the rows an event or a profile is rendered from, or for a queue the queue_updated_at
+of its event, read with one primary key lookup. A request whose
+If-None-Match or If-Modified-Since still holds is answered 304 before the payload is
+queried or serialized.
+"""
+import datetime
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from app.models import DjProfile, Event
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def make_etag(kind, pk, version):
+    return f'"{kind}-{pk}-{(version - EPOCH) // datetime.timedelta(microseconds=1)}"'
+
+
+def event_version(event_id):
+    """
+    When an event or its location last changed, or None if the event does not exist.
+    """
+    row = Event.objects.filter(id=event_id).values_list('updated_at', 'location__updated_at').first()
+    return max(row) if row else None
+
+
+def dj_profile_version(dj_id):
+    """
+    When the profile of a DJ last changed, or None if the user has no profile.
+    """
+    return DjProfile.objects.filter(user_id=dj_id).values_list('updated_at', flat=True).first()
+
+
+def not_modified(request, etag, version):
+    """
+    The 304 (or 412) response if the preconditions of `request` hold for `etag` and `version`, else None.
+    Last-Modified has a resolution of a second, so clients should prefer the ETag.
+    """
+    return get_conditional_response(request, etag=etag, last_modified=int(version.timestamp()))
+
+
+def add_validators(response, etag, version, cache_control):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(version.timestamp())
+    response['Cache-Control'] = cache_control
+    return response
@@ -0,0 +1,104 @@
+"""
+Geohash helpers for finding locations near a point.
+
+Locations store the geohash of their coordinates in an indexed column. A radius
+search covers its bounding box with at most four geohash cells, so the database
+only scans the rows under those prefixes, and exact distances are computed for
+the few candidates left.
+"""
+import math
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+EARTH_RADIUS_KM = 6371.0088
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(geohash) < precision:
+        value_range, value = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (value_range[0] + value_range[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            value_range[0] = middle
+        else:
+            value_range[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(geohash)
+
+
+def cell_size(precision):
+    """
+    Return the (latitude, longitude) size in degrees of a geohash cell.
+    """
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def haversine_km(latitude1, longitude1, latitude2, longitude2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (latitude1, longitude1, latitude2, longitude2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """
+    Return (min_lat, max_lat, min_lon, max_lon) around a point; longitudes are not wrapped.
+    """
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = max(latitude - lat_delta, -90.0), min(latitude + lat_delta, 90.0)
+    if min_lat == -90.0 or max_lat == 90.0:
+        return min_lat, max_lat, -180.0, 180.0
+    lon_delta = math.degrees(radius_km / (EARTH_RADIUS_KM * math.cos(math.radians(max(abs(min_lat), abs(max_lat))))))
+    if lon_delta >= 180.0:
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, longitude - lon_delta, longitude + lon_delta
+
+
+def wrap_longitude(longitude):
+    return (longitude + 180.0) % 360.0 - 180.0
+
+
+def covering_prefixes(box):
+    """
+    Return at most four geohash prefixes whose cells cover the bounding box.
+    The precision is the finest one whose cells are at least as large as the box,
+    so the box touches at most two cells on each axis, all of them at its corners.
+    """
+    min_lat, max_lat, min_lon, max_lon = box
+    precision = 0
+    while precision < GEOHASH_PRECISION:
+        lat_size, lon_size = cell_size(precision + 1)
+        if lat_size < max_lat - min_lat or lon_size < max_lon - min_lon:
+            break
+        precision += 1
+    if precision == 0:
+        return []
+    return sorted({
+        encode_geohash(min(latitude, 90.0 - 1e-9), wrap_longitude(longitude), precision)
+        for latitude in (min_lat, max_lat)
+        for longitude in (min_lon, max_lon)
+    })
+
+
+def prefix_range(prefix):
+    """
+    Return the [start, stop) range of geohashes under a prefix.
+    A range lookup uses a plain b-tree index, unlike LIKE 'prefix%' on most databases.
+    """
+    stripped = prefix.rstrip(GEOHASH_ALPHABET[-1])
+    if not stripped:
+        return prefix, None
+    stop = stripped[:-1] + GEOHASH_ALPHABET[GEOHASH_ALPHABET.index(stripped[-1]) + 1]
+    return prefix, stop
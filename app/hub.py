@@ -0,0 +1,167 @@
+"""
+In-process pub/sub hub that fans song request changes out to DJ consoles.
+
+Messages are published from the song request signals once the surrounding
+transaction commits. Each event with subscribers keeps a bounded history so a
+reconnecting client can resume from its Last-Event-ID; when the history no longer
+covers that id, or the id comes from another process, the client is told to reset.
+The history of an event is dropped once it has had no subscribers for a while, so
+ended events are forgotten.
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.db import transaction
+from django.dispatch import receiver
+
+from app.models import SongRequest
+from app.signals import song_requests_created, song_requests_status_changed
+
+RESET = 'reset'
+CREATED = 'created'
+STATUS_CHANGED = 'status_changed'
+
+logger = logging.getLogger(__name__)
+
+
+class Subscriber:
+    def __init__(self, loop, max_size):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_size)
+
+    def deliver(self, message):
+        # Runs on the subscriber's event loop; a consumer that falls behind starts over
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait((None, RESET, {}))
+
+
+class SongRequestHub:
+    def __init__(self, history_size=500, subscriber_queue_size=1000, idle_seconds=60):
+        self.instance = uuid.uuid4().hex[:8]
+        self.history_size = history_size
+        self.subscriber_queue_size = subscriber_queue_size
+        self.idle_seconds = idle_seconds
+        self.lock = threading.Lock()
+        self.last_number = 0
+        # Only events with subscribers, or that had some within idle_seconds, keep a history
+        self.history = {}
+        # The message number after which each history is complete, so a client can resume from there
+        self.complete_after = {}
+        self.subscribers = defaultdict(set)
+        # Events without subscribers, by when their last subscriber left
+        self.idle_since = {}
+
+    def message_id(self, number):
+        return f'{self.instance}-{number}'
+
+    def parse_message_id(self, message_id):
+        instance, _, number = (message_id or '').partition('-')
+        if instance != self.instance or not number.isdigit():
+            return None
+        return int(number)
+
+    def prune(self):
+        # Called with the lock held
+        now = time.monotonic()
+        for event_id, since in list(self.idle_since.items()):
+            if now - since >= self.idle_seconds:
+                del self.idle_since[event_id], self.history[event_id], self.complete_after[event_id]
+
+    def publish(self, event_id, name, data):
+        with self.lock:
+            self.prune()
+            self.last_number += 1
+            history = self.history.get(event_id)
+            if history is None:
+                # Nobody follows the event, so nobody can resume from this message
+                return
+            if len(history) == history.maxlen:
+                self.complete_after[event_id] = history[0][0]
+            message = (self.message_id(self.last_number), name, data)
+            history.append((self.last_number,) + message)
+            subscribers = list(self.subscribers.get(event_id, ()))
+
+        for subscriber in subscribers:
+            subscriber.loop.call_soon_threadsafe(subscriber.deliver, message)
+
+    def subscribe(self, event_id, last_event_id=None):
+        """
+        Register a subscriber on the running loop; returns it with the messages it missed.
+        """
+        subscriber = Subscriber(asyncio.get_running_loop(), self.subscriber_queue_size)
+        with self.lock:
+            self.prune()
+            self.idle_since.pop(event_id, None)
+            if event_id not in self.history:
+                self.history[event_id] = deque(maxlen=self.history_size)
+                self.complete_after[event_id] = self.last_number
+            self.subscribers[event_id].add(subscriber)
+            if not last_event_id:
+                return subscriber, []
+
+            last_number = self.parse_message_id(last_event_id)
+            if last_number is None or last_number < self.complete_after[event_id]:
+                return subscriber, [(None, RESET, {})]
+            return subscriber, [entry[1:] for entry in self.history[event_id] if entry[0] > last_number]
+
+    def unsubscribe(self, event_id, subscriber):
+        with self.lock:
+            self.subscribers[event_id].discard(subscriber)
+            if not self.subscribers[event_id]:
+                del self.subscribers[event_id]
+                # Kept a while for the client to reconnect, as streams are closed periodically
+                self.idle_since[event_id] = time.monotonic()
+
+
+hub = SongRequestHub(
+    history_size=getattr(settings, 'SONG_REQUEST_HUB_HISTORY', 500),
+    subscriber_queue_size=getattr(settings, 'SONG_REQUEST_HUB_QUEUE_SIZE', 1000),
+    idle_seconds=getattr(settings, 'SONG_REQUEST_HUB_IDLE_SECONDS', 60),
+)
+
+
+def publish_messages(name, messages):
+    """
+    Publish (event id, data) messages, after the commit that made them.
+    Failures are logged, as they would otherwise surface in the request that committed.
+    """
+    try:
+        for event_id, data in messages:
+            hub.publish(event_id, name, data)
+    except Exception:
+        logger.exception('Publishing %s song request messages failed', name)
+
+
+def song_request_message(song_request, **extra):
+    return dict({
+        'id': song_request.id,
+        'song': song_request.song_id,
+        'user': song_request.user_id,
+        'status': song_request.status,
+        'votes': song_request.votes,
+        'last_status_timestamp': song_request.last_status_timestamp,
+    }, **extra)
+
+
+@receiver(song_requests_created, sender=SongRequest)
+def song_requests_created_handler(sender, instances, **kwargs):
+    messages = [(song_request.event_id, song_request_message(song_request)) for song_request in instances]
+    transaction.on_commit(lambda: publish_messages(CREATED, messages))
+
+
+@receiver(song_requests_status_changed, sender=SongRequest)
+def song_requests_status_changed_handler(sender, instances, previous_statuses, **kwargs):
+    messages = [
+        (song_request.event_id, song_request_message(song_request, previous_status=previous_statuses[song_request.id]))
+        for song_request in instances
+    ]
+    transaction.on_commit(lambda: publish_messages(STATUS_CHANGED, messages))
@@ -0,0 +1,88 @@
+"""
+Content-addressed image storage.
+
+Image bytes are stored once under MEDIA_ROOT, named after the SHA-256 of their content,
+together with fixed-size renditions generated at upload time. Models only keep the
+file name, so querysets never carry image data.
+"""
+import hashlib
+import io
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+IMAGE_DIR = 'images'
+
+RENDITIONS = {
+    'thumbnail': (160, 160),
+    'medium': (320, 320),
+}
+RENDITION_FORMAT = 'PNG'
+
+IMAGE_NAME_PATTERN = re.compile(r'^(?P<hash>[0-9a-f]{64})(_(?P<rendition>[a-z]+))?\.(?P<ext>[a-z0-9]+)$')
+
+
+def image_storage():
+    return FileSystemStorage(location=settings.MEDIA_ROOT)
+
+
+def image_path(name):
+    """
+    Return the storage path of an image file, sharded by the first two hash characters.
+    """
+    return os.path.join(IMAGE_DIR, name[:2], name)
+
+
+def rendition_name(name, rendition):
+    content_hash = name.split('.', 1)[0]
+    return f'{content_hash}_{rendition}.{RENDITION_FORMAT.lower()}'
+
+
+def store_image(data):
+    """
+    Store image bytes and their renditions; returns the file name of the original.
+    Storing the same content twice is a no-op.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (UnidentifiedImageError, OSError):
+        raise ValidationError("Upload a valid image.")
+
+    name = f'{hashlib.sha256(data).hexdigest()}.{image.format.lower()}'
+    storage = image_storage()
+    if not storage.exists(image_path(name)):
+        storage.save(image_path(name), ContentFile(data))
+
+    for rendition, size in RENDITIONS.items():
+        path = image_path(rendition_name(name, rendition))
+        if storage.exists(path):
+            continue
+        thumbnail = ImageOps.fit(ImageOps.exif_transpose(image), size)
+        if thumbnail.mode not in ('RGB', 'RGBA'):
+            thumbnail = thumbnail.convert('RGBA')
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, RENDITION_FORMAT)
+        storage.save(path, ContentFile(buffer.getvalue()))
+
+    return name
+
+
+def image_exists(name):
+    return bool(IMAGE_NAME_PATTERN.match(name)) and image_storage().exists(image_path(name))
+
+
+def open_image(name):
+    """
+    Open a stored image or rendition by file name; returns (file, content type) or None.
+    """
+    if not image_exists(name):
+        return None
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    return image_storage().open(image_path(name)), content_type
@@ -0,0 +1,135 @@
+"""
+Keyset-paginated lists with sparse fieldsets.
+
+A page is the next `limit` rows after a cursor, the ordering values of the last row of
+the previous page, on an ordering an index serves. So every page costs one index range
+scan however deep the client pages, where an offset would scan all the rows before it.
+Fieldsets map the names clients may ask for with `?fields=` to the columns behind them,
+and a page selects only the columns of the fields it returns.
+"""
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidListParameter(ValueError):
+    pass
+
+
+class Fieldset:
+    """
+    Output fields of a list mapped to their ORM lookups; `default` is returned without ?fields=.
+    """
+    fields = {}
+    default = ()
+
+    def __init__(self, requested=None):
+        if requested:
+            names = [name.strip() for name in requested.split(',') if name.strip()]
+            unknown = [name for name in names if name not in self.fields]
+            if unknown:
+                raise InvalidListParameter(
+                    f"Unknown fields: {', '.join(unknown)}. Choose from {', '.join(self.fields)}"
+                )
+            self.names = list(dict.fromkeys(names))
+        else:
+            self.names = list(self.default or self.fields)
+
+    @property
+    def lookups(self):
+        return [self.fields[name] for name in self.names]
+
+
+class EventFieldset(Fieldset):
+    fields = {
+        'id': 'id',
+        'name': 'name',
+        'dj': 'dj_id',
+        'dj_name': 'dj__djprofile__name',
+        'location': 'location_id',
+        'location_name': 'location__name',
+        'start': 'start',
+        'end': 'end',
+    }
+    default = ('id', 'name', 'dj', 'location', 'start', 'end')
+
+
+class SongRequestFieldset(Fieldset):
+    fields = {
+        'id': 'id',
+        'song': 'song_id',
+        'song_name': 'song__name',
+        'song_artist': 'song__artist',
+        'user': 'user_id',
+        'status': 'status',
+        'votes': 'votes',
+        'created_at': 'created_at',
+        'last_status_timestamp': 'last_status_timestamp',
+    }
+    default = ('id', 'song', 'user', 'status', 'votes', 'last_status_timestamp')
+
+
+class SongFieldset(Fieldset):
+    fields = {
+        'id': 'id',
+        'name': 'name',
+        'artist': 'artist',
+        'spotify_url': 'spotify_url',
+        'image_url': 'image_url',
+        'request_count': 'request_count',
+    }
+
+
+def encode_cursor(values):
+    values = [value.isoformat() if isinstance(value, datetime.datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, keys):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError
+        return [model._meta.get_field(key).to_python(value) for key, value in zip(keys, values)]
+    except (ValueError, TypeError, binascii.Error, ValidationError):
+        raise InvalidListParameter('Invalid cursor')
+
+
+def keyset_filter(keys, values, descending):
+    """
+    Rows after `values` in the ordering of `keys`. The leading key is also bounded on its own,
+    so the database scans its index from the cursor instead of evaluating the OR on every row.
+    """
+    after = 'lt' if descending else 'gt'
+    bound = 'lte' if descending else 'gte'
+    condition = Q()
+    for i in reversed(range(len(keys))):
+        equal = {key: value for key, value in zip(keys[:i], values[:i])}
+        condition |= Q(**equal, **{f'{keys[i]}__{after}': values[i]})
+    return Q(**{f'{keys[0]}__{bound}': values[0]}) & condition
+
+
+def keyset_page(queryset, ordering, fieldset, cursor=None, limit=50):
+    """
+    One page of `queryset` in `ordering`, all ascending or all descending and ending on a
+    unique key, with the fields of `fieldset`. Returns the rows and the cursor of the next page.
+    """
+    keys = [name.lstrip('-') for name in ordering]
+    descending = ordering[0].startswith('-')
+    if cursor:
+        queryset = queryset.filter(keyset_filter(keys, decode_cursor(cursor, queryset.model, keys), descending))
+
+    lookups = fieldset.lookups
+    selected = list(dict.fromkeys(lookups + keys))
+    rows = list(queryset.order_by(*ordering).values_list(*selected)[:limit + 1])
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1][selected.index(key)] for key in keys])
+    positions = [selected.index(lookup) for lookup in lookups]
+    return [dict(zip(fieldset.names, (row[i] for i in positions))) for row in rows], next_cursor
@@ -0,0 +1,158 @@
+"""
+Process-local index of live events.
+
+Events live now or starting within LIVE_EVENTS_HORIZON_HOURS are loaded with one
+query on event_time_index into an interval tree, along with their DJs, which each
+process keeps in memory.
+LIVE_EVENTS_CACHE only holds a version of the events, which expires every
+LIVE_EVENTS_REFRESH_SECONDS and is dropped when an event changes; a process rebuilds
+its tree when the version it was built at is no longer current. "Live at T" and
+"overlapping a window" inside the horizon are then answered without touching the
+database, and without loading the tree from the cache.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from app.models import Event
+
+LIVE_EVENTS_VERSION_KEY = 'live_events_version'
+
+# This process's snapshot; replaced whole, so readers in other threads see the old or the new one
+local_snapshot = None
+
+
+class IntervalIndex:
+    """
+    Static interval tree over (start, end, value) triples with closed intervals.
+    Intervals are sorted by start and every node of the implicit tree over the sorted
+    list knows the latest end below it, so queries skip whole subtrees.
+    """
+    def __init__(self, intervals):
+        self.intervals = sorted(intervals, key=lambda interval: interval[0])
+        self.max_end = [None] * len(self.intervals)
+        self.build(0, len(self.intervals))
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def build(self, lo, hi):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        max_end = self.intervals[mid][1]
+        for child_end in (self.build(lo, mid), self.build(mid + 1, hi)):
+            if child_end is not None and child_end > max_end:
+                max_end = child_end
+        self.max_end[mid] = max_end
+        return max_end
+
+    def overlapping(self, start, end):
+        """
+        Return the values of the intervals that overlap [start, end].
+        """
+        found = []
+        stack = [(0, len(self.intervals))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self.max_end[mid] < start:
+                continue
+            stack.append((lo, mid))
+            interval_start, interval_end, value = self.intervals[mid]
+            if interval_start <= end:
+                if interval_end >= start:
+                    found.append(value)
+                stack.append((mid + 1, hi))
+        return found
+
+    def at(self, moment):
+        return self.overlapping(moment, moment)
+
+
+def live_events_cache():
+    return caches[getattr(settings, 'LIVE_EVENTS_CACHE', 'default')]
+
+
+def build_live_events(version, now=None):
+    now = now or timezone.now()
+    horizon = now + timezone.timedelta(hours=getattr(settings, 'LIVE_EVENTS_HORIZON_HOURS', 24))
+    rows = list(Event.objects.overlapping(now, horizon).values_list('start', 'end', 'id', 'dj_id'))
+    return {
+        'version': version,
+        'from': now,
+        'until': horizon,
+        'index': IntervalIndex([(start, end, event_id) for start, end, event_id, _ in rows]),
+        'djs': {event_id: dj_id for _, _, event_id, dj_id in rows},
+    }
+
+
+def live_events_version():
+    """
+    Return the current version of the live events, starting a new one when it expired or was dropped.
+    """
+    cache = live_events_cache()
+    version = cache.get(LIVE_EVENTS_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        # add, so processes racing to start a version agree on the one that made it in
+        if not cache.add(LIVE_EVENTS_VERSION_KEY, version, getattr(settings, 'LIVE_EVENTS_REFRESH_SECONDS', 60)):
+            version = cache.get(LIVE_EVENTS_VERSION_KEY) or version
+    return version
+
+
+def get_live_events():
+    """
+    Return this process's live events snapshot, rebuilding it when its version is no longer current.
+    """
+    global local_snapshot
+    # Read before the events, so a change made meanwhile leaves the snapshot on an outdated version
+    version = live_events_version()
+    snapshot = local_snapshot
+    if snapshot is None or snapshot['version'] != version or snapshot['until'] < timezone.now():
+        snapshot = local_snapshot = build_live_events(version)
+    return snapshot
+
+
+def live_events(at=None):
+    """
+    Return the DJ of each event live at `at`, by event id.
+    """
+    snapshot = get_live_events()
+    # Taken after a rebuild, which starts the snapshot at its own now
+    at = at or timezone.now()
+    if snapshot['from'] <= at <= snapshot['until']:
+        return {event_id: snapshot['djs'][event_id] for event_id in snapshot['index'].at(at)}
+    return dict(Event.objects.live(at).values_list('id', 'dj_id'))
+
+
+def live_event_ids(at=None):
+    return set(live_events(at))
+
+
+def overlapping_event_ids(start, end):
+    snapshot = get_live_events()
+    if snapshot['from'] <= start and end <= snapshot['until']:
+        return set(snapshot['index'].overlapping(start, end))
+    return set(Event.objects.overlapping(start, end).values_list('id', flat=True))
+
+
+def is_event_live(event_id, at=None):
+    return event_id in live_event_ids(at)
+
+
+def invalidate_live_events():
+    # After the commit, or a process could rebuild from the old rows under the next version
+    transaction.on_commit(lambda: live_events_cache().delete(LIVE_EVENTS_VERSION_KEY))
+
+
+@receiver([post_save, post_delete], sender=Event)
+def event_changed_handler(sender, **kwargs):
+    invalidate_live_events()
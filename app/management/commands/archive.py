@@ -0,0 +1,87 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from app.archive import ARCHIVED_MODELS, archivable, archive, get_archived_model, restore
+from app.models import ArchivedRow
+
+
+class Command(BaseCommand):
+    help = (
+        'Move soft-deleted rows, and the song requests of events that ended more than --finished-days ago, '
+        'into the archive, or put archived rows back with --restore. Every batch is its own transaction, '
+        'so an interrupted run is resumed by running the command again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model', action='append', dest='models',
+            help='Model to archive or restore, e.g. songrequest; repeat for several. Defaults to all of them.',
+        )
+        parser.add_argument(
+            '--finished-days', type=int, default=getattr(settings, 'ARCHIVE_FINISHED_EVENT_DAYS', 30),
+            help='Days since the end of an event after which its song requests are archived.',
+        )
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows moved per transaction.')
+        parser.add_argument('--max-batches', type=int, help='Stop after this many batches per model.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows that would be archived.')
+        parser.add_argument('--restore', action='store_true', help='Restore archived rows instead.')
+        parser.add_argument('--event', type=int, action='append', dest='events',
+                            help='With --restore, restore the rows of this event; repeat for several.')
+        parser.add_argument('--id', type=int, action='append', dest='ids',
+                            help='With --restore and one --model, restore the row with this id; repeat for several.')
+
+    def handle(self, *args, **options):
+        models = ARCHIVED_MODELS
+        if options['models']:
+            models = [get_archived_model(label) for label in options['models']]
+            if None in models:
+                names = ', '.join(model._meta.model_name for model in ARCHIVED_MODELS)
+                raise CommandError(f'Unknown model in {", ".join(options["models"])}. Choose from {names}.')
+        if options['ids'] and not (options['restore'] and options['models'] and len(models) == 1):
+            raise CommandError('--id needs --restore and a single --model.')
+
+        started = time.monotonic()
+        skipped = {}
+        if options['restore']:
+            counts, skipped = self.restore(models, options)
+            verb = 'Restored'
+        else:
+            counts = self.archive(models, options)
+            verb = 'Would archive' if options['dry_run'] else 'Archived'
+        elapsed = time.monotonic() - started
+
+        total = sum(counts.values())
+        for label, count in sorted(counts.items()):
+            self.stdout.write(f'{label:<24} {count:>10}')
+        self.stdout.write(f'{verb} {total} rows in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.0f} rows/s)')
+        for label, count in sorted(skipped.items()):
+            self.stderr.write(
+                f'Skipped {count} {label} rows that conflict with live rows or reference skipped rows; '
+                'they stay archived'
+            )
+
+    def archive(self, models, options):
+        finished_before = timezone.now() - timezone.timedelta(days=options['finished_days'])
+        counts = {}
+        for model in models:
+            if options['dry_run']:
+                counts[model._meta.label_lower] = archivable(model, finished_before).count()
+                continue
+            for label, count in archive(
+                model, finished_before, options['batch_size'], options['max_batches'],
+            ).items():
+                counts[label] = counts.get(label, 0) + count
+        return counts
+
+    def restore(self, models, options):
+        archived_rows = ArchivedRow.objects.all()
+        if options['events']:
+            archived_rows = archived_rows.filter(event_id__in=options['events'])
+        if options['ids']:
+            archived_rows = archived_rows.filter(model=models[0]._meta.label_lower, object_id__in=options['ids'])
+        elif options['models']:
+            archived_rows = archived_rows.filter(model__in=[model._meta.label_lower for model in models])
+        return restore(archived_rows, options['batch_size'], options['max_batches'])
@@ -0,0 +1,75 @@
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app.models import SongRequest
+
+
+class Command(BaseCommand):
+    help = (
+        'Expire requested and pending song requests that are older than --max-age minutes '
+        'or belong to events that have ended. Runs once, or every --interval seconds.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age', type=int, default=getattr(settings, 'SONG_REQUEST_MAX_AGE_MINUTES', 120),
+            help='Minutes since the last status change after which a song request expires.',
+        )
+        parser.add_argument('--batch-size', type=int, default=500, help='Song requests expired per UPDATE.')
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Seconds between sweeps; by default the command sweeps once and exits.',
+        )
+
+    def handle(self, *args, **options):
+        rates = deque(maxlen=10)
+        while True:
+            started = time.monotonic()
+            expired = self.sweep(options['max_age'], options['batch_size'])
+            elapsed = time.monotonic() - started
+            rates.append(expired / elapsed if elapsed else 0)
+            self.stdout.write(
+                f'Expired {expired} song requests in {elapsed:.2f}s '
+                f'({rates[-1]:.0f} rows/s, {sum(rates) / len(rates):.0f} rows/s over the last {len(rates)} sweeps), '
+                f'backlog {self.backlog(options["max_age"])}'
+            )
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def expirable(self):
+        allowed_from = [
+            status for status, targets in SongRequest.ALLOWED_TRANSITIONS.items() if SongRequest.EXPIRED in targets
+        ]
+        return SongRequest.objects.filter(status__in=allowed_from)
+
+    def selectors(self, max_age):
+        now = timezone.now()
+        return [
+            # Served by status_time_index
+            self.expirable().filter(last_status_timestamp__lt=now - timezone.timedelta(minutes=max_age)),
+            # Served by event_status_time_index
+            self.expirable().filter(event__end__lt=now),
+        ]
+
+    def sweep(self, max_age, batch_size):
+        expired = 0
+        for selector in self.selectors(max_age):
+            while True:
+                ids = list(selector.values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    break
+                moved = SongRequest.objects.filter(id__in=ids).change_state(SongRequest.EXPIRED, skip_locked=True)
+                if not moved:
+                    # Everything left is locked by another transaction; pick it up on the next sweep
+                    break
+                expired += len(moved)
+        return expired
+
+    def backlog(self, max_age):
+        stale, finished = self.selectors(max_age)
+        return (stale | finished).count()
@@ -0,0 +1,108 @@
+import os
+import sys
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+
+from app.catalog import FORMATS, catalog_imported, read_catalog, upsert_songs, validate_song_row
+
+EXTENSIONS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+
+class Command(BaseCommand):
+    help = (
+        'Import a song catalog from CSV or JSON Lines with spotify_url, artist, name and image_url per row, '
+        'upserting the songs on their Spotify track id in chunks. The file is streamed, invalid rows are '
+        'reported and skipped, and running the import again is safe.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Catalog file, or - for standard input.')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the one of the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows upserted per transaction.')
+        parser.add_argument('--skip', type=int, default=0, help='Rows to skip, to resume a stopped import.')
+        parser.add_argument('--max-errors', type=int, help='Stop after this many invalid rows.')
+        parser.add_argument('--dry-run', action='store_true', help='Only validate the rows.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        catalog_format = options['format'] or EXTENSIONS.get(os.path.splitext(path)[1].lower())
+        if catalog_format is None:
+            raise CommandError(f'Cannot tell the format of {path}; pass --format {" or ".join(FORMATS)}.')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive.')
+
+        if path == '-':
+            self.import_catalog(sys.stdin, catalog_format, options)
+        else:
+            try:
+                file = open(path, newline='', encoding='utf-8-sig')
+            except OSError as e:
+                raise CommandError(f'Cannot open {path}: {e}')
+            with file:
+                self.import_catalog(file, catalog_format, options)
+
+    def import_catalog(self, file, catalog_format, options):
+        self.started = time.monotonic()
+        self.read = self.written = self.invalid = 0
+        self.skip = options['skip']
+        # Rows before this one are committed, which is where a stopped import resumes
+        done = options['skip']
+        chunk = []
+        try:
+            for line_number, row in read_catalog(file, catalog_format):
+                self.read += 1
+                if self.read <= options['skip']:
+                    continue
+                try:
+                    chunk.append(validate_song_row(row))
+                except ValidationError as e:
+                    self.invalid += 1
+                    self.stderr.write(f'Line {line_number}: {self.format_error(e)}')
+                    if options['max_errors'] is not None and self.invalid >= options['max_errors']:
+                        raise CommandError(f'Stopped after {self.invalid} invalid rows.')
+                if self.read - done >= options['chunk_size']:
+                    self.write_chunk(chunk, options)
+                    chunk, done = [], self.read
+            self.write_chunk(chunk, options)
+            done = self.read
+        except DatabaseError as e:
+            self.resume_hint(done, options)
+            raise CommandError(f'Import failed: {e}')
+        except (CommandError, KeyboardInterrupt):
+            self.resume_hint(done, options)
+            raise
+        finally:
+            if self.written and not options['dry_run']:
+                catalog_imported()
+
+        elapsed = time.monotonic() - self.started
+        verb = 'Validated' if options['dry_run'] else 'Imported'
+        self.stdout.write(
+            f'{verb} {self.written} songs from {self.read - self.skip} rows, {self.invalid} invalid, '
+            f'in {elapsed:.2f}s ({self.rate():.0f} rows/s)'
+        )
+
+    def write_chunk(self, songs, options):
+        if options['dry_run']:
+            self.written += len({song.spotify_id for song in songs})
+        else:
+            self.written += upsert_songs(songs)
+        self.stdout.write(
+            f'{self.read:>10} rows  {self.written:>10} songs  {self.invalid:>8} invalid  {self.rate():>8.0f} rows/s'
+        )
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return (self.read - self.skip) / elapsed if elapsed else 0
+
+    def resume_hint(self, done, options):
+        if done > options['skip'] and not options['dry_run']:
+            self.stderr.write(f'The first {done} rows are imported; resume with --skip {done}.')
+
+    def format_error(self, error):
+        if hasattr(error, 'error_dict'):
+            return '; '.join(f'{field}: {" ".join(messages)}' for field, messages in error.message_dict.items())
+        return ' '.join(error.messages)
@@ -0,0 +1,120 @@
+import decimal
+import io
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from app.models import SongRequest
+from app.renderers import FastJSONParser, FastJSONRenderer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the JSON renderer and parser in REST_FRAMEWORK with DRF's on song request and event payloads "
+        'shaped like the API responses, and report the time per payload and the speedup.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=50, help='Rows per payload, as in a page of a list.')
+        parser.add_argument('--iterations', type=int, default=2000, help='Renders or parses per timing.')
+        parser.add_argument('--repeat', type=int, default=5, help='Timings per case; the best one is reported.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the payloads.')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        payloads = {
+            'song_requests': self.song_requests(rng, options['rows']),
+            'events': self.events(rng, options['rows']),
+        }
+        pairs = {
+            'drf': (JSONRenderer(), JSONParser()),
+            'fast': (FastJSONRenderer(), FastJSONParser()),
+        }
+
+        self.stdout.write(f'{"payload":<16}{"step":<8}{"bytes":>8}{"drf µs":>12}{"fast µs":>12}{"speedup":>10}')
+        for name, payload in payloads.items():
+            rendered = {key: renderer.render(payload) for key, (renderer, _) in pairs.items()}
+            if json.loads(rendered['drf']) != json.loads(rendered['fast']):
+                self.stderr.write(f'{name}: the renderers disagree')
+
+            render = {
+                key: self.best(lambda renderer=renderer: renderer.render(payload), options)
+                for key, (renderer, _) in pairs.items()
+            }
+            body = rendered['drf']
+            parse = {
+                key: self.best(lambda parser=parser: parser.parse(io.BytesIO(body)), options)
+                for key, (_, parser) in pairs.items()
+            }
+            for step, timings in (('render', render), ('parse', parse)):
+                self.stdout.write(
+                    f'{name:<16}{step:<8}{len(body):>8}{timings["drf"] * 1e6:>12.1f}{timings["fast"] * 1e6:>12.1f}'
+                    f'{timings["drf"] / timings["fast"]:>9.1f}x'
+                )
+
+    def best(self, func, options):
+        """
+        Seconds per call of the fastest of `repeat` timings of `iterations` calls.
+        """
+        timings = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            for _ in range(options['iterations']):
+                func()
+            timings.append((time.perf_counter() - started) / options['iterations'])
+        return min(timings)
+
+    def song_requests(self, rng, rows):
+        """
+        A page of song requests with their songs, as the song request list and queue return them.
+        """
+        now = timezone.now()
+        labels = dict(SongRequest.STATUS_CHOICES)
+        results = []
+        for i in range(rows):
+            song_status = rng.choice(list(labels))
+            created_at = now - timezone.timedelta(seconds=rng.randrange(1, 7200))
+            results.append({
+                'id': 100000 + i,
+                'song': rng.randrange(1, 50000),
+                'song_name': f'Song {i} – Remastered',
+                'song_artist': f'Artist {rng.randrange(1000)}',
+                'user': rng.randrange(1, 100000),
+                'status': song_status,
+                'status_label': _(labels[song_status]),
+                'votes': rng.randrange(1, 40),
+                'created_at': created_at,
+                'last_status_timestamp': created_at + timezone.timedelta(seconds=rng.randrange(0, 600)),
+            })
+        return {'results': results, 'next': 'WyIyMDI2LTEwLTE4VDEyOjAwOjAwKzAwOjAwIiwxMDAwNTBd'}
+
+    def events(self, rng, rows):
+        """
+        A page of events with their locations, as the event list and nearby events return them.
+        """
+        now = timezone.now()
+        results = []
+        for i in range(rows):
+            start = now + timezone.timedelta(hours=rng.randrange(-48, 48))
+            results.append({
+                'id': 5000 + i,
+                'name': f'Night {i}',
+                'dj': rng.randrange(1, 10000),
+                'dj_name': f'DJ {i}',
+                'start': start,
+                'end': start + timezone.timedelta(hours=rng.randrange(2, 10)),
+                'distance_km': decimal.Decimal(rng.randrange(0, 200000)) / 1000,
+                'location': {
+                    'id': rng.randrange(1, 10000),
+                    'name': f'Club {i}',
+                    'latitude': rng.uniform(-60, 60),
+                    'longitude': rng.uniform(-180, 180),
+                },
+            })
+        return {'results': results, 'next': None}
@@ -0,0 +1,286 @@
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from app.geo import encode_geohash
+from app.models import CustomUser, DjProfile, Event, Location, Song, SongRequest
+from app.throttling import bucket_store
+
+PASSWORD = 'loadtest'
+ADMIN_MODELS = ('customuser', 'djprofile', 'location', 'event', 'song', 'songrequest')
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the login, song request, event and admin changelist views with an in-process client '
+        'against a fresh test database, and report throughput and p50/p95/p99 latency per scenario. '
+        'Results are written as JSON so runs can be diffed between commits.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per scenario.')
+        parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per scenario.')
+        parser.add_argument('--concurrency', type=int, default=4, help='Client threads per scenario.')
+        parser.add_argument('--rows', type=int, default=200, help='Rows per table seeded before the run.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the data and the requests.')
+        parser.add_argument(
+            '--scenario', action='append', dest='scenarios',
+            help='Scenario to run; repeat for several. Defaults to all of them.',
+        )
+        parser.add_argument(
+            '--output', default=os.path.join(tempfile.gettempdir(), 'bethedj_loadtest.json'),
+            help='File the JSON results are written to. Defaults to bethedj_loadtest.json in the temp directory.',
+        )
+        parser.add_argument('--keepdb', action='store_true', help='Keep the test database between runs.')
+
+    def handle(self, *args, **options):
+        scenarios = self.scenarios()
+        names = options['scenarios'] or list(scenarios)
+        unknown = set(names) - set(scenarios)
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}. Choose from {", ".join(scenarios)}.')
+
+        workdir = tempfile.mkdtemp(prefix='bethedj-loadtest-')
+        # Buckets of the run must not leak into the ones shared with a running server
+        bucket_store.path = os.path.join(workdir, 'throttle.sqlite3')
+        if connection.vendor == 'sqlite':
+            # In-memory SQLite cannot be shared between the client threads
+            connection.settings_dict['TEST']['NAME'] = os.path.join(workdir, 'loadtest.sqlite3')
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            self.seed = options['seed']
+            self.random = random.Random(self.seed)
+            self.seed_data(options['rows'], options['requests'] + options['warmup'])
+            results = {}
+            for name in names:
+                results[name] = self.run_scenario(
+                    scenarios[name], options['requests'], options['warmup'], options['concurrency'],
+                )
+                self.report(name, results[name])
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+            if not options['keepdb']:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        with open(options['output'], 'w') as output:
+            json.dump(self.environment(options) | {'scenarios': results}, output, indent=2)
+        self.stdout.write(f'Results written to {options["output"]}')
+
+    def scenarios(self):
+        scenarios = {
+            'login': self.login,
+            'create_song_request': self.create_song_request,
+            'create_event': self.create_event,
+        }
+        for model_name in ADMIN_MODELS:
+            scenarios[f'admin_{model_name}_changelist'] = self.admin_changelist(model_name)
+        return scenarios
+
+    def seed_data(self, rows, requests):
+        """
+        Seed `rows` of every table, and one DJ with a free location per create_event request.
+        Every user shares one password hash, so seeding does not pay for thousands of hashes.
+        """
+        password = make_password(PASSWORD)
+        CustomUser.objects.bulk_create(
+            [CustomUser(email=f'guest{i}@loadtest.local', name=f'guest{i}', password=password) for i in range(rows)]
+            + [CustomUser(email=f'dj{i}@loadtest.local', name=f'dj{i}', password=password)
+               for i in range(rows + requests)]
+        )
+        self.admin = CustomUser.objects.create_superuser(email='admin@loadtest.local', password=PASSWORD)
+        self.guests = list(CustomUser.objects.filter(email__startswith='guest').values_list('id', flat=True))
+        djs = list(CustomUser.objects.filter(email__startswith='dj').order_by('id').values_list('id', flat=True))
+        DjProfile.objects.bulk_create([DjProfile(user_id=dj, name=f'DJ {dj}') for dj in djs])
+        Token.objects.bulk_create([Token(user_id=dj, key=Token.generate_key()) for dj in djs])
+        self.tokens = dict(Token.objects.filter(user_id__in=djs).values_list('user_id', 'key'))
+
+        locations = []
+        for i in range(rows + requests):
+            latitude, longitude = self.random.uniform(-60, 60), self.random.uniform(-180, 180)
+            geohash = encode_geohash(latitude, longitude)
+            locations.append(Location(name=f'Club {i}', latitude=latitude, longitude=longitude, geohash=geohash))
+        Location.objects.bulk_create(locations)
+        location_ids = list(Location.objects.order_by('id').values_list('id', flat=True))
+        Event.objects.bulk_create([
+            Event(name=f'Night {i}', dj_id=djs[i], location_id=location_ids[i]) for i in range(rows)
+        ])
+        self.events = list(Event.objects.values_list('dj_id', 'id'))
+        # The remaining DJs and locations are used by create_event, one each
+        self.free_djs = list(zip(djs[rows:], location_ids[rows:]))
+
+        self.tracks = [f'{i:022d}' for i in range(rows)]
+        Song.objects.bulk_create([
+            Song(
+                spotify_url=f'https://open.spotify.com/track/{track}', spotify_id=track,
+                artist=f'Artist {i}', name=f'Song {i}', image_url='https://i.scdn.co/image/cover.png',
+            )
+            for i, track in enumerate(self.tracks)
+        ])
+        songs = list(Song.objects.values_list('id', flat=True))
+        # Distinct songs per event, as an event holds one open song request per song
+        SongRequest.objects.bulk_create([
+            SongRequest(song_id=song, user_id=self.random.choice(self.guests), dj_id=dj, event_id=event)
+            for dj, event in self.events for song in self.random.sample(songs, 3)
+        ])
+
+    def login(self, client, i):
+        return client.post(
+            reverse('login'), {'email': f'guest{i % len(self.guests)}@loadtest.local', 'password': PASSWORD},
+            content_type='application/json',
+        )
+
+    def create_song_request(self, client, i):
+        # Seeded per request, so runs are the same whatever the thread interleaving
+        rng = random.Random(f'{self.seed}:{i}')
+        dj, event = rng.choice(self.events)
+        track = rng.choice(self.tracks)
+        data = {
+            'song': {
+                'spotify_url': f'https://open.spotify.com/track/{track}',
+                'artist': f'Artist {track}',
+                'name': f'Song {track}',
+                'image_url': 'https://i.scdn.co/image/cover.png',
+            },
+            'user': rng.choice(self.guests),
+            'dj': dj,
+            'event': event,
+        }
+        # Every request comes from its own guest, as on a busy night
+        return client.post(
+            reverse('create:create_song_request'), data, content_type='application/json',
+            REMOTE_ADDR=f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}', HTTP_X_DEVICE_ID=f'device{i}',
+        )
+
+    def create_event(self, client, i):
+        dj, location = self.free_djs[i]
+        return client.post(
+            reverse('create:create_event'), {'name': f'Party {i}', 'dj': dj, 'location': location},
+            content_type='application/json', HTTP_AUTHORIZATION=f'Token {self.tokens[dj]}',
+        )
+
+    def admin_changelist(self, model_name):
+        def request(client, i):
+            if '_auth_user_id' not in client.session:
+                client.force_login(self.admin)
+            return client.get(reverse(f'admin:app_{model_name}_changelist'))
+        return request
+
+    def run_scenario(self, request, requests, warmup, concurrency):
+        """
+        Run `warmup` then `requests` requests over `concurrency` threads, each with its own client.
+        A request that raises is counted under its exception in `errors`, and the thread carries on.
+        """
+        counter = iter(range(warmup + requests))
+        lock = threading.Lock()
+        latencies = []
+        statuses = Counter()
+        errors = Counter()
+
+        def worker():
+            client = Client()
+            try:
+                while True:
+                    with lock:
+                        i = next(counter, None)
+                    if i is None:
+                        return
+                    started = time.perf_counter()
+                    try:
+                        response = request(client, i)
+                    except Exception as e:
+                        if i >= warmup:
+                            with lock:
+                                errors[f'{type(e).__name__}: {e}'] += 1
+                        continue
+                    elapsed = time.perf_counter() - started
+                    if i >= warmup:
+                        with lock:
+                            latencies.append(elapsed)
+                            statuses[response.status_code] += 1
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Warmup requests are part of the wall time; take them out in proportion
+        wall = (time.perf_counter() - started) * requests / (warmup + requests) if requests else 0
+
+        latencies.sort()
+        return {
+            'requests': len(latencies),
+            'concurrency': concurrency,
+            'throughput': len(latencies) / wall if wall else 0,
+            # None when no measured request completed
+            'latency_ms': {
+                'mean': sum(latencies) / len(latencies) * 1000,
+                'p50': percentile(latencies, 50) * 1000,
+                'p95': percentile(latencies, 95) * 1000,
+                'p99': percentile(latencies, 99) * 1000,
+                'max': latencies[-1] * 1000,
+            } if latencies else None,
+            'statuses': {str(code): count for code, count in sorted(statuses.items())},
+            'errors': dict(errors.most_common()),
+        }
+
+    def report(self, name, result):
+        latency = result['latency_ms']
+        statuses = ', '.join(f'{code}: {count}' for code, count in result['statuses'].items())
+        if latency is None:
+            self.stdout.write(f'{name:<34} no request completed')
+        else:
+            self.stdout.write(
+                f'{name:<34} {result["throughput"]:>8.1f} req/s  p50 {latency["p50"]:>7.2f}ms  '
+                f'p95 {latency["p95"]:>7.2f}ms  p99 {latency["p99"]:>7.2f}ms  ({statuses})'
+            )
+        for error, count in result['errors'].items():
+            self.stderr.write(f'{name:<34} {count} raised {error}')
+
+    def environment(self, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'options': {
+                name: options[name] for name in ('requests', 'warmup', 'concurrency', 'rows', 'seed', 'scenarios')
+            },
+        }
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of sorted values.
+    """
+    return values[max(0, math.ceil(len(values) * percent / 100) - 1)]
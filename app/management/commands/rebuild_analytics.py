@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.analytics import rebuild
+from app.models import ArchivedRow, Event, SongRequest
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the per-event song request rollups from the song requests, for every event '
+        'or the ones given with --event. Each batch of events is rebuilt in its own transaction. '
+        'Events with archived song requests are skipped, as their rollups can no longer be recomputed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=int, action='append', dest='events', help='Event id; repeat for several.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Events rebuilt per transaction.')
+
+    def handle(self, *args, **options):
+        archived = ArchivedRow.objects.filter(model=SongRequest._meta.label_lower, event_id__isnull=False)
+        events = Event._base_manager.exclude(pk__in=archived.values('event_id')).order_by('pk')
+        if options['events']:
+            events = events.filter(pk__in=options['events'])
+
+        started = time.monotonic()
+        rebuilt = 0
+        last_pk = 0
+        while True:
+            event_ids = list(events.filter(pk__gt=last_pk).values_list('pk', flat=True)[:options['batch_size']])
+            if not event_ids:
+                break
+            rebuild(event_ids)
+            rebuilt += len(event_ids)
+            last_pk = event_ids[-1]
+        self.stdout.write(f'Rebuilt the analytics of {rebuilt} events in {time.monotonic() - started:.2f}s')
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from app.profiling import view_stats
+
+SORT_KEYS = {
+    'total': lambda row: row['total_seconds'],
+    'db': lambda row: row['db_seconds'],
+    'queries': lambda row: row['queries'] / row['requests'],
+    'requests': lambda row: row['requests'],
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Show the query count, DB time and total time per view recorded by app.profiling.ProfilingMiddleware, '
+        'across every worker process.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=sorted(SORT_KEYS), default='total', help='Column to sort views by.')
+        parser.add_argument('--reset', action='store_true', help='Clear the recorded stats after showing them.')
+
+    def handle(self, *args, **options):
+        rows = sorted(view_stats.stats(), key=SORT_KEYS[options['sort']], reverse=True)
+        if not rows:
+            self.stdout.write('No requests recorded; is ProfilingMiddleware in MIDDLEWARE?')
+        else:
+            width = max(len(row['view_name']) for row in rows)
+            self.stdout.write(
+                f'{"view":<{width}} {"requests":>8} {"queries":>8} {"max q":>6} '
+                f'{"db ms":>8} {"total ms":>9} {"max ms":>8} {"over":>5}'
+            )
+            for row in rows:
+                requests = row['requests']
+                self.stdout.write(
+                    f'{row["view_name"]:<{width}} {requests:>8} {row["queries"] / requests:>8.1f} '
+                    f'{row["max_queries"]:>6} {row["db_seconds"] * 1000 / requests:>8.2f} '
+                    f'{row["total_seconds"] * 1000 / requests:>9.2f} {row["max_seconds"] * 1000:>8.2f} '
+                    f'{row["over_budget"]:>5}'
+                )
+        if options['reset']:
+            view_stats.reset()
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.3 on 2026-10-18 11:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_alter_djprofile_name_alter_song_spotify_url_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='songrequest',
+            index=models.Index(fields=['event', 'status'], name='event_status_index'),
+        ),
+    ]
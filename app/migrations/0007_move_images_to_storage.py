@@ -0,0 +1,24 @@
+# Generated by Django 4.2.3 on 2026-10-18 11:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Images are copied by 0008_copy_images_to_storage and their columns dropped by 0009_drop_image_columns
+
+    dependencies = [
+        ('app', '0006_songrequest_event_status_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='djprofile',
+            name='image_file',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='image_file',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
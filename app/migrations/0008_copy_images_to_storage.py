@@ -0,0 +1,136 @@
+# Generated by Django 4.2.3 on 2026-10-18 11:25
+
+import base64
+import hashlib
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import migrations, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+BATCH_SIZE = 100
+IMAGE_MODELS = ('DjProfile', 'Event')
+
+# The storage layout of app.images when this migration was written, frozen so later changes do not alter it
+IMAGE_DIR = 'images'
+RENDITIONS = {
+    'thumbnail': (160, 160),
+    'medium': (320, 320),
+}
+RENDITION_FORMAT = 'PNG'
+
+
+def image_storage():
+    return FileSystemStorage(location=settings.MEDIA_ROOT)
+
+
+def image_path(name):
+    return os.path.join(IMAGE_DIR, name[:2], name)
+
+
+def store_image(data):
+    """
+    Store image bytes and their renditions as app.images does; returns the file name, or None
+    if the bytes are not an image.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (UnidentifiedImageError, OSError):
+        return None
+
+    name = f'{hashlib.sha256(data).hexdigest()}.{image.format.lower()}'
+    storage = image_storage()
+    if not storage.exists(image_path(name)):
+        storage.save(image_path(name), ContentFile(data))
+
+    content_hash = name.split('.', 1)[0]
+    for rendition, size in RENDITIONS.items():
+        path = image_path(f'{content_hash}_{rendition}.{RENDITION_FORMAT.lower()}')
+        if storage.exists(path):
+            continue
+        thumbnail = ImageOps.fit(ImageOps.exif_transpose(image), size)
+        if thumbnail.mode not in ('RGB', 'RGBA'):
+            thumbnail = thumbnail.convert('RGBA')
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, RENDITION_FORMAT)
+        storage.save(path, ContentFile(buffer.getvalue()))
+    return name
+
+
+def decode_legacy_image(value):
+    # Rows hold either bare base64 or a data URI
+    if ';base64,' in value:
+        value = value.split(';base64,', 1)[1]
+    return base64.b64decode(value)
+
+
+def move_images_to_storage(apps, schema_editor):
+    """
+    Store the images held in rows and point the rows at them. Rows whose image cannot be
+    decoded keep it and fail the migration, once every other row is stored, as the next
+    migration drops the column holding it; fix or clear their image and migrate again.
+    """
+    undecodable = {}
+    for model_name in IMAGE_MODELS:
+        model = apps.get_model('app', model_name)
+        pending = model.objects.filter(image_file__isnull=True, image__isnull=False).exclude(image='')
+        last_pk = 0
+        while True:
+            batch = list(pending.filter(pk__gt=last_pk).order_by('pk').only('pk', 'image', 'image_file')[:BATCH_SIZE])
+            if not batch:
+                break
+            stored = []
+            for row in batch:
+                try:
+                    row.image_file = store_image(decode_legacy_image(row.image))
+                except ValueError:
+                    row.image_file = None
+                if row.image_file is None:
+                    undecodable.setdefault(model_name, []).append(row.pk)
+                else:
+                    stored.append(row)
+            with transaction.atomic():
+                model.objects.bulk_update(stored, ['image_file'])
+            last_pk = batch[-1].pk
+
+    if undecodable:
+        raise ValueError('Images that are not decodable, by model and id: ' + '; '.join(
+            f'{model_name} {", ".join(map(str, pks))}' for model_name, pks in undecodable.items()
+        ))
+
+
+def move_images_to_rows(apps, schema_editor):
+    storage = image_storage()
+    for model_name in IMAGE_MODELS:
+        model = apps.get_model('app', model_name)
+        pending = model.objects.filter(image_file__isnull=False).exclude(image_file='')
+        last_pk = 0
+        while True:
+            batch = list(pending.filter(pk__gt=last_pk).order_by('pk').only('pk', 'image', 'image_file')[:BATCH_SIZE])
+            if not batch:
+                break
+            for row in batch:
+                if storage.exists(image_path(row.image_file)):
+                    with storage.open(image_path(row.image_file)) as image:
+                        row.image = base64.b64encode(image.read()).decode()
+            with transaction.atomic():
+                model.objects.bulk_update(batch, ['image'])
+            last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+    # Images are moved in batches that commit on their own, so an interrupted run is resumed by
+    # migrating again; the columns it reads and writes are added and dropped by the migrations around it
+    atomic = False
+
+    dependencies = [
+        ('app', '0007_move_images_to_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_images_to_storage, move_images_to_rows),
+    ]
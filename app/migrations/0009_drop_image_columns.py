@@ -0,0 +1,21 @@
+# Generated by Django 4.2.3 on 2026-10-18 11:25
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_copy_images_to_storage'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='djprofile',
+            name='image',
+        ),
+        migrations.RemoveField(
+            model_name='event',
+            name='image',
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.3 on 2026-10-18 11:36
+
+from django.db import migrations, models
+
+from app.geo import encode_geohash
+
+BATCH_SIZE = 1000
+
+
+def fill_geohashes(apps, schema_editor):
+    Location = apps.get_model('app', 'Location')
+    last_pk = 0
+    while True:
+        batch = list(Location.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', 'latitude', 'longitude')[:BATCH_SIZE])
+        if not batch:
+            break
+        for location in batch:
+            location.geohash = encode_geohash(location.latitude, location.longitude)
+        Location.objects.bulk_update(batch, ['geohash'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_drop_image_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12),
+        ),
+        migrations.RunPython(fill_geohashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.3 on 2026-10-18 11:39
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+# Django's icontains compiles to UPPER(column) LIKE UPPER(pattern) on PostgreSQL,
+# which these trigram indexes serve.
+TRIGRAM_INDEXES = {
+    'song_name_trgm_index': 'name',
+    'song_artist_trgm_index': 'artist',
+}
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, column in TRIGRAM_INDEXES.items():
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON app_song USING gin (UPPER({column}) gin_trgm_ops)')
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+def fill_request_counts(apps, schema_editor):
+    Song = apps.get_model('app', 'Song')
+    SongRequest = apps.get_model('app', 'SongRequest')
+    counts = (
+        SongRequest.objects.filter(song_id=OuterRef('pk'), is_active=True)
+        .values('song_id').annotate(count=Count('id')).values('count')
+    )
+    Song.objects.update(request_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_location_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='request_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_request_counts, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.3 on 2026-10-18 11:41
+
+from django.db import migrations, models
+
+from app.spotify import parse_track_id
+
+BATCH_SIZE = 1000
+
+
+def fill_spotify_ids(apps, schema_editor):
+    """
+    Key songs on their track id. When several rows point at the same track, the oldest
+    one keeps it, the song requests of the others are moved onto it and they are soft deleted.
+    """
+    Song = apps.get_model('app', 'Song')
+    SongRequest = apps.get_model('app', 'SongRequest')
+    kept = {}
+    last_pk = 0
+    while True:
+        batch = list(Song.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', 'spotify_url')[:BATCH_SIZE])
+        if not batch:
+            break
+        updated = []
+        for song in batch:
+            track_id = parse_track_id(song.spotify_url)
+            if track_id is None:
+                continue
+            if track_id in kept:
+                SongRequest.objects.filter(song_id=song.pk).update(song_id=kept[track_id])
+                Song.objects.filter(pk=song.pk).update(is_active=False)
+                continue
+            kept[track_id] = song.pk
+            song.spotify_id = track_id
+            updated.append(song)
+        Song.objects.bulk_update(updated, ['spotify_id'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_song_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='spotify_id',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(fill_spotify_ids, migrations.RunPython.noop),
+    ]
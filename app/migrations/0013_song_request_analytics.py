@@ -0,0 +1,58 @@
+# Generated by Django 4.2.3 on 2026-10-18 11:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_song_spotify_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventSummary',
+            fields=[
+                ('event', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='app.event')),
+                ('total', models.IntegerField(default=0)),
+                ('requested', models.IntegerField(default=0)),
+                ('pending', models.IntegerField(default=0)),
+                ('played', models.IntegerField(default=0)),
+                ('rejected', models.IntegerField(default=0)),
+                ('expired', models.IntegerField(default=0)),
+                ('played_seconds', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EventPlayDelay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='app.event')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SongRequestRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('REQUESTED', 'Requested'), ('PENDING', 'Pending'), ('PLAYED', 'Played'), ('REJECTED', 'Rejected'), ('EXPIRED', 'Expired')], max_length=20)),
+                ('count', models.IntegerField(default=0)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='app.event')),
+                ('song', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='app.song')),
+            ],
+            options={
+                'indexes': [models.Index(models.F('event'), models.F('status'), models.OrderBy(models.F('count'), descending=True), name='rollup_event_count_index')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='songrequestrollup',
+            constraint=models.UniqueConstraint(fields=('event', 'song', 'status'), name='rollup_event_song_status_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='eventplaydelay',
+            constraint=models.UniqueConstraint(fields=('event', 'bucket'), name='play_delay_event_bucket_unique'),
+        ),
+    ]
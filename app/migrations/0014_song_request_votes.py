@@ -0,0 +1,109 @@
+# Generated by Django 4.2.3 on 2026-10-18 12:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from app.analytics import rebuild
+
+BATCH_SIZE = 500
+OPEN_STATUSES = ('REQUESTED', 'PENDING')
+
+
+def merge_open_song_requests(apps, schema_editor):
+    """
+    Keep the oldest of the open song requests for the same event and song, with one vote per
+    distinct user of the group, and soft-delete the others so the unique constraint can be added.
+    """
+    SongRequest = apps.get_model('app', 'SongRequest')
+    SongRequestVote = apps.get_model('app', 'SongRequestVote')
+    open_requests = SongRequest._base_manager.filter(status__in=OPEN_STATUSES, is_active=True)
+    last_pk = 0
+    while True:
+        batch = list(
+            open_requests.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', 'event_id', 'song_id')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        last_pk = batch[-1][0]
+
+        keys = {(event_id, song_id) for _, event_id, song_id in batch}
+        # Whole groups, including their rows of later batches; rows of earlier batches were merged already
+        rows = open_requests.filter(
+            event_id__in={event_id for event_id, _ in keys}, song_id__in={song_id for _, song_id in keys},
+        ).order_by('pk').values_list('pk', 'event_id', 'song_id', 'user_id')
+        groups = {}
+        for pk, event_id, song_id, user_id in rows:
+            if (event_id, song_id) in keys:
+                groups.setdefault((event_id, song_id), []).append((pk, user_id))
+
+        votes = []
+        merged = []
+        for group in groups.values():
+            kept = group[0][0]
+            users = {user_id for _, user_id in group}
+            votes += [SongRequestVote(song_request_id=kept, user_id=user_id) for user_id in users]
+            if len(group) > 1:
+                merged += [pk for pk, _ in group[1:]]
+                SongRequest._base_manager.filter(pk=kept).update(votes=len(users))
+        SongRequestVote.objects.bulk_create(votes)
+        if merged:
+            SongRequest._base_manager.filter(pk__in=merged).update(is_active=False)
+
+
+def fill_rollups(apps, schema_editor):
+    """
+    Compute the analytics rollups of every event, weighted by votes, with the rebuild the
+    rebuild_analytics command runs.
+    """
+    Event = apps.get_model('app', 'Event')
+    last_pk = 0
+    while True:
+        event_ids = list(Event._base_manager.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:BATCH_SIZE])
+        if not event_ids:
+            break
+        rebuild(event_ids, apps)
+        last_pk = event_ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_song_request_analytics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongRequestVote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='songrequest',
+            name='votes',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='songrequestvote',
+            name='song_request',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='app.songrequest'),
+        ),
+        migrations.AddField(
+            model_name='songrequestvote',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='songrequestvote',
+            constraint=models.UniqueConstraint(fields=('song_request', 'user'), name='song_request_vote_unique'),
+        ),
+        migrations.RunPython(merge_open_song_requests, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='songrequest',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True), ('status__in', ['REQUESTED', 'PENDING'])), fields=('event', 'song'), name='open_song_request_unique'),
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 4.2.3 on 2026-10-18 12:05
+
+import app.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_song_request_votes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('object_id', models.BigIntegerField()),
+                ('event_id', models.BigIntegerField(blank=True, null=True)),
+                ('data', models.JSONField(encoder=app.models.ArchiveJSONEncoder)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='customuser',
+            name='email_index',
+        ),
+        migrations.RemoveIndex(
+            model_name='event',
+            name='event_time_index',
+        ),
+        migrations.RemoveIndex(
+            model_name='song',
+            name='spotify_url_index',
+        ),
+        migrations.RemoveIndex(
+            model_name='songrequest',
+            name='status_time_index',
+        ),
+        migrations.RemoveIndex(
+            model_name='songrequest',
+            name='event_status_index',
+        ),
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['email'], name='email_index'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['start', 'end'], name='event_time_index'),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['spotify_url'], name='spotify_url_index'),
+        ),
+        migrations.AddIndex(
+            model_name='songrequest',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['status', 'last_status_timestamp'], name='status_time_index'),
+        ),
+        migrations.AddIndex(
+            model_name='songrequest',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['event', 'status'], name='event_status_index'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedrow',
+            index=models.Index(fields=['event_id', 'model'], name='archived_row_event_index'),
+        ),
+        migrations.AddConstraint(
+            model_name='archivedrow',
+            constraint=models.UniqueConstraint(fields=('model', 'object_id'), name='archived_row_unique'),
+        ),
+    ]
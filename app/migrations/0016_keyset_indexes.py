@@ -0,0 +1,29 @@
+# Generated by Django 4.2.3 on 2026-10-18 12:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_archive'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['start', 'id'], name='event_start_index'),
+        ),
+        migrations.AddIndex(
+            model_name='songrequest',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['event', 'last_status_timestamp', 'id'], name='event_time_request_index'),
+        ),
+        migrations.AddIndex(
+            model_name='songrequest',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['event', 'status', 'last_status_timestamp', 'id'], name='event_status_time_index'),
+        ),
+        migrations.RemoveIndex(
+            model_name='songrequest',
+            name='event_status_index',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-18 13:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='queue_updated_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
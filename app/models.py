@@ -1,11 +1,18 @@
-import base64
+import datetime
+
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.core.exceptions import ValidationError
-from django.core.files.base import ContentFile
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models, transaction
+from django.urls import reverse
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from app.geo import encode_geohash
+from app.images import rendition_name, store_image
+from app.signals import song_requests_created, song_requests_status_changed
+from app.spotify import parse_track_id
+
 
 def one_day_from_now():
     return timezone.now() + timezone.timedelta(days=1)
@@ -30,25 +37,22 @@ class SoftDeletionModel(models.Model):
 
 
 class ImageModel(models.Model):
-    image = models.TextField(null=True, blank=True)
+    image_file = models.CharField(max_length=100, null=True, blank=True)
     image_name = models.TextField(null=True, blank=True)
 
     class Meta:
         abstract = True
 
-    def encode_image(self, image):
-        # Read image data and encode it into base64
+    def set_image(self, image):
+        # Store the uploaded file in the content-addressed image storage
         self.image_name = image.name
-        image_data = image.read()
-        self.image = base64.b64encode(image_data).decode()
-        
-    def decode_image(self):
-        if self.image:
-            format, imgstr = self.image.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name=self.image_name + '.' + ext)
-            return data
-        return None
+        self.image_file = store_image(image.read())
+
+    def image_url(self, rendition=None):
+        if not self.image_file:
+            return None
+        name = rendition_name(self.image_file, rendition) if rendition else self.image_file
+        return reverse('image', args=[name])
 
 
 class CustomUserManager(BaseUserManager):
@@ -81,7 +85,8 @@ class CustomUser(AbstractBaseUser, PermissionsMixin, SoftDeletionModel):
         verbose_name = "User"
         verbose_name_plural = "Users"
         indexes = [
-            models.Index(fields=['email'], name='email_index'),
+            # Logins look emails up through the unique index, active or not
+            models.Index(fields=['email'], name='email_index', condition=models.Q(is_active=True)),
         ]
 
     @property
@@ -124,6 +129,8 @@ class CustomUser(AbstractBaseUser, PermissionsMixin, SoftDeletionModel):
 class DjProfile(SoftDeletionModel, ImageModel):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, null=True, blank=True)
     name = models.CharField(max_length=255, unique=True)
+    # Version marker of the profile endpoint, see app.conditional
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         constraints = [
@@ -138,9 +145,17 @@ class Location(SoftDeletionModel):
     name = models.CharField(max_length=255)
     latitude = models.FloatField()
     longitude = models.FloatField()
+    # Kept in sync with the coordinates on save; backs the nearby search in app.geo
+    geohash = models.CharField(max_length=12, db_index=True, editable=False, blank=True)
+    # Version marker of the event endpoint, which renders the location, see app.conditional
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
+
+    def save(self, *args, **kwargs):
+        self.geohash = encode_geohash(float(self.latitude), float(self.longitude))
+        super().save(*args, **kwargs)
     
     class Meta:
         constraints = [
@@ -148,16 +163,37 @@ class Location(SoftDeletionModel):
         ]
 
 
+class EventQuerySet(models.QuerySet):
+    def overlapping(self, start, end):
+        return self.filter(start__lte=end, end__gte=start)
+
+    def live(self, at=None):
+        at = at or timezone.now()
+        return self.overlapping(at, at)
+
+
 class Event(SoftDeletionModel, ImageModel):
     name = models.CharField(max_length=255)
     dj = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     location = models.OneToOneField(Location, on_delete=models.CASCADE)
     start = models.DateTimeField(default=timezone.now)
     end = models.DateTimeField(default=one_day_from_now)
+    # Version marker of the event endpoint, see app.conditional
+    updated_at = models.DateTimeField(auto_now=True)
+    # Version marker of the event's song request queue, moved by app.queue alone
+    queue_updated_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = SoftDeletionModelManager.from_queryset(EventQuerySet)()
 
     def save(self, *args, **kwargs):
         if self.dj.djprofile is None:
             raise ValidationError("User must be a dj to be able to be assigned to an event")
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Saving a stale queue version would make queues cached at it current again
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'queue_updated_at'
+            ]
         super().save(*args, **kwargs)
 
     @property
@@ -166,21 +202,92 @@ class Event(SoftDeletionModel, ImageModel):
     
     class Meta:
         indexes = [
-            models.Index(fields=['start', 'end'], name='event_time_index'),
+            models.Index(fields=['start', 'end'], name='event_time_index', condition=models.Q(is_active=True)),
+            models.Index(fields=['start', 'id'], name='event_start_index', condition=models.Q(is_active=True)),
         ]
 
 
 class Song(SoftDeletionModel):
     spotify_url = models.URLField(max_length=200, unique=True)
+    # Canonical Spotify track id parsed from spotify_url; songs are upserted on it
+    spotify_id = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
     artist = models.CharField(max_length=255)
     name = models.CharField(max_length=255)
     image_url = models.URLField(max_length=200)
+    # Maintained by app.search as song requests are created; ranks search results
+    request_count = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         indexes = [
-            models.Index(fields=['spotify_url'], name='spotify_url_index'),
+            models.Index(fields=['spotify_url'], name='spotify_url_index', condition=models.Q(is_active=True)),
         ]
 
+    def save(self, *args, **kwargs):
+        self.spotify_id = parse_track_id(self.spotify_url)
+        super().save(*args, **kwargs)
+
+
+class SongRequestQuerySet(models.QuerySet):
+    # Columns RETURNING reports of each moved song request, for the change signal
+    CHANGED_FIELDS = ('id', 'song', 'user', 'dj', 'event', 'created_at', 'votes')
+
+    def change_state(self, state, skip_locked=False):
+        """
+        Move every song request in the queryset that may transition to `state`, with one
+        conditional UPDATE per status they may move from, a single one but for EXPIRED.
+        A row is only moved while it is in that status, so a row changed concurrently is moved
+        from the status it has or left alone. With `skip_locked`, rows locked by another
+        transaction are skipped instead of waited for. Returns the moved song requests, built
+        from what RETURNING reports, the only ones the change signal is sent for.
+        """
+        allowed_from = [
+            status for status, targets in self.model.ALLOWED_TRANSITIONS.items() if state in targets
+        ]
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        timestamp = self.model._meta.get_field('last_status_timestamp')
+        # In model order, which from_db takes the values in
+        fields = [field for field in self.model._meta.concrete_fields if field.name in self.CHANGED_FIELDS]
+        columns = [field.get_col(self.model._meta.db_table) for field in fields]
+        converters = [
+            connection.ops.get_db_converters(column) + column.get_db_converters(connection) for column in columns
+        ]
+        now = timezone.now()
+
+        song_requests = []
+        previous_statuses = {}
+        with transaction.atomic(using=self.db):
+            for previous_status in allowed_from:
+                ids = self.filter(status=previous_status).order_by().values('id')
+                if skip_locked:
+                    ids = ids.select_for_update(skip_locked=True, of=('self',))
+                subquery, params = ids.query.sql_with_params()
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f'UPDATE {table} SET {quote("status")} = %s, {quote(timestamp.column)} = %s '
+                        f'WHERE {quote("id")} IN ({subquery}) AND {quote("status")} = %s AND {quote("is_active")} = %s '
+                        f'RETURNING {", ".join(quote(field.column) for field in fields)}',
+                        [state, timestamp.get_db_prep_save(now, connection), *params, previous_status, True],
+                    )
+                    rows = cursor.fetchall()
+                for values in map(list, rows):
+                    for index, column in enumerate(columns):
+                        for converter in converters[index]:
+                            values[index] = converter(values[index], column, connection)
+                    song_request = self.model.from_db(self.db, [field.attname for field in fields], values)
+                    song_request.status = state
+                    song_request.last_status_timestamp = now
+                    song_requests.append(song_request)
+                    previous_statuses[song_request.id] = previous_status
+            if not song_requests:
+                return []
+            # Sent in the transaction, so the read models change with the rows
+            song_requests_status_changed.send(
+                sender=self.model, instances=song_requests, previous_statuses=previous_statuses
+            )
+        return song_requests
+
 
 class SongRequest(SoftDeletionModel):
     REQUESTED = 'REQUESTED'
@@ -205,25 +312,61 @@ class SongRequest(SoftDeletionModel):
 
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=REQUESTED)
     last_status_timestamp = models.DateTimeField(auto_now=True)
+    # Users asking for the song; later requests for an open song request become votes, see app.votes
+    votes = models.PositiveIntegerField(default=1)
 
     ALLOWED_TRANSITIONS = {
-        REQUESTED: [REJECTED, PENDING],
+        REQUESTED: [REJECTED, PENDING, EXPIRED],
         PENDING: [EXPIRED, PLAYED]
     }
 
+    objects = SoftDeletionModelManager.from_queryset(SongRequestQuerySet)()
+
     class Meta:
         indexes = [
-            models.Index(fields=['status', 'last_status_timestamp'], name='status_time_index'),
+            models.Index(
+                fields=['status', 'last_status_timestamp'], name='status_time_index', condition=models.Q(is_active=True),
+            ),
+            # Serve the per-event song request lists, all statuses or one, in keyset order
+            models.Index(
+                fields=['event', 'last_status_timestamp', 'id'], name='event_time_request_index',
+                condition=models.Q(is_active=True),
+            ),
+            models.Index(
+                fields=['event', 'status', 'last_status_timestamp', 'id'], name='event_status_time_index',
+                condition=models.Q(is_active=True),
+            ),
         ]
+        constraints = [
+            # One open song request per song and event
+            models.UniqueConstraint(
+                fields=['event', 'song'],
+                condition=models.Q(status__in=['REQUESTED', 'PENDING'], is_active=True),
+                name='open_song_request_unique',
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        created = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if created:
+                SongRequestVote.objects.create(song_request=self, user_id=self.user_id)
+                song_requests_created.send(sender=SongRequest, instances=[self], votes={self.id: self.votes})
 
     def change_state(self, state):
         allowed_states = self.ALLOWED_TRANSITIONS.get(self.status)
         if allowed_states is None or state not in allowed_states:
             raise ValidationError(f'Transition from state ({self.status}) to ({state}) is not allowed')
-        self.status = self.REJECTED
+        previous_status = self.status
+        self.status = state
         self.last_status_timestamp = timezone.now()
-        self.save()
-        
+        with transaction.atomic():
+            self.save()
+            song_requests_status_changed.send(
+                sender=SongRequest, instances=[self], previous_statuses={self.id: previous_status}
+            )
+
 
     def reject(self):
         self.change_state(self.REJECTED)
@@ -235,4 +378,96 @@ class SongRequest(SoftDeletionModel):
         self.change_state(self.EXPIRED)
 
     def play(self):
-        self.change_state(self.PLAYED)
\ No newline at end of file
+        self.change_state(self.PLAYED)
+
+
+class SongRequestVote(models.Model):
+    """
+    A user's vote for an open song request; the first requester's included.
+    """
+    song_request = models.ForeignKey(SongRequest, on_delete=models.CASCADE, related_name='+')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['song_request', 'user'], name='song_request_vote_unique'),
+        ]
+
+
+class SongRequestRollup(models.Model):
+    """
+    Number of song requests per event, song and status, kept up to date by app.analytics.
+    """
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='+')
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='+')
+    status = models.CharField(max_length=20, choices=SongRequest.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'song', 'status'], name='rollup_event_song_status_unique'),
+        ]
+        indexes = [
+            models.Index('event', 'status', models.F('count').desc(), name='rollup_event_count_index'),
+        ]
+
+
+class EventSummary(models.Model):
+    """
+    Song request totals of an event, kept up to date by app.analytics.
+    """
+    event = models.OneToOneField(Event, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    total = models.IntegerField(default=0)
+    requested = models.IntegerField(default=0)
+    pending = models.IntegerField(default=0)
+    played = models.IntegerField(default=0)
+    rejected = models.IntegerField(default=0)
+    expired = models.IntegerField(default=0)
+    # Sum of the seconds between request and PLAYED, over the played requests
+    played_seconds = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class EventPlayDelay(models.Model):
+    """
+    Histogram of the time from request to PLAYED per event; see app.analytics.PLAY_DELAY_BUCKETS.
+    """
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='+')
+    bucket = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'bucket'], name='play_delay_event_bucket_unique'),
+        ]
+
+
+class ArchiveJSONEncoder(DjangoJSONEncoder):
+    """
+    DjangoJSONEncoder keeping microseconds, so archived timestamps are restored exactly.
+    """
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class ArchivedRow(models.Model):
+    """
+    A row moved out of its table by app.archive, serialized so it can be restored as it was.
+    """
+    model = models.CharField(max_length=100)
+    object_id = models.BigIntegerField()
+    # The event the row belongs to, so the rows of an event are restored together
+    event_id = models.BigIntegerField(null=True, blank=True)
+    data = models.JSONField(encoder=ArchiveJSONEncoder)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['model', 'object_id'], name='archived_row_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['event_id', 'model'], name='archived_row_event_index'),
+        ]
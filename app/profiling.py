@@ -0,0 +1,139 @@
+"""
+Opt-in per-view instrumentation.
+
+ProfilingMiddleware records the query count, DB time and total time of each request
+under its resolved URL name, in a SQLite file shared by the worker processes of a host
+(PROFILE_DATABASE); `manage.py view_stats` reads them back. Views declare a
+`query_budget`, and QUERY_BUDGETS sets one for views we do not own such as the admin's;
+requests over budget are logged, or raise QueryBudgetExceeded when
+QUERY_BUDGET_ACTION is 'raise'.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from app.utils import SharedSQLiteStore
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryRecorder:
+    """
+    Database execute wrapper that counts queries and their time.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+def get_query_budget(resolver_match):
+    """
+    Return the query budget of a resolved view, from QUERY_BUDGETS or its `query_budget`, or None.
+    """
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    if resolver_match.view_name in budgets:
+        return budgets[resolver_match.view_name]
+    view_class = getattr(resolver_match.func, 'view_class', None)
+    return getattr(view_class, 'query_budget', None)
+
+
+def query_budget_exceeded(view_name, queries, budget):
+    message = f'{view_name} ran {queries} queries, over its budget of {budget}'
+    if getattr(settings, 'QUERY_BUDGET_ACTION', 'log') == 'raise':
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+class ViewStatsStore(SharedSQLiteStore):
+    """
+    Running totals per view name, so the stats of every worker end up in one place.
+    """
+    schema = [
+        'CREATE TABLE IF NOT EXISTS view_stats ('
+        'view_name TEXT PRIMARY KEY, requests INTEGER NOT NULL, queries INTEGER NOT NULL, '
+        'max_queries INTEGER NOT NULL, db_seconds REAL NOT NULL, total_seconds REAL NOT NULL, '
+        'max_seconds REAL NOT NULL, over_budget INTEGER NOT NULL)',
+    ]
+    COLUMNS = (
+        'view_name', 'requests', 'queries', 'max_queries', 'db_seconds', 'total_seconds', 'max_seconds', 'over_budget',
+    )
+
+    def record(self, view_name, queries, db_seconds, total_seconds, over_budget):
+        self.connection.execute(
+            'INSERT INTO view_stats VALUES (?, 1, ?, ?, ?, ?, ?, ?) ON CONFLICT (view_name) DO UPDATE SET '
+            'requests = requests + 1, queries = queries + excluded.queries, '
+            'max_queries = MAX(max_queries, excluded.max_queries), db_seconds = db_seconds + excluded.db_seconds, '
+            'total_seconds = total_seconds + excluded.total_seconds, '
+            'max_seconds = MAX(max_seconds, excluded.max_seconds), over_budget = over_budget + excluded.over_budget',
+            (view_name, queries, queries, db_seconds, total_seconds, total_seconds, int(over_budget)),
+        )
+
+    def stats(self):
+        rows = self.connection.execute(f'SELECT {", ".join(self.COLUMNS)} FROM view_stats').fetchall()
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+
+    def reset(self):
+        self.connection.execute('DELETE FROM view_stats')
+
+
+view_stats = ViewStatsStore(getattr(settings, 'PROFILE_DATABASE', 'profile.sqlite3'))
+
+
+class ProfilingMiddleware:
+    """
+    Record query count, DB time and total time per resolved URL name, and check query budgets.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        total_seconds = time.perf_counter() - started
+
+        resolver_match = request.resolver_match
+        if resolver_match is None:
+            return response
+        budget = get_query_budget(resolver_match)
+        over_budget = budget is not None and recorder.count > budget
+        view_stats.record(resolver_match.view_name, recorder.count, recorder.duration, total_seconds, over_budget)
+        if over_budget:
+            query_budget_exceeded(resolver_match.view_name, recorder.count, budget)
+        return response
+
+
+class QueryBudgetTestMixin:
+    """
+    TestCase mixin asserting that a request stays within the query budget of the view it resolves to.
+    """
+    def assertWithinQueryBudget(self, view_name, request):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = request()
+        self.assertEqual(response.resolver_match.view_name, view_name)
+        budget = get_query_budget(response.resolver_match)
+        self.assertIsNotNone(budget, f'{view_name} declares no query budget')
+        self.assertLessEqual(
+            recorder.count, budget, f'{view_name} ran {recorder.count} queries, over its budget of {budget}'
+        )
+        if recorder.count < budget:
+            # Not a failure: a budget covers the costliest path, such as an expired cache
+            logger.info('%s ran %d queries, %d under its budget of %d', view_name, recorder.count,
+                        budget - recorder.count, budget)
+        return response
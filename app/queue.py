@@ -0,0 +1,217 @@
+"""
+Ranked per-event song request queue.
+
+The queue is a read model kept in Django's cache: one entry per event holding the
+active (requested or pending) songs with their request counts, the votes of their song
+requests. It is built from the database with a single grouped query on a cache miss and
+then updated in place as song requests are created or change state, so reads do not
+group. Every change moves the version of the queue, the queue_updated_at of its event,
+with the event row locked until the change commits. The change learns the version it
+moved from, and once committed applies itself to a cached entry only if the entry is at
+that version, so concurrent changes are applied in commit order or not at all, and a
+skipped entry is rebuilt on its next read. Reads serve an entry only at the current
+version, so a worker whose cache missed a change rebuilds the queue instead of serving it
+stale, and the ETags the queue endpoints derive from the version cannot outlive the entry
+they describe. Changes made outside the signals, like soft deletes in the admin, move the
+version with invalidate_event_queues.
+"""
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.dispatch import receiver
+from django.utils import timezone
+
+from app.models import Event, Song, SongRequest
+from app.signals import song_requests_created, song_requests_status_changed
+
+ACTIVE_STATUSES = (SongRequest.REQUESTED, SongRequest.PENDING)
+
+
+def queue_cache():
+    return caches[getattr(settings, 'EVENT_QUEUE_CACHE', 'default')]
+
+
+def queue_timeout():
+    return getattr(settings, 'EVENT_QUEUE_TIMEOUT', 300)
+
+
+def queue_key(event_id):
+    return f'event_queue:{event_id}'
+
+
+def get_queue_version(event_id):
+    """
+    When the queue of an event last changed, or None if the event does not exist. Before its
+    first song request the queue of an event dates from the event's creation.
+    """
+    row = Event.objects.filter(id=event_id).values_list('created_at', 'queue_updated_at').first()
+    if row is None:
+        return None
+    created_at, changed_at = row
+    return changed_at or created_at
+
+
+def move_queue_versions(event_ids):
+    """
+    Move the queue versions of `event_ids`, locking their events until the current transaction
+    commits. Returns the previous and the new version of each event, by event id.
+    """
+    event_ids = sorted(set(event_ids))
+    with transaction.atomic(savepoint=False):
+        # NO KEY UPDATE, so song requests can still be inserted for the events meanwhile
+        rows = (
+            Event._base_manager.select_for_update(no_key=True)
+            .filter(id__in=event_ids).order_by('id').values_list('id', 'created_at', 'queue_updated_at')
+        )
+        now = timezone.now()
+        versions = {}
+        for event_id, created_at, changed_at in rows:
+            previous = changed_at or created_at
+            # Never the version moved from, should the clock not have moved
+            versions[event_id] = (previous, max(now, previous + datetime.timedelta(microseconds=1)))
+        for event_id, (_, version) in versions.items():
+            Event._base_manager.filter(id=event_id).update(queue_updated_at=version)
+    return versions
+
+
+def new_entry(song_id, name, artist):
+    return {
+        'song': song_id,
+        'name': name,
+        'artist': artist,
+        'requests': dict.fromkeys(ACTIVE_STATUSES, 0),
+        'last_requested': None,
+    }
+
+
+def build_event_queue(event_id):
+    """
+    Build the queue entries of an event from the database.
+    """
+    rows = (
+        SongRequest.objects
+        .filter(event_id=event_id, status__in=ACTIVE_STATUSES)
+        .values('song_id', 'song__name', 'song__artist', 'status')
+        .annotate(count=Sum('votes'), last_requested=Max('created_at'))
+    )
+    entries = {}
+    for row in rows:
+        entry = entries.get(row['song_id'])
+        if entry is None:
+            entry = entries[row['song_id']] = new_entry(row['song_id'], row['song__name'], row['song__artist'])
+        entry['requests'][row['status']] = row['count']
+        if entry['last_requested'] is None or row['last_requested'] > entry['last_requested']:
+            entry['last_requested'] = row['last_requested']
+    return entries
+
+
+def apply_changes(entries, changes):
+    """
+    Apply `changes`, (song request, previous status or None, votes moved) triples, to the
+    queue `entries` of their event. Returns False if the entries cannot be updated in place:
+    when the song request last requested for a song leaves the queue, the next one is unknown.
+    """
+    missing = {
+        song_request.song_id for song_request, _, _ in changes
+        if song_request.status in ACTIVE_STATUSES and song_request.song_id not in entries
+    }
+    songs = {song['id']: song for song in Song._base_manager.filter(id__in=missing).values('id', 'name', 'artist')}
+
+    for song_request, previous, votes in changes:
+        song_id, status = song_request.song_id, song_request.status
+        entry = entries.get(song_id)
+        if previous in ACTIVE_STATUSES:
+            if entry is None:
+                return False
+            entry['requests'][previous] -= votes
+            if status in ACTIVE_STATUSES:
+                entry['requests'][status] += votes
+                continue
+            if not any(entry['requests'].values()):
+                del entries[song_id]
+            elif song_request.created_at >= entry['last_requested']:
+                return False
+        elif status in ACTIVE_STATUSES:
+            if entry is None:
+                if song_id not in songs:
+                    return False
+                song = songs[song_id]
+                entry = entries[song_id] = new_entry(song_id, song['name'], song['artist'])
+            entry['requests'][status] += votes
+            if entry['last_requested'] is None or song_request.created_at > entry['last_requested']:
+                entry['last_requested'] = song_request.created_at
+    return True
+
+
+def rank_entries(entries):
+    ranked = [dict(entry, count=sum(entry['requests'].values())) for entry in entries.values()]
+    ranked.sort(key=lambda entry: (entry['count'], entry['last_requested']), reverse=True)
+    return ranked
+
+
+def get_event_queue(event_id, version=None):
+    """
+    Return the active songs of an event, most requested and most recent first. The cached
+    entries are used if they are at `version`, the current version of the queue.
+    """
+    if version is None:
+        version = get_queue_version(event_id)
+    cache = queue_cache()
+    cached = cache.get(queue_key(event_id))
+    if cached is not None and cached['version'] == version:
+        return rank_entries(cached['entries'])
+
+    entries = build_event_queue(event_id)
+    # Only cached if no change committed while it was built, so changes can be applied to it
+    if get_queue_version(event_id) == version:
+        cache.set(queue_key(event_id), {'version': version, 'entries': entries}, queue_timeout())
+    return rank_entries(entries)
+
+
+def update_cached_queues(versions, changes):
+    """
+    Apply committed `changes`, by event id, to the cached queues at the version they moved from.
+    """
+    cache = queue_cache()
+    for event_id, (previous, version) in versions.items():
+        cached = cache.get(queue_key(event_id))
+        if cached is None or cached['version'] != previous:
+            continue
+        if apply_changes(cached['entries'], changes[event_id]):
+            cache.set(queue_key(event_id), {'version': version, 'entries': cached['entries']}, queue_timeout())
+
+
+def update_event_queues(changes):
+    """
+    Move the versions of the queues `changes` touch, in the transaction making the changes, and
+    update their cached entries once it commits.
+    """
+    by_event = defaultdict(list)
+    for change in changes:
+        by_event[change[0].event_id].append(change)
+    versions = move_queue_versions(by_event)
+    transaction.on_commit(lambda: update_cached_queues(versions, by_event))
+
+
+def invalidate_event_queues(event_ids):
+    """
+    Move the versions of the queues of `event_ids` after their song requests changed without a
+    signal, so their cached entries are rebuilt on the next read.
+    """
+    move_queue_versions(event_ids)
+
+
+@receiver(song_requests_created, sender=SongRequest)
+def song_requests_created_handler(sender, instances, votes, **kwargs):
+    update_event_queues([(song_request, None, votes[song_request.id]) for song_request in instances])
+
+
+@receiver(song_requests_status_changed, sender=SongRequest)
+def song_requests_status_changed_handler(sender, instances, previous_statuses, **kwargs):
+    update_event_queues([
+        (song_request, previous_statuses[song_request.id], song_request.votes) for song_request in instances
+    ])
@@ -0,0 +1,90 @@
+"""
+JSON rendering and parsing on orjson.
+
+DRF's JSONRenderer and JSONParser go through the stdlib json module and call back into
+Python for every datetime. orjson encodes datetimes, dates, times and UUIDs natively and
+writes bytes directly, and only the remaining Django types (Decimals, lazy strings,
+querysets, ...) go through `default`, which follows DRF's JSONEncoder. Output matches
+DRF's compact JSON, except that indentation is always two spaces, NaN and infinities
+render as null and floats in exponent form are spelled 1e20 rather than 1e+20. The pair
+is registered in REST_FRAMEWORK; run `manage.py jsonbench` to compare it with DRF's.
+"""
+import datetime
+import decimal
+
+import orjson
+from django.conf import settings
+from django.db.models.query import QuerySet
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+LINE_SEPARATOR = '\u2028'.encode()
+PARAGRAPH_SEPARATOR = '\u2029'.encode()
+
+
+def default(obj):
+    """
+    Encode the types orjson does not know, as DRF's JSONEncoder does.
+    """
+    if isinstance(obj, Promise):
+        return force_str(obj)
+    if isinstance(obj, decimal.Decimal):
+        # Serializers coerce decimals to strings by default
+        return float(obj)
+    if isinstance(obj, datetime.timedelta):
+        return str(obj.total_seconds())
+    if isinstance(obj, QuerySet):
+        return tuple(obj)
+    if isinstance(obj, bytes):
+        return obj.decode()
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if hasattr(obj, '__getitem__'):
+        try:
+            return dict(obj)
+        except Exception:
+            pass
+    if hasattr(obj, '__iter__'):
+        return tuple(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def dumps(data, indent=False):
+    option = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    rendered = orjson.dumps(data, default=default, option=option)
+    if LINE_SEPARATOR in rendered or PARAGRAPH_SEPARATOR in rendered:
+        # Escaped like DRF does, so the output stays a strict JavaScript subset
+        rendered = rendered.replace(LINE_SEPARATOR, b'\\u2028').replace(PARAGRAPH_SEPARATOR, b'\\u2029')
+    return rendered
+
+
+def loads(data):
+    return orjson.loads(data)
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        return dumps(data, indent=bool(indent))
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            body = stream.read()
+            if encoding.lower().replace('-', '') != 'utf8':
+                body = body.decode(encoding)
+            return loads(body)
+        except (ValueError, LookupError) as exc:
+            raise ParseError(f'JSON parse error - {exc}')
@@ -0,0 +1,119 @@
+"""
+Song catalog search.
+
+On PostgreSQL, name and artist searches are served by trigram GIN indexes on
+UPPER(column), which Django's icontains lookups use directly. Other databases,
+such as SQLite in tests, fall back to an in-process trigram index over the catalog
+that is rebuilt when songs change or after SONG_SEARCH_INDEX_TTL seconds. Both
+match a song when its name or its artist contains the query, ignoring case only.
+Results are ranked by how often each song has been requested.
+"""
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, F, Q, When
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from app.models import Song, SongRequest
+from app.signals import song_requests_created
+
+NGRAM_SIZE = 3
+# Bounds the ids handed back to the database by the fallback index
+MAX_FALLBACK_MATCHES = 1000
+
+
+def normalize(text):
+    # Lowercase only, as icontains only ignores case: casefold() would also match "ss" to "ß"
+    return text.lower()
+
+
+def ngrams(text):
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+class NgramIndex:
+    """
+    Inverted trigram index answering substring queries over (id, texts) pairs.
+    A row matches when one of its texts contains the query, so texts are never joined.
+    """
+    def __init__(self, rows):
+        self.texts = {}
+        self.postings = defaultdict(set)
+        for row_id, texts in rows:
+            texts = tuple(normalize(text) for text in texts)
+            self.texts[row_id] = texts
+            for text in texts:
+                for gram in ngrams(text):
+                    self.postings[gram].add(row_id)
+        self.built_at = time.monotonic()
+
+    def search(self, query, limit=MAX_FALLBACK_MATCHES):
+        query = normalize(query)
+        grams = ngrams(query)
+        if grams:
+            postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+            candidates = set.intersection(*postings)
+        else:
+            candidates = self.texts.keys()
+        matches = []
+        for row_id in candidates:
+            if any(query in text for text in self.texts[row_id]):
+                matches.append(row_id)
+                if len(matches) >= limit:
+                    break
+        return matches
+
+
+fallback_lock = threading.Lock()
+fallback_index = None
+
+
+def get_fallback_index():
+    global fallback_index
+    ttl = getattr(settings, 'SONG_SEARCH_INDEX_TTL', 60)
+    with fallback_lock:
+        if fallback_index is None or time.monotonic() - fallback_index.built_at > ttl:
+            songs = Song.objects.values_list('id', 'name', 'artist')
+            fallback_index = NgramIndex((song_id, (name, artist)) for song_id, name, artist in songs)
+        return fallback_index
+
+
+def invalidate_fallback_index():
+    global fallback_index
+    with fallback_lock:
+        fallback_index = None
+
+
+def search_songs(query, queryset=None):
+    """
+    Filter songs whose name or artist contains `query`, most requested first.
+    """
+    songs = Song.objects.all() if queryset is None else queryset
+    if connection.vendor == 'postgresql':
+        songs = songs.filter(Q(name__icontains=query) | Q(artist__icontains=query))
+    else:
+        songs = songs.filter(id__in=get_fallback_index().search(query))
+    return songs.order_by('-request_count', 'name')
+
+
+@receiver([post_save, post_delete], sender=Song)
+def song_changed_handler(sender, **kwargs):
+    if connection.vendor != 'postgresql':
+        invalidate_fallback_index()
+
+
+@receiver(song_requests_created, sender=SongRequest)
+def song_requests_created_handler(sender, instances, votes, **kwargs):
+    counts = Counter()
+    for song_request in instances:
+        counts[song_request.song_id] += votes[song_request.id]
+    if not counts:
+        return
+    # One UPDATE whatever the number of songs
+    Song.objects.filter(id__in=counts).update(request_count=F('request_count') + Case(
+        *(When(id=song_id, then=count) for song_id, count in counts.items())
+    ))
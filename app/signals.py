@@ -0,0 +1,10 @@
+from django.dispatch import Signal
+
+# Sent with `instances` and a `votes` mapping of id to the number of requests each
+# gained after song requests are created or voted on, including bulk inserts. A song
+# request is sent once however many votes it gained, see app.votes.
+song_requests_created = Signal()
+
+# Sent with `instances` and a `previous_statuses` mapping of id to status after
+# song requests change state, including set-based updates.
+song_requests_status_changed = Signal()
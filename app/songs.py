@@ -0,0 +1,53 @@
+"""
+Song upserts keyed on the canonical Spotify track id.
+
+Resolved track ids are kept in a bounded LRU so hot songs map to their row id
+without a query; entries are dropped when the song changes.
+"""
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from app.models import Song
+from app.spotify import canonical_track_url, parse_track_id
+from app.utils import LRUCache, sanitize_fields, upsert_model_instance
+
+song_ids = LRUCache(getattr(settings, 'SONG_ID_CACHE_SIZE', 10000))
+
+
+def canonical_song_data(song_data):
+    """
+    Return song data keyed on its Spotify track id, with the URL in canonical form.
+    """
+    if not isinstance(song_data, dict):
+        raise ValidationError({'song': 'Enter a song object.'})
+    spotify_url = song_data.get('spotify_url')
+    track_id = parse_track_id(spotify_url) if isinstance(spotify_url, str) else None
+    if track_id is None:
+        raise ValidationError({'spotify_url': 'Enter a Spotify track URL.'})
+    return dict(song_data, spotify_id=track_id, spotify_url=canonical_track_url(track_id))
+
+
+def upsert_song(song_data):
+    """
+    Resolve song data to a song id, inserting or updating the song in one statement.
+    Songs already resolved by this process are answered from the LRU without a query.
+    Soft deleted songs are not available, like in the batch endpoint.
+    """
+    song_data = canonical_song_data(song_data)
+    # The canonical URL is built from a parsed track id, so it is valid already
+    Song(**sanitize_fields(song_data, Song)).clean_fields(exclude=['spotify_id', 'spotify_url'])
+    song_id = song_ids.get(song_data['spotify_id'])
+    if song_id is None:
+        song_id = upsert_model_instance(song_data, Song, 'spotify_id')
+        if song_id is None:
+            raise ValidationError({'song': 'Song is no longer available.'})
+        song_ids.set(song_data['spotify_id'], song_id)
+    return song_id
+
+
+@receiver(post_save, sender=Song)
+def song_changed_handler(sender, instance, **kwargs):
+    if instance.spotify_id:
+        song_ids.discard(instance.spotify_id)
@@ -0,0 +1,21 @@
+"""
+Canonical Spotify track keys.
+
+Spotify links come in many shapes (locale prefixes, ?si= tracking parameters,
+spotify:track: URIs); they all reduce to the track id, which songs are keyed on.
+"""
+import re
+
+TRACK_URL_PATTERN = re.compile(
+    r'^(?:https?://open\.spotify\.com/(?:intl-[\w-]+/)?(?:embed/)?track/|spotify:track:)'
+    r'(?P<track_id>[A-Za-z0-9]+)(?:[/?#].*)?$'
+)
+
+
+def parse_track_id(url):
+    match = TRACK_URL_PATTERN.match((url or '').strip())
+    return match.group('track_id') if match else None
+
+
+def canonical_track_url(track_id):
+    return f'https://open.spotify.com/track/{track_id}'
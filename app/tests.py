@@ -1,3 +1,1371 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import decimal
+import importlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import uuid
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.admin import AdminSite
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import DataError, connection
+from django.http import JsonResponse
+from django.middleware.csrf import get_token
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from app.admin import CustomUserAdmin, SongAdmin, SongRequestAdmin
+from app.analytics import rebuild
+from app.authentication import token_key
+from app.backends import backoff_keys, login_backoff, record_login_failure
+from app.catalog import IMPORTED_FIELDS, copy_upsert_sql, song_import_csv, upsert_songs, validate_song_row
+from app.checks import check_shared_caches
+from app.compression import CompressionMiddleware
+from app.geo import encode_geohash, prefix_range
+from app.hub import RESET, SongRequestHub
+from app.images import RENDITIONS, image_path, image_storage, rendition_name, store_image
+from app.live import IntervalIndex, is_event_live, live_events_cache
+from app.management.commands.loadtest import Command as LoadtestCommand
+from app.models import (
+    ArchivedRow, CustomUser, DjProfile, Event, EventSummary, Location, Song, SongRequest,
+    SongRequestRollup, SongRequestVote,
+)
+from app.profiling import QueryBudgetExceeded, QueryBudgetTestMixin
+from app.queue import build_event_queue, get_event_queue, queue_cache, queue_key, rank_entries
+from app.renderers import FastJSONParser, FastJSONRenderer
+from app.signals import song_requests_created, song_requests_status_changed
+from app.songs import song_ids, upsert_song
+from app.throttling import SongRequestThrottle, bucket_store
+from app.utils import get_write_plan, increment_counters, sanitize_fields
+from app.votes import ALREADY_VOTED, CREATED, VOTED, submit_song_requests
+
+
+def create_event(suffix=''):
+    """
+    A DJ with a profile, a guest, and a live event of the DJ at a location.
+    """
+    dj = CustomUser.objects.create_user(email=f'dj{suffix}@example.com', password='test123', name=f'dj{suffix}')
+    DjProfile.objects.create(user=dj, name=f'DJ{suffix}')
+    guest = CustomUser.objects.create_user(
+        email=f'guest{suffix}@example.com', password='test123', name=f'guest{suffix}',
+    )
+    location = Location.objects.create(name=f'Club{suffix}', latitude=44.4, longitude=26.1)
+    event = Event.objects.create(name=f'Night{suffix}', dj=dj, location=location)
+    return dj, guest, location, event
+
+
+def create_song(suffix=''):
+    return Song.objects.create(
+        spotify_url=f'https://open.spotify.com/track/{suffix}',
+        artist=f'Artist {suffix}',
+        name=f'Song {suffix}',
+        image_url='https://i.scdn.co/image/cover.png',
+    )
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class EventTestCase(TestCase):
+    """
+    Starts every test with create_event's rows and empty caches: the default cache, which holds
+    the queues, token snapshots and live events, and the song ids resolved by this process. Song
+    requests are not throttled; throttling tests patch in the rates they need.
+    """
+    def setUp(self):
+        caches['default'].clear()
+        song_ids.clear()
+        self.enterContext(mock.patch.object(SongRequestThrottle, 'rates', {}))
+        self.dj, self.guest, self.location, self.event = create_event()
+
+    def authorization(self, user):
+        token, _ = Token.objects.get_or_create(user=user)
+        return {'HTTP_AUTHORIZATION': f'Token {token.key}'}
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AdminChangelistQueryCountTests(TestCase):
+    """
+    The admin changelists must run a fixed number of queries, whatever the number of rows.
+    """
+    def setUp(self):
+        admin = CustomUser.objects.create_superuser(email='admin@example.com', password='test123')
+        self.client.force_login(admin)
+        self.seeded = 0
+
+    def seed(self, count):
+        for i in range(self.seeded, self.seeded + count):
+            dj, guest, _, event = create_event(i)
+            SongRequest.objects.create(song=create_song(i), user=guest, dj=dj, event=event)
+        self.seeded += count
+
+    def changelist_queries(self, model_name):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse(f'admin:app_{model_name}_changelist'))
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def assertConstantQueries(self, model_name):
+        self.seed(5)
+        small = self.changelist_queries(model_name)
+        self.seed(20)
+        large = self.changelist_queries(model_name)
+        self.assertEqual(small, large, f'{model_name} changelist queries grow with the number of rows')
+
+    def test_customuser_changelist(self):
+        self.assertConstantQueries('customuser')
+
+    def test_djprofile_changelist(self):
+        self.assertConstantQueries('djprofile')
+
+    def test_event_changelist(self):
+        self.assertConstantQueries('event')
+
+    def test_songrequest_changelist(self):
+        self.assertConstantQueries('songrequest')
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, EventTestCase):
+    """
+    The hot views must stay within their declared query budgets.
+    """
+    def test_login(self):
+        self.assertWithinQueryBudget('login', lambda: self.client.post(
+            reverse('login'), {'email': 'guest@example.com', 'password': 'test123'}, content_type='application/json',
+        ))
+
+    def test_create_song_request(self):
+        data = {
+            'song': {
+                'spotify_url': 'https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC',
+                'artist': 'Artist',
+                'name': 'Song',
+                'image_url': 'https://i.scdn.co/image/cover.png',
+            },
+            'user': self.guest.id,
+            'dj': self.dj.id,
+            'event': self.event.id,
+        }
+        response = self.assertWithinQueryBudget('create:create_song_request', lambda: self.client.post(
+            reverse('create:create_song_request'), data, content_type='application/json',
+        ))
+        self.assertEqual(response.status_code, 201)
+
+    def test_event_song_requests_pages(self):
+        SongRequest.objects.bulk_create([
+            SongRequest(song=create_song(i), user=self.guest, dj=self.dj, event=self.event) for i in range(5)
+        ])
+        url = reverse('event_song_requests', args=[self.event.id])
+        headers = self.authorization(self.dj)
+        ids, cursor = [], None
+        while True:
+            params = {'limit': 2, 'fields': 'id,song_name', **({'cursor': cursor} if cursor else {})}
+            # Every page with the token snapshot expired, the most a page can cost
+            caches['default'].clear()
+            response = self.assertWithinQueryBudget('event_song_requests', lambda: self.client.get(
+                url, params, **headers,
+            ))
+            self.assertEqual(response.status_code, 200)
+            ids += [row['id'] for row in response.json()['results']]
+            cursor = response.json()['next']
+            if cursor is None:
+                break
+        self.assertEqual(ids, sorted(SongRequest.objects.values_list('id', flat=True), reverse=True))
+
+    def test_event_detail(self):
+        self.assertWithinQueryBudget('event_detail', lambda: self.client.get(
+            reverse('event_detail', args=[self.event.id]),
+        ))
+
+    def test_admin_changelists(self):
+        admin = CustomUser.objects.create_superuser(email='admin@example.com', password='test123')
+        self.client.force_login(admin)
+        for model_name in ('customuser', 'djprofile', 'location', 'event', 'song', 'songrequest'):
+            with self.subTest(model_name=model_name):
+                view_name = f'admin:app_{model_name}_changelist'
+                self.assertWithinQueryBudget(view_name, lambda: self.client.get(reverse(view_name)))
+
+    @override_settings(QUERY_BUDGETS={'event_detail': 10})
+    def test_slack_is_logged(self):
+        with self.assertLogs('app.profiling', 'INFO') as logs:
+            self.assertWithinQueryBudget('event_detail', lambda: self.client.get(
+                reverse('event_detail', args=[self.event.id]), **self.authorization(self.guest),
+            ))
+        self.assertIn('under its budget of 10', logs.output[0])
+
+    @override_settings(
+        MIDDLEWARE=['app.profiling.ProfilingMiddleware', *settings.MIDDLEWARE],
+        QUERY_BUDGET_ACTION='raise',
+        QUERY_BUDGETS={'login': 0},
+    )
+    def test_middleware_raises_over_budget(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.post(reverse('login'), {'email': 'guest@example.com', 'password': 'test123'},
+                             content_type='application/json')
+
+
+class KeysetListTests(EventTestCase):
+    """
+    The song requests of an event are listed to its DJ only, and bad parameters are a 400.
+    """
+    def test_other_djs_event(self):
+        other_dj, _, _, _ = create_event('2')
+        response = self.client.get(
+            reverse('event_song_requests', args=[self.event.id]), **self.authorization(other_dj),
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {'detail': 'Event does not exist'})
+
+    def test_invalid_parameters(self):
+        url = reverse('event_song_requests', args=[self.event.id])
+        for params in [{'status': 'LOST'}, {'limit': 'many'}, {'cursor': 'garbage'}]:
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(url, params, **self.authorization(self.dj)).status_code, 400)
+
+
+class ConditionalGetTests(EventTestCase):
+    """
+    The read endpoints must answer 304 while their version marker has not moved.
+    """
+    def test_event_detail(self):
+        url = reverse('event_detail', args=[self.event.id])
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(context), 1)
+
+        self.location.name = 'Other club'
+        self.location.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['location']['name'], 'Other club')
+
+    def test_event_queue(self):
+        url = reverse('event_queue', args=[self.event.id])
+        headers = self.authorization(self.guest)
+        etag = self.client.get(url, **headers)['ETag']
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, **headers)
+        self.assertEqual(response.status_code, 304)
+        # Only the version of the queue
+        self.assertEqual(len(context), 1)
+
+        song = create_song(1)
+        submit_song_requests([{'song_id': song.id, 'user_id': self.guest.id, 'dj_id': self.dj.id,
+                               'event_id': self.event.id}])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([entry['song'] for entry in response.json()['queue']], [song.id])
+
+    def test_compression(self):
+        url = reverse('event_detail', args=[self.event.id])
+        self.event.name = 'Night ' * 100
+        self.event.save()
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertTrue(response['ETag'].startswith('W/'))
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='br;q=0, gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_pages_are_not_compressed(self):
+        admin = CustomUser.objects.create_superuser(email='admin@example.com', password='test123')
+        for url in [reverse('admin:login'), reverse('admin:app_event_changelist')]:
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, br')
+                self.assertEqual(response.status_code, 200)
+                self.assertGreater(len(response.content), CompressionMiddleware.MIN_LENGTH)
+                self.assertFalse(response.has_header('Content-Encoding'))
+            self.client.force_login(admin)
+
+    def test_responses_using_the_csrf_token_are_not_compressed(self):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='br')
+        get_token(request)
+        response = JsonResponse({'csrf': 'x' * 500})
+        response = CompressionMiddleware(lambda request: response).process_response(request, response)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_unknown_event_queue(self):
+        response = self.client.get(reverse('event_queue', args=[self.event.id + 1]), **self.authorization(self.guest))
+        self.assertEqual(response.status_code, 404)
+
+
+class WritePlanTests(TestCase):
+    """
+    Request data must map onto the writable fields of a model through a plan computed once.
+    """
+    SONG = {
+        'spotify_url': 'https://open.spotify.com/track/1',
+        'artist': 'Artist',
+        'name': 'Song',
+        'image_url': 'https://i.scdn.co/image/cover.png',
+    }
+
+    def test_plan(self):
+        plan = {field.name: field for field in get_write_plan(Song)}
+        # No primary key, and nothing the model or the database fills in
+        self.assertEqual(set(plan), {'is_active', 'spotify_url', 'artist', 'name', 'image_url'})
+        self.assertFalse(plan['is_active'].required)
+        self.assertTrue(plan['spotify_url'].required and plan['spotify_url'].unique)
+
+    def test_plan_is_cached(self):
+        get_write_plan(Song)
+        hits = get_write_plan.cache_info().hits
+        self.assertIs(get_write_plan(Song), get_write_plan(Song))
+        self.assertEqual(get_write_plan.cache_info().hits, hits + 2)
+
+    def test_missing_fields_are_reported_together(self):
+        with self.assertRaises(ValidationError) as context:
+            sanitize_fields({'artist': 'Artist'}, Song)
+        self.assertEqual(set(context.exception.message_dict), {'spotify_url', 'name', 'image_url'})
+        self.assertEqual(context.exception.message_dict['name'], ['This field is required for Song.'])
+
+    def test_extra_keys_are_ignored(self):
+        data = dict(self.SONG, id=5, spotify_id='1', request_count=10, unknown='value')
+        self.assertEqual(sanitize_fields(data, Song), self.SONG)
+
+    def test_relations(self):
+        dj, guest, _, event = create_event()
+        fields = sanitize_fields({'song_id': 1, 'user': guest.id, 'dj': dj, 'event_id': event.id}, SongRequest)
+        # Ids go to the columns, instances to the relations
+        self.assertEqual(fields, {'song_id': 1, 'user_id': guest.id, 'dj': dj, 'event_id': event.id})
+        with self.assertRaises(ValidationError) as context:
+            sanitize_fields({'song': 1}, SongRequest)
+        self.assertEqual(set(context.exception.message_dict), {'user', 'dj', 'event'})
+
+
+class ImportSongsTests(TestCase):
+    """
+    Catalog imports must skip invalid rows and leave songs as they were when run again.
+    """
+    def test_import_csv(self):
+        catalog = tempfile.NamedTemporaryFile('w', suffix='.csv')
+        self.addCleanup(catalog.close)
+        catalog.write(
+            'spotify_url,artist,name,image_url\n'
+            'https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC?si=1,Artist,Song,https://i.scdn.co/image/a.png\n'
+            'https://example.com/track/1,Artist,Song,https://i.scdn.co/image/b.png\n'
+            'spotify:track:1301WleyT98MSxVHPZCA6M,Other artist,Other song,https://i.scdn.co/image/c.png\n'
+        )
+        catalog.flush()
+        for _ in range(2):
+            stderr = io.StringIO()
+            call_command('import_songs', catalog.name, '--chunk-size', '2', stdout=io.StringIO(), stderr=stderr)
+            self.assertIn('Line 3:', stderr.getvalue())
+        self.assertEqual(
+            sorted(Song.objects.values_list('spotify_url', 'name')),
+            [('https://open.spotify.com/track/1301WleyT98MSxVHPZCA6M', 'Other song'),
+             ('https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC', 'Song')],
+        )
+
+    def test_import_jsonl_with_wrong_types(self):
+        song = {'spotify_url': 'spotify:track:1301WleyT98MSxVHPZCA6M', 'artist': 'Artist', 'name': 'Song',
+                'image_url': 'https://i.scdn.co/image/a.png'}
+        rows = [dict(song, spotify_url=42), dict(song, spotify_url=None), dict(song, name=['Song']),
+                dict(song, image_url=5), ['not', 'an', 'object'], song]
+        catalog = io.StringIO(''.join(json.dumps(row) + '\n' for row in rows) + 'not json\n')
+        stderr = io.StringIO()
+        with mock.patch('sys.stdin', catalog):
+            call_command('import_songs', '-', '--format', 'jsonl', stdout=io.StringIO(), stderr=stderr)
+        self.assertEqual([line.partition(':')[0] for line in stderr.getvalue().splitlines()],
+                         ['Line 1', 'Line 2', 'Line 3', 'Line 4', 'Line 5', 'Line 7'])
+        self.assertEqual(Song.objects.get().spotify_id, '1301WleyT98MSxVHPZCA6M')
+
+    def test_upsert_keeps_the_last_row_of_a_track(self):
+        rows = [
+            {'spotify_url': f'spotify:track:{track_id}', 'artist': 'Artist', 'name': name,
+             'image_url': 'https://i.scdn.co/image/a.png'}
+            for track_id, name in [('1301WleyT98MSxVHPZCA6M', 'First'), ('4uLU6hMCjMI75M1A2tKUQC', 'Song'),
+                                   ('1301WleyT98MSxVHPZCA6M', 'Last')]
+        ]
+        with mock.patch.object(connection, 'vendor', 'postgresql'), \
+                mock.patch('app.catalog.copy_upsert_songs') as copy_upsert:
+            self.assertEqual(upsert_songs([validate_song_row(row) for row in rows]), 2)
+        [songs] = copy_upsert.call_args.args
+        self.assertEqual([song.name for song in songs], ['Last', 'Song'])
+
+    def test_song_import_csv(self):
+        song = validate_song_row({
+            'spotify_url': 'spotify:track:1301WleyT98MSxVHPZCA6M', 'artist': 'Artist, "quoted"', 'name': 'Line\nbreak',
+            'image_url': 'https://i.scdn.co/image/a.png',
+        })
+        self.assertEqual(list(csv.reader(song_import_csv([song]))), [[
+            '1301WleyT98MSxVHPZCA6M', 'https://open.spotify.com/track/1301WleyT98MSxVHPZCA6M', 'Artist, "quoted"',
+            'Line\nbreak', 'https://i.scdn.co/image/a.png',
+        ]])
+
+    def test_copy_upsert_sql(self):
+        setup, copy, merge, defaults = copy_upsert_sql(connection)
+        self.assertEqual(setup, [
+            'DROP TABLE IF EXISTS pg_temp.song_import',
+            'CREATE TEMPORARY TABLE song_import ("spotify_id" varchar(64), "spotify_url" varchar(200), '
+            '"artist" varchar(255), "name" varchar(255), "image_url" varchar(200)) ON COMMIT DROP',
+        ])
+        self.assertEqual(
+            copy, 'COPY song_import ("spotify_id", "spotify_url", "artist", "name", "image_url") FROM STDIN '
+                  'WITH (FORMAT csv)',
+        )
+        imported = '"spotify_id", "spotify_url", "artist", "name", "image_url"'
+        defaulted = [field for field in Song._meta.concrete_fields
+                     if not field.primary_key and field.name not in IMPORTED_FIELDS]
+        columns = ', '.join(f'"{field.column}"' for field in defaulted)
+        self.assertEqual(merge, (
+            f'INSERT INTO "app_song" ({imported}, {columns}) '
+            f'SELECT {imported}, {", ".join(["%s"] * len(defaulted))} FROM song_import '
+            'ON CONFLICT ("spotify_id") DO UPDATE SET "spotify_url" = EXCLUDED."spotify_url", '
+            '"artist" = EXCLUDED."artist", "name" = EXCLUDED."name", "image_url" = EXCLUDED."image_url" '
+            'WHERE ("app_song"."spotify_url", "app_song"."artist", "app_song"."name", "app_song"."image_url") '
+            'IS DISTINCT FROM (EXCLUDED."spotify_url", EXCLUDED."artist", EXCLUDED."name", EXCLUDED."image_url")'
+        ))
+        self.assertEqual(len(defaults), len(defaulted))
+
+
+class CreateSongRequestBatchTests(EventTestCase):
+    """
+    Batches must upsert their songs once and report every item on its own.
+    """
+    def item(self, track_id, **overrides):
+        return dict({
+            'song': {
+                'spotify_url': f'https://open.spotify.com/track/{track_id}',
+                'artist': 'Artist',
+                'name': f'Song {track_id}',
+                'image_url': 'https://i.scdn.co/image/cover.png',
+            },
+            'user': self.guest.id,
+            'dj': self.dj.id,
+            'event': self.event.id,
+        }, **overrides)
+
+    def post(self, items):
+        return self.client.post(reverse('create:create_song_requests'), items, content_type='application/json')
+
+    def test_batch(self):
+        response = self.post([
+            self.item('4uLU6hMCjMI75M1A2tKUQC'),
+            self.item('1301WleyT98MSxVHPZCA6M'),
+            self.item('1301WleyT98MSxVHPZCA6M', user=self.dj.id),
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Song.objects.count(), 2)
+        self.assertEqual(SongRequest.objects.count(), 2)
+
+    def test_partial_batch(self):
+        response = self.post([
+            self.item('4uLU6hMCjMI75M1A2tKUQC'),
+            self.item('1301WleyT98MSxVHPZCA6M', event='x'),
+            self.item('7ouMYWpwJ422jRcDASZB7P', user=0),
+            'not an item',
+        ])
+        self.assertEqual(response.status_code, 207)
+        results = response.json()['results']
+        self.assertIn('success', results[0])
+        self.assertEqual(
+            [result['error'] for result in results[1:]],
+            ['User, dj and event must be ids', 'User or dj does not exist', 'Song request must be an object'],
+        )
+        self.assertEqual(SongRequest.objects.count(), 1)
+
+    def test_empty_batch(self):
+        self.assertEqual(self.post([]).status_code, 400)
+
+    def test_other_djs_event(self):
+        other_dj, _, _, _ = create_event('2')
+        response = self.post([self.item('4uLU6hMCjMI75M1A2tKUQC', dj=other_dj.id)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['results'], [{'index': 0, 'error': 'Dj is not the DJ of the event'}])
+        self.assertFalse(SongRequest.objects.exists())
+
+    def test_items_are_throttled_one_by_one(self):
+        bucket_store.clear()
+        self.addCleanup(bucket_store.clear)
+        url = reverse('create:create_song_requests')
+        items = [self.item(track_id) for track_id in ('1', '2', '3', '4')]
+        with mock.patch.object(SongRequestThrottle, 'rates', {'ip': '5/min'}):
+            self.assertEqual(self.client.post(url, items, content_type='application/json').status_code, 201)
+            response = self.client.post(url, items[:2], content_type='application/json')
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('Retry-After', response)
+            bucket_store.clear()
+            # Over the capacity, so never let through
+            response = self.client.post(url, items + items[:2], content_type='application/json')
+            self.assertEqual(response.status_code, 429)
+            self.assertNotIn('Retry-After', response)
+        self.assertEqual(SongRequest.objects.count(), 4)
+
+    def test_buckets_key_on_the_remote_address(self):
+        request = RequestFactory().post(
+            '/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='203.0.113.9', HTTP_X_DEVICE_ID='phone',
+        )
+        buckets = dict(SongRequestThrottle().song_request_buckets(request, {'event': self.event.id}))
+        # The forwarded address is the client's to set without a proxy in front, and so is the device
+        self.assertEqual(buckets, {'ip': '10.0.0.1', 'device': '10.0.0.1:phone', 'event': self.event.id})
+
+
+class EventQueueTests(EventTestCase):
+    """
+    Queues must rank by votes, and be updated in place as song requests change without
+    serving entries of an older version.
+    """
+    def request(self, song, user):
+        with self.captureOnCommitCallbacks(execute=True):
+            submit_song_requests([
+                {'song_id': song.id, 'user_id': user.id, 'dj_id': self.dj.id, 'event_id': self.event.id}
+            ])
+
+    def change_state(self, song, state):
+        with self.captureOnCommitCallbacks(execute=True):
+            SongRequest.objects.filter(song=song).change_state(state)
+
+    def ranked(self):
+        return [(entry['song'], entry['count']) for entry in get_event_queue(self.event.id)]
+
+    def test_ranking(self):
+        first, second = create_song(1), create_song(2)
+        self.request(first, self.guest)
+        self.request(second, self.guest)
+        self.request(second, self.dj)
+        self.assertEqual(self.ranked(), [(second.id, 2), (first.id, 1)])
+
+    def test_changes_update_the_cached_queue(self):
+        first, second, third = create_song(1), create_song(2), create_song(3)
+        self.request(first, self.guest)
+        self.request(second, self.guest)
+        get_event_queue(self.event.id)
+
+        self.request(third, self.guest)
+        self.request(first, self.dj)
+        self.change_state(second, SongRequest.PENDING)
+        self.change_state(first, SongRequest.REJECTED)
+        with self.assertNumQueries(1):
+            ranked = self.ranked()
+        self.assertEqual(ranked, [(third.id, 1), (second.id, 1)])
+        self.assertEqual(get_event_queue(self.event.id), rank_entries(build_event_queue(self.event.id)))
+
+    def test_entries_of_an_older_version_are_rebuilt(self):
+        first, second = create_song(1), create_song(2)
+        self.request(first, self.guest)
+        get_event_queue(self.event.id)
+        # As in a worker whose cache the change did not reach
+        with mock.patch('app.queue.update_cached_queues'):
+            self.request(second, self.guest)
+        self.assertIsNotNone(queue_cache().get(queue_key(self.event.id)))
+        self.assertEqual(len(get_event_queue(self.event.id)), 2)
+
+    def test_changes_apply_only_to_the_version_they_moved_from(self):
+        first, second = create_song(1), create_song(2)
+        self.request(first, self.guest)
+        with self.captureOnCommitCallbacks() as callbacks:
+            submit_song_requests([
+                {'song_id': second.id, 'user_id': self.guest.id, 'dj_id': self.dj.id, 'event_id': self.event.id}
+            ])
+        # Cached after the change committed, so it must not count the change again
+        self.assertEqual(len(get_event_queue(self.event.id)), 2)
+        callbacks[0]()
+        self.assertEqual(self.ranked(), [(second.id, 1), (first.id, 1)])
+
+    def test_admin_soft_delete_moves_the_version(self):
+        first, second = create_song(1), create_song(2)
+        self.request(first, self.guest)
+        self.request(second, self.guest)
+        get_event_queue(self.event.id)
+        admin = SongRequestAdmin(SongRequest, AdminSite())
+        admin.soft_delete_queryset(SongRequest.objects.filter(song=first))
+        self.assertEqual(self.ranked(), [(second.id, 1)])
+        admin.delete_model(None, SongRequest.objects.get(song=second))
+        self.assertEqual(self.ranked(), [])
+
+
+class ExpireSongRequestsTests(EventTestCase):
+    """
+    The sweeper must expire open song requests that are stale or of ended events, and nothing else.
+    """
+    def setUp(self):
+        super().setUp()
+        self.songs = [create_song(i) for i in range(3)]
+        submit_song_requests([
+            {'song_id': song.id, 'user_id': self.guest.id, 'dj_id': self.dj.id, 'event_id': self.event.id}
+            for song in self.songs
+        ])
+        SongRequest.objects.filter(song=self.songs[2]).change_state(SongRequest.REJECTED)
+
+    def expire(self):
+        out = io.StringIO()
+        call_command('expire_song_requests', '--batch-size', '1', stdout=out)
+        return out.getvalue()
+
+    def statuses(self):
+        return dict(SongRequest.objects.values_list('song_id', 'status'))
+
+    def test_stale_requests(self):
+        old = timezone.now() - timezone.timedelta(minutes=settings.SONG_REQUEST_MAX_AGE_MINUTES + 1)
+        SongRequest.objects.filter(song__in=self.songs[1:]).update(last_status_timestamp=old)
+        self.assertIn('Expired 1 song requests', self.expire())
+        self.assertEqual(self.statuses(), {
+            self.songs[0].id: SongRequest.REQUESTED,
+            self.songs[1].id: SongRequest.EXPIRED,
+            self.songs[2].id: SongRequest.REJECTED,
+        })
+        self.assertIn('Expired 0 song requests', self.expire())
+
+    def test_ended_events(self):
+        Event.objects.filter(id=self.event.id).update(end=timezone.now() - timezone.timedelta(minutes=1))
+        output = self.expire()
+        self.assertIn('Expired 2 song requests', output)
+        self.assertIn('backlog 0', output)
+        self.assertEqual(self.statuses()[self.songs[2].id], SongRequest.REJECTED)
+        self.assertEqual(get_event_queue(self.event.id), [])
+
+
+class TriageSongRequestsTests(EventTestCase):
+    """
+    Triage must move the song requests that allow the transition, with one UPDATE per status
+    moved from, and report the others back.
+    """
+    def setUp(self):
+        super().setUp()
+        self.songs = [create_song(i) for i in range(2)]
+        results = submit_song_requests([
+            {'song_id': song.id, 'user_id': self.guest.id, 'dj_id': self.dj.id, 'event_id': self.event.id}
+            for song in self.songs
+        ])
+        self.ids = [song_request_id for song_request_id, _ in results]
+        self.changes = []
+        song_requests_status_changed.connect(self.status_changed, sender=SongRequest)
+        self.addCleanup(song_requests_status_changed.disconnect, self.status_changed, sender=SongRequest)
+
+    def status_changed(self, sender, instances, previous_statuses, **kwargs):
+        self.changes.append(sorted((instance.id, previous_statuses[instance.id]) for instance in instances))
+
+    def triage(self, user, state, ids):
+        return self.client.post(
+            reverse('triage_song_requests'), {'status': state, 'ids': ids}, content_type='application/json',
+            **self.authorization(user),
+        )
+
+    def test_triage(self):
+        response = self.triage(self.dj, SongRequest.PENDING, self.ids)
+        self.assertEqual(response.json(), {'moved': self.ids, 'rejected': []})
+        self.assertEqual(self.changes, [[(song_request_id, SongRequest.REQUESTED) for song_request_id in self.ids]])
+        response = self.triage(self.dj, SongRequest.PLAYED, self.ids[:1])
+        self.assertEqual(response.json(), {'moved': self.ids[:1], 'rejected': []})
+
+    def test_disallowed_transition(self):
+        response = self.triage(self.dj, SongRequest.PLAYED, self.ids)
+        self.assertEqual(response.json(), {'moved': [], 'rejected': self.ids})
+        self.assertEqual(set(SongRequest.objects.values_list('status', flat=True)), {SongRequest.REQUESTED})
+        self.assertEqual(self.changes, [])
+
+    def test_other_djs_requests(self):
+        other_dj = create_event(1)[0]
+        self.assertEqual(self.triage(other_dj, SongRequest.REJECTED, self.ids).json()['rejected'], self.ids)
+        self.assertEqual(self.triage(self.guest, SongRequest.REJECTED, self.ids).status_code, 403)
+
+    def test_one_update_without_reading_first(self):
+        with CaptureQueriesContext(connection) as context:
+            moved = SongRequest.objects.filter(id__in=self.ids).change_state(SongRequest.PENDING)
+        self.assertEqual(sorted(song_request.id for song_request in moved), self.ids)
+        statements = [query['sql'].split()[0] for query in context if '"app_songrequest"' in query['sql']]
+        self.assertEqual(statements, ['UPDATE'])
+
+    def test_rows_moved_from_different_statuses(self):
+        SongRequest.objects.filter(id=self.ids[0]).change_state(SongRequest.PENDING)
+        self.changes.clear()
+        moved = SongRequest.objects.filter(id__in=self.ids).change_state(SongRequest.EXPIRED)
+        self.assertEqual(self.changes, [[(self.ids[0], SongRequest.PENDING), (self.ids[1], SongRequest.REQUESTED)]])
+        # Built from RETURNING, with the values and types a read gives
+        stored = {song_request.id: song_request for song_request in SongRequest.objects.filter(id__in=self.ids)}
+        for song_request in moved:
+            for field in ('song_id', 'user_id', 'dj_id', 'event_id', 'created_at', 'votes', 'status'):
+                self.assertEqual(getattr(song_request, field), getattr(stored[song_request.id], field))
+
+
+class NearbyEventsTests(EventTestCase):
+    """
+    The nearby search must find live events within the radius, also across the antimeridian.
+    """
+    def nearby(self, latitude, longitude, radius=10):
+        return self.client.get(reverse('nearby_events'), {'latitude': latitude, 'longitude': longitude, 'radius': radius})
+
+    def test_geohash(self):
+        self.assertEqual(encode_geohash(57.64911, 10.40744), 'u4pruydqq')
+        self.assertEqual(prefix_range('u4z'), ('u4z', 'u5'))
+        self.assertEqual(prefix_range('zz'), ('zz', None))
+
+    def test_nearby(self):
+        response = self.nearby(44.41, 26.11, radius=5)
+        self.assertEqual(response.status_code, 200)
+        [event] = response.json()['events']
+        self.assertEqual(event['id'], self.event.id)
+        self.assertLess(event['distance_km'], 5)
+        self.assertEqual(self.nearby(44.41, 26.11, radius=1).json()['events'], [])
+        self.assertEqual(self.nearby(44.4, 27.5).json()['events'], [])
+
+    def test_ended_events(self):
+        Event.objects.filter(id=self.event.id).update(end=timezone.now() - timezone.timedelta(minutes=1))
+        self.assertEqual(self.nearby(44.4, 26.1).json()['events'], [])
+
+    def test_antimeridian(self):
+        location = Location.objects.create(name='Island', latitude=0, longitude=179.99)
+        event = Event.objects.create(name='Dateline', dj=self.dj, location=location)
+        self.assertEqual([event['id'] for event in self.nearby(0, -179.99).json()['events']], [event.id])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.nearby(91, 0).status_code, 400)
+        self.assertEqual(self.nearby(0, 0, radius=0).status_code, 400)
+        self.assertEqual(self.client.get(reverse('nearby_events'), {'latitude': 'x'}).status_code, 400)
+
+
+class LiveEventsTests(EventTestCase):
+    """
+    Each process must keep its live events index until their version changes.
+    """
+    def test_interval_index(self):
+        intervals = [(start, start + length, (start, length)) for start in range(0, 50, 3) for length in (0, 2, 7)]
+        index = IntervalIndex(intervals)
+        for start, end in [(0, 0), (5, 9), (20, 20), (48, 60), (60, 70)]:
+            expected = {value for low, high, value in intervals if low <= end and high >= start}
+            self.assertEqual(set(index.overlapping(start, end)), expected)
+
+    def test_index_is_kept_until_the_version_changes(self):
+        self.assertTrue(is_event_live(self.event.id))
+        with self.assertNumQueries(0):
+            self.assertTrue(is_event_live(self.event.id))
+
+        # Another process's change drops the version, which this process sees on its next lookup
+        Event.objects.filter(id=self.event.id).update(end=timezone.now() - timezone.timedelta(minutes=1))
+        live_events_cache().clear()
+        with self.assertNumQueries(1):
+            self.assertFalse(is_event_live(self.event.id))
+
+    def test_event_changes_drop_the_version(self):
+        self.assertTrue(is_event_live(self.event.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.event.end = timezone.now() - timezone.timedelta(minutes=1)
+            self.event.save()
+        self.assertFalse(is_event_live(self.event.id))
+
+
+class SongSearchTests(EventTestCase):
+    """
+    Searches must match the name or the artist on its own, ignoring case only, most requested first.
+    """
+    def setUp(self):
+        super().setUp()
+        self.street = Song.objects.create(
+            spotify_url='https://open.spotify.com/track/1', artist='Bob', name='Straße A',
+            image_url='https://i.scdn.co/image/cover.png',
+        )
+        self.other = Song.objects.create(
+            spotify_url='https://open.spotify.com/track/2', artist='Straße Band', name='Other',
+            image_url='https://i.scdn.co/image/cover.png',
+        )
+
+    def search(self, query):
+        response = self.client.get(reverse('song_search'), {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [song['id'] for song in response.json()['songs']]
+
+    def test_search(self):
+        self.assertEqual(self.search('STRAßE'), [self.other.id, self.street.id])
+        self.assertEqual(self.search('bob'), [self.street.id])
+        # Only within one column, and without case folding, as icontains does
+        self.assertEqual(self.search('a bob'), [])
+        self.assertEqual(self.search('strasse'), [])
+
+    def test_ranked_by_requests(self):
+        with CaptureQueriesContext(connection) as context:
+            submit_song_requests([
+                {'song_id': song.id, 'user_id': user.id, 'dj_id': self.dj.id, 'event_id': self.event.id}
+                for song, user in [(self.street, self.guest), (self.street, self.dj), (self.other, self.guest)]
+            ])
+        self.assertEqual(len([query for query in context if query['sql'].startswith('UPDATE "app_song"')]), 1)
+        self.assertEqual(self.search('straße'), [self.street.id, self.other.id])
+        self.assertEqual(
+            dict(Song.objects.values_list('id', 'request_count')), {self.street.id: 2, self.other.id: 1}
+        )
+
+    def test_admin_search_by_spotify_link(self):
+        admin = SongAdmin(Song, AdminSite())
+        for term, song in [
+            ('https://open.spotify.com/intl-de/track/1?si=abc', self.street),
+            (' https://open.spotify.com/track/1 ', self.street),
+            ('spotify:track:2', self.other),
+        ]:
+            with self.subTest(term=term):
+                songs, _ = admin.get_search_results(None, Song.objects.all(), term)
+                self.assertEqual(list(songs), [song])
+
+
+class CreateSongRequestTests(EventTestCase):
+    """
+    Invalid songs must be answered with a 400, never a 500.
+    """
+    def post(self, **song):
+        data = {
+            'song': dict({
+                'spotify_url': 'https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC',
+                'artist': 'Artist',
+                'name': 'Song',
+                'image_url': 'https://i.scdn.co/image/cover.png',
+            }, **song),
+            'user': self.guest.id,
+            'dj': self.dj.id,
+            'event': self.event.id,
+        }
+        return self.client.post(reverse('create:create_song_request'), data, content_type='application/json')
+
+    def test_create(self):
+        self.assertEqual(self.post().status_code, 201)
+        self.assertEqual(self.post(spotify_url='spotify:track:4uLU6hMCjMI75M1A2tKUQC').status_code, 200)
+        self.assertEqual(Song.objects.get().spotify_id, '4uLU6hMCjMI75M1A2tKUQC')
+
+    def test_invalid_songs(self):
+        for song in [{'spotify_url': 42}, {'spotify_url': None}, {'name': 'x' * 256}, {'image_url': 'not a url'}]:
+            with self.subTest(song=song):
+                self.assertEqual(self.post(**song).status_code, 400)
+        self.assertFalse(Song.objects.exists())
+
+    def test_soft_deleted_song(self):
+        self.assertEqual(self.post().status_code, 201)
+        song = Song.objects.get()
+        SongRequest.objects.update(status=SongRequest.REJECTED)
+        song.delete()
+        response = self.post()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'song': ['Song is no longer available.']})
+        self.assertEqual(SongRequest.objects.count(), 1)
+
+    def test_invalid_song_requests(self):
+        other_dj, _, _, other_event = create_event('2')
+        fields = {'user': self.guest.id, 'dj': self.dj.id, 'event': self.event.id}
+        for data, error in [
+            ([fields], 'Song request must be an object'),
+            ({'user': self.guest.id, 'dj': self.dj.id}, 'User, dj and event must be ids'),
+            (dict(fields, event='x'), 'User, dj and event must be ids'),
+            (dict(fields, user='abc'), 'User, dj and event must be ids'),
+            (dict(fields, event=other_event.id + 1), 'Event does not exist or is not live'),
+            (dict(fields, dj=other_dj.id), 'Dj is not the DJ of the event'),
+        ]:
+            for view_name in ('create:create_song_request', 'async:create_song_request'):
+                with self.subTest(data=data, view_name=view_name):
+                    response = self.client.post(reverse(view_name), data, content_type='application/json')
+                    self.assertEqual(response.status_code, 400)
+                    if isinstance(data, dict):
+                        self.assertEqual(response.json(), {'error': error})
+        self.assertFalse(SongRequest.objects.exists())
+        self.assertFalse(Song.objects.exists())
+
+    def test_database_errors(self):
+        with mock.patch('app.utils.connection.cursor', side_effect=DataError('value too long')):
+            with self.assertRaises(ValidationError):
+                upsert_song({
+                    'spotify_url': 'https://open.spotify.com/track/1', 'artist': 'Artist', 'name': 'Song',
+                    'image_url': 'https://i.scdn.co/image/cover.png',
+                })
+
+
+class SongRequestVoteTests(EventTestCase):
+    """
+    Requests for an open song request are votes on it, one per user, sent to receivers once per song request.
+    """
+    def setUp(self):
+        super().setUp()
+        self.song = create_song(1)
+
+    def submit(self, *users):
+        return submit_song_requests([
+            {'song_id': self.song.id, 'user_id': user.id, 'dj_id': self.dj.id, 'event_id': self.event.id}
+            for user in users
+        ])
+
+    def test_duplicate_request_is_a_vote(self):
+        [(song_request_id, created)] = self.submit(self.guest)
+        self.assertEqual(self.submit(self.dj), [(song_request_id, VOTED)])
+        self.assertEqual(created, CREATED)
+        self.assertEqual(SongRequest.objects.get().votes, 2)
+        self.assertEqual(SongRequestVote.objects.filter(song_request_id=song_request_id).count(), 2)
+        self.song.refresh_from_db()
+        self.assertEqual(self.song.request_count, 2)
+        self.assertEqual(EventSummary.objects.get().total, 2)
+
+    def test_same_user_votes_once(self):
+        [(song_request_id, _)] = self.submit(self.guest)
+        self.assertEqual(self.submit(self.guest, self.guest), [(song_request_id, ALREADY_VOTED)] * 2)
+        self.assertEqual(SongRequest.objects.get().votes, 1)
+        self.assertEqual(SongRequestVote.objects.count(), 1)
+        self.song.refresh_from_db()
+        self.assertEqual(self.song.request_count, 1)
+        self.assertEqual(EventSummary.objects.get().total, 1)
+
+    def test_one_signal_per_song_request(self):
+        received = []
+
+        def handler(sender, instances, votes, **kwargs):
+            received.append(([song_request.id for song_request in instances], votes))
+
+        song_requests_created.connect(handler, sender=SongRequest)
+        self.addCleanup(song_requests_created.disconnect, handler, sender=SongRequest)
+        [(song_request_id, _), _, _] = self.submit(self.guest, self.dj, self.guest)
+        self.assertEqual(received, [([song_request_id], {song_request_id: 2})])
+        self.submit(self.guest)
+        self.assertEqual(len(received), 1)
+
+    def test_invalid_ids(self):
+        for user_id in ['abc', [1]]:
+            with self.subTest(user_id=user_id), self.assertRaises(ValidationError):
+                submit_song_requests([
+                    {'song_id': self.song.id, 'user_id': user_id, 'dj_id': self.dj.id, 'event_id': self.event.id}
+                ])
+
+
+class AnalyticsTests(EventTestCase):
+    """
+    The rollups must follow song requests, weighted by votes, as a rebuild would count them.
+    """
+    def setUp(self):
+        super().setUp()
+        self.first, self.second = create_song(1), create_song(2)
+        submit_song_requests([
+            {'song_id': song.id, 'user_id': user.id, 'dj_id': self.dj.id, 'event_id': self.event.id}
+            for song, user in [(self.first, self.guest), (self.first, self.dj), (self.second, self.guest)]
+        ])
+        SongRequest.objects.filter(song=self.second).change_state(SongRequest.REJECTED)
+        SongRequest.objects.filter(song=self.first).change_state(SongRequest.PENDING)
+        SongRequest.objects.filter(song=self.first).change_state(SongRequest.PLAYED)
+
+    def rollups(self):
+        return (
+            sorted(SongRequestRollup.objects.filter(count__gt=0).values_list('song_id', 'status', 'count')),
+            EventSummary.objects.values('total', 'requested', 'pending', 'played', 'rejected', 'expired').get(),
+        )
+
+    def test_stats(self):
+        response = self.client.get(reverse('event_stats', args=[self.event.id]), **self.authorization(self.dj))
+        self.assertEqual(response.status_code, 200)
+        stats = response.json()
+        self.assertEqual(stats['total'], 3)
+        self.assertEqual(stats['statuses'], {'REQUESTED': 0, 'PENDING': 0, 'PLAYED': 2, 'REJECTED': 1, 'EXPIRED': 0})
+        self.assertEqual(
+            [(song['song_id'], song['requests']) for song in stats['top_songs']], [(self.first.id, 2), (self.second.id, 1)]
+        )
+
+    def test_rebuild_matches(self):
+        incremental = self.rollups()
+        rebuild([self.event.id])
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_writes_lock_the_event_before_the_rollups(self):
+        # rebuild() locks the events, so writes must not touch the rollups before they lock them
+        with CaptureQueriesContext(connection) as context:
+            submit_song_requests([
+                {'song_id': self.first.id, 'user_id': self.guest.id, 'dj_id': self.dj.id, 'event_id': self.event.id},
+            ])
+        sqls = [query['sql'] for query in context.captured_queries]
+        event_lock = next(
+            i for i, sql in enumerate(sqls) if sql.startswith('SELECT') and '"app_event"."queue_updated_at"' in sql
+        )
+        rollups = next(i for i, sql in enumerate(sqls) if 'INSERT INTO "app_songrequestrollup"' in sql)
+        self.assertLess(event_lock, rollups)
+
+    def test_counters_are_written_in_key_order(self):
+        rows = [
+            {'event_id': self.event.id, 'song_id': song.id, 'status': SongRequest.REQUESTED, 'count': 1}
+            for song in (self.second, self.first)
+        ]
+        with CaptureQueriesContext(connection) as context:
+            increment_counters(SongRequestRollup, ('event', 'song', 'status'), rows)
+        [query] = context.captured_queries
+        self.assertLess(query['sql'].index(f'({self.event.id}, {self.first.id}, '),
+                        query['sql'].index(f'({self.event.id}, {self.second.id}, '))
+
+
+class TokenAuthenticationTests(EventTestCase):
+    """
+    Tokens must resolve from a cached user and role snapshot, dropped by the signals of the
+    changes to the token, the user or its DJ profile, and otherwise only when it expires.
+    """
+    def get_songs(self, headers):
+        return self.client.get(reverse('song_list'), **headers)
+
+    def test_snapshot_is_cached(self):
+        headers = self.authorization(self.dj)
+        key = headers['HTTP_AUTHORIZATION'].split()[1]
+        self.assertEqual(self.get_songs(headers).status_code, 200)
+        self.assertEqual(caches['default'].get(token_key(key))['djprofile'], {'id': self.dj.djprofile.id, 'name': 'DJ'})
+        self.dj.djprofile.delete()
+        self.assertIsNone(caches['default'].get(token_key(key)))
+
+    def test_cached_snapshot_costs_no_queries(self):
+        headers = self.authorization(self.dj)
+        with CaptureQueriesContext(connection) as cold:
+            self.get_songs(headers)
+        with CaptureQueriesContext(connection) as warm:
+            self.get_songs(headers)
+        self.assertEqual(len(cold), len(warm) + 1)
+        self.assertIn('authtoken_token', cold[0]['sql'])
+        self.assertFalse(any('authtoken_token' in query['sql'] for query in warm))
+
+    def test_deactivated_user_is_refused(self):
+        headers = self.authorization(self.guest)
+        self.assertEqual(self.get_songs(headers).status_code, 200)
+        self.guest.is_active = False
+        self.guest.save()
+        self.assertEqual(self.get_songs(headers).status_code, 401)
+
+    def test_admin_soft_deleted_user_is_refused(self):
+        headers = self.authorization(self.guest)
+        self.assertEqual(self.get_songs(headers).status_code, 200)
+        CustomUserAdmin(CustomUser, AdminSite()).soft_delete_queryset(CustomUser.objects.filter(pk=self.guest.pk))
+        self.assertEqual(self.get_songs(headers).status_code, 401)
+
+    def test_logged_out_token_is_refused(self):
+        headers = self.authorization(self.guest)
+        self.assertEqual(self.client.get(reverse('logout'), **headers).status_code, 200)
+        self.assertEqual(self.get_songs(headers).status_code, 401)
+
+    def test_changes_without_signals_show_once_the_snapshot_expires(self):
+        headers = self.authorization(self.guest)
+        self.assertEqual(self.get_songs(headers).status_code, 200)
+        # Like a change another worker made, whose signals did not reach this worker's cache
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM authtoken_token')
+        self.assertEqual(self.get_songs(headers).status_code, 200)
+        caches['default'].clear()
+        self.assertEqual(self.get_songs(headers).status_code, 401)
+
+
+class LoginTests(EventTestCase):
+    """
+    Logins must reject malformed credentials and back off accounts that keep failing.
+    """
+    def test_malformed_credentials(self):
+        for url in (reverse('login'), reverse('async:login')):
+            for data in ({'email': ['guest@example.com'], 'password': 'test123'},
+                         {'email': 'guest@example.com', 'password': 1},
+                         {'email': 'guest@example.com'}):
+                with self.subTest(url=url, data=data):
+                    self.assertEqual(self.client.post(url, data, content_type='application/json').status_code, 400)
+
+    def test_failures_back_off(self):
+        for _ in range(settings.LOGIN_BACKOFF_FREE_ATTEMPTS):
+            record_login_failure('Guest@example.com')
+        self.assertEqual(login_backoff('guest@example.com'), 0)
+        record_login_failure('guest@example.com')
+        self.assertEqual(caches['default'].get(backoff_keys('guest@example.com')[0]), 6)
+        self.assertGreater(login_backoff('guest@example.com'), 0)
+        response = self.client.post(
+            reverse('login'), {'email': 'guest@example.com', 'password': 'test123'}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 429)
+
+    def test_shared_cache_check(self):
+        self.assertEqual(
+            [warning.msg.split()[0] for warning in check_shared_caches(None)],
+            ['LOGIN_BACKOFF_CACHE'],
+        )
+
+
+class AsyncViewTests(EventTestCase):
+    """
+    The async views must answer like their sync versions.
+    """
+    def test_login_backs_off(self):
+        url = reverse('async:login')
+        data = {'email': 'guest@example.com', 'password': 'wrong'}
+        for _ in range(settings.LOGIN_BACKOFF_FREE_ATTEMPTS + 1):
+            self.assertEqual(self.client.post(url, data, content_type='application/json').status_code, 400)
+        response = self.client.post(url, data, content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_create_song_request_error_without_fields(self):
+        data = {
+            'song': {'spotify_url': 'https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC'},
+            'user': self.guest.id,
+            'dj': self.dj.id,
+            'event': self.event.id,
+        }
+        with mock.patch('app.views.upsert_song', side_effect=ValidationError('Bad song.')):
+            response = self.client.post(reverse('async:create_song_request'), data, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': ['Bad song.']})
+
+
+class SongRequestHubTests(EventTestCase):
+    """
+    The hub must resume reconnecting clients and forget events nobody follows.
+    """
+    def test_resume(self):
+        hub = SongRequestHub()
+
+        async def run():
+            subscriber, _ = hub.subscribe(1)
+            hub.publish(1, 'created', {'id': 1})
+            hub.publish(1, 'created', {'id': 2})
+            first_id = (await subscriber.queue.get())[0]
+            hub.unsubscribe(1, subscriber)
+            return hub.subscribe(1, first_id)[1]
+
+        self.assertEqual([data for _, _, data in asyncio.run(run())], [{'id': 2}])
+
+    def test_idle_events_are_forgotten(self):
+        hub = SongRequestHub(idle_seconds=0)
+
+        async def run():
+            subscriber, _ = hub.subscribe(1)
+            hub.publish(1, 'created', {'id': 1})
+            message_id = (await subscriber.queue.get())[0]
+            hub.unsubscribe(1, subscriber)
+            hub.publish(2, 'created', {'id': 2})
+            self.assertEqual((hub.history, hub.complete_after, hub.idle_since), ({}, {}, {}))
+            return hub.subscribe(1, message_id)[1]
+
+        self.assertEqual(asyncio.run(run()), [(None, RESET, {})])
+
+    def test_publish_failures_are_logged(self):
+        song = create_song(1)
+        with mock.patch('app.hub.hub.publish', side_effect=RuntimeError), self.assertLogs('app.hub', 'ERROR'):
+            with self.captureOnCommitCallbacks(execute=True):
+                submit_song_requests([
+                    {'song_id': song.id, 'user_id': self.guest.id, 'dj_id': self.dj.id, 'event_id': self.event.id}
+                ])
+        self.assertEqual(SongRequest.objects.count(), 1)
+
+
+class ArchiveTests(EventTestCase):
+    """
+    Archived rows must come back exactly as they were, timestamps included.
+    """
+    ARCHIVED = (SongRequest, SongRequestVote, Event, EventSummary, SongRequestRollup)
+
+    def setUp(self):
+        super().setUp()
+        song = create_song(1)
+        submit_song_requests([
+            {'song_id': song.id, 'user_id': user.id, 'dj_id': self.dj.id, 'event_id': self.event.id}
+            for user in (self.guest, self.dj)
+        ])
+        past = timezone.now() - timezone.timedelta(days=400)
+        Event.objects.update(start=past, end=past, created_at=past, updated_at=past, is_active=False)
+        SongRequest.objects.update(created_at=past, last_status_timestamp=past)
+        SongRequestVote.objects.update(created_at=past)
+        EventSummary.objects.update(updated_at=past)
+
+    def rows(self):
+        rows = {model: list(model._base_manager.order_by('pk').values()) for model in self.ARCHIVED}
+        # The queue version moves as the song requests leave and come back
+        for event in rows[Event]:
+            del event['queue_updated_at']
+        return rows
+
+    def test_round_trip(self):
+        rows = self.rows()
+        self.assertTrue(all(rows.values()))
+        call_command('archive', stdout=io.StringIO())
+        self.assertTrue(all(not archived for archived in self.rows().values()))
+        call_command('archive', '--restore', '--event', str(self.event.id), stdout=io.StringIO())
+        self.assertEqual(self.rows(), rows)
+        self.assertFalse(ArchivedRow.objects.exists())
+
+    def restore(self, *args):
+        stderr = io.StringIO()
+        call_command('archive', '--restore', *args, stdout=io.StringIO(), stderr=stderr)
+        return stderr.getvalue()
+
+    def test_open_song_request_conflict_stays_archived(self):
+        call_command('archive', stdout=io.StringIO())
+        self.restore('--model', 'event')
+        SongRequest.objects.create(song=Song.objects.get(), user=self.guest, dj=self.dj, event=self.event)
+        # With its votes, which reference it; the event summary came back with its event
+        self.assertEqual(self.restore().splitlines(), [
+            'Skipped 1 app.songrequest rows that conflict with live rows or reference skipped rows; they stay archived',
+            'Skipped 2 app.songrequestvote rows that conflict with live rows or reference skipped rows; '
+            'they stay archived',
+        ])
+        self.assertEqual(
+            sorted(ArchivedRow.objects.values_list('model', flat=True)),
+            ['app.songrequest', 'app.songrequestvote', 'app.songrequestvote'],
+        )
+        self.assertEqual(SongRequest.objects.count(), 1)
+
+    def test_song_conflict_skips_only_its_row(self):
+        songs = [create_song('4uLU6hMCjMI75M1A2tKUQC'), create_song('1301WleyT98MSxVHPZCA6M')]
+        Song._base_manager.filter(pk__in=[song.pk for song in songs]).update(is_active=False)
+        call_command('archive', '--model', 'song', stdout=io.StringIO())
+        live = create_song('4uLU6hMCjMI75M1A2tKUQC')
+        self.assertIn('Skipped 1 app.song rows', self.restore('--model', 'song'))
+        self.assertEqual(list(ArchivedRow.objects.values_list('object_id', flat=True)), [songs[0].pk])
+        self.assertEqual(Song._base_manager.get(spotify_id='4uLU6hMCjMI75M1A2tKUQC'), live)
+        self.assertTrue(Song._base_manager.filter(pk=songs[1].pk).exists())
+
+
+class RendererParityTests(EventTestCase):
+    """
+    The orjson renderer and parser must read and write the JSON DRF's own would.
+    """
+    PAYLOAD = {
+        'text': 'h\u00e9llo "quoted" \\ \n\t\x01 </script> \U0001f3b5',
+        'separators': 'line\u2028paragraph\u2029',
+        'numbers': [0, -1, 2 ** 63 - 1, 0.1, -2.0, 123456789.123],
+        'constants': [None, True, False],
+        'utc': datetime.datetime(2026, 10, 18, 12, 0, 0, 123456, tzinfo=datetime.timezone.utc),
+        'whole_seconds': datetime.datetime(2026, 10, 18, 12, 0, tzinfo=datetime.timezone.utc),
+        'naive': datetime.datetime(2026, 10, 18, 12, 0, 0, 5),
+        'offset': datetime.datetime(2026, 10, 18, 12, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=2))),
+        'date': datetime.date(2026, 1, 2),
+        'time': datetime.time(3, 4, 5, 6),
+        'uuid': uuid.UUID(int=5),
+        'decimal': decimal.Decimal('1.25'),
+        'lazy': gettext_lazy('This field is required.'),
+        'duration': datetime.timedelta(seconds=90.5),
+        'bytes': b'abc',
+        'tuple': (1, 2),
+        'nested': {'list': [{'empty': {}}], 'empty': []},
+        'int_keys': {1: 'one'},
+    }
+
+    def test_render(self):
+        for media_type in ['application/json', 'application/json; indent=2']:
+            with self.subTest(media_type=media_type):
+                self.assertEqual(
+                    FastJSONRenderer().render(self.PAYLOAD, media_type),
+                    JSONRenderer().render(self.PAYLOAD, media_type),
+                )
+        self.assertEqual(FastJSONRenderer().render(None), JSONRenderer().render(None))
+
+    def test_exponent_floats(self):
+        floats = [1e20, 1e-7, 1e16]
+        self.assertEqual(json.loads(FastJSONRenderer().render(floats)), json.loads(JSONRenderer().render(floats)))
+
+    def test_parse(self):
+        latin = '{"caf\u00e9": [1.5, null]}'.encode('latin-1')
+        for body, encoding in [(JSONRenderer().render(self.PAYLOAD), 'utf-8'), (latin, 'latin-1')]:
+            with self.subTest(encoding=encoding):
+                context = {'encoding': encoding}
+                self.assertEqual(
+                    FastJSONParser().parse(io.BytesIO(body), parser_context=context),
+                    JSONParser().parse(io.BytesIO(body), parser_context=context),
+                )
+        for body in [b'{"unterminated": ', latin]:
+            for parser in [FastJSONParser(), JSONParser()]:
+                with self.subTest(body=body, parser=parser), self.assertRaises(ParseError):
+                    parser.parse(io.BytesIO(body), parser_context={'encoding': 'utf-8'})
+
+    def test_api_responses(self):
+        create_song(1)
+        headers = self.authorization(self.dj)
+        for url in [reverse('event_detail', args=[self.event.id]), reverse('event_list'), reverse('song_list')]:
+            with self.subTest(url=url):
+                response = self.client.get(url, **headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+
+class ImageStorageTests(TestCase):
+    """
+    Images must be stored once by content, with their renditions, and served only while they exist.
+    """
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        buffer = io.BytesIO()
+        Image.new('RGB', (400, 300), 'red').save(buffer, 'PNG')
+        self.data = buffer.getvalue()
+
+    def test_store_image(self):
+        name = store_image(self.data)
+        self.assertEqual(store_image(self.data), name)
+        storage = image_storage()
+        for rendition in RENDITIONS:
+            self.assertTrue(storage.exists(image_path(rendition_name(name, rendition))))
+        with self.assertRaises(ValidationError):
+            store_image(b'not an image')
+
+    def test_migration_stores_images_the_same_way(self):
+        migration = importlib.import_module('app.migrations.0008_copy_images_to_storage')
+        self.assertEqual(migration.store_image(self.data), store_image(self.data))
+        self.assertIsNone(migration.store_image(b'not an image'))
+
+    def test_image_view(self):
+        name = store_image(self.data)
+        url = reverse('image', args=[name])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        response.close()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        image_storage().delete(image_path(name))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 404)
+        self.assertEqual(self.client.get(reverse('image', args=['settings.py'])).status_code, 404)
+
+
+class LoadtestTests(SimpleTestCase):
+    """
+    The loadtest command must report runs where requests fail or none is measured.
+    """
+    def run_scenario(self, request, requests):
+        command = LoadtestCommand(stdout=io.StringIO(), stderr=io.StringIO())
+        result = command.run_scenario(request, requests, warmup=1, concurrency=2)
+        command.report('scenario', result)
+        return result, command.stderr.getvalue()
+
+    def test_errors_are_recorded(self):
+        def request(client, i):
+            if i % 2:
+                raise RuntimeError('boom')
+            return JsonResponse({})
+
+        result, stderr = self.run_scenario(request, 4)
+        self.assertEqual(result['requests'], 2)
+        self.assertEqual(result['statuses'], {'200': 2})
+        self.assertEqual(result['errors'], {'RuntimeError: boom': 2})
+        self.assertIn('2 raised RuntimeError: boom', stderr)
+
+    def test_no_request_completed(self):
+        def request(client, i):
+            raise RuntimeError('boom')
+
+        for requests in [0, 3]:
+            with self.subTest(requests=requests):
+                result, _ = self.run_scenario(request, requests)
+                self.assertEqual(result['requests'], 0)
+                self.assertIsNone(result['latency_ms'])
+                self.assertEqual(result['throughput'], 0)
+
+    def test_smoke(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'loadtest.json')
+            subprocess.run(
+                [
+                    sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'loadtest', '--requests', '4',
+                    '--warmup', '1', '--rows', '3', '--scenario', 'login', '--scenario', 'create_song_request',
+                    '--output', output,
+                ],
+                cwd=directory, capture_output=True, check=True,
+                env=os.environ | {'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE},
+            )
+            with open(output) as f:
+                results = json.load(f)
+        self.assertEqual(set(results['scenarios']), {'login', 'create_song_request'})
+        for result in results['scenarios'].values():
+            self.assertEqual(result['requests'], 4)
+            self.assertEqual(result['errors'], {})
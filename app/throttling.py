@@ -0,0 +1,165 @@
+"""
+Token-bucket throttling shared by every worker process on a host.
+
+Each key owns one row (tokens left, last refill time) in a small SQLite database,
+so the state per key is constant and all gunicorn/uvicorn workers see the same
+buckets. A request takes one token from each of its buckets, or one per time the
+bucket is named, in a single write transaction: either every bucket has the tokens
+and all are charged, or none is. Buckets that have refilled completely carry no
+information and are pruned.
+"""
+import math
+import time
+from collections import Counter
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from app.utils import SharedSQLiteStore
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+PRUNE_INTERVAL_SECONDS = 300
+
+
+def parse_rate(rate):
+    """
+    Turn a DRF style rate such as '30/min' into (capacity, tokens per second).
+    """
+    count, period = rate.split('/')
+    return int(count), int(count) / DURATIONS[period[0]]
+
+
+class TokenBucketStore(SharedSQLiteStore):
+    """
+    SQLite backed token buckets, shared between the worker processes of a host.
+    """
+    schema = [
+        'CREATE TABLE IF NOT EXISTS buckets '
+        '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS buckets_full_at ON buckets (full_at)',
+    ]
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.pruned_at = 0
+
+    def take(self, buckets, now=None):
+        """
+        Take `cost` tokens from every (key, capacity, refill_rate, cost) bucket, all or nothing.
+        Returns 0 when the tokens were taken, otherwise the seconds until they would be,
+        which is infinite when a cost is over its bucket's capacity.
+        """
+        now = time.time() if now is None else now
+        connection = self.connection
+        wait = 0
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for key, capacity, refill_rate, cost in buckets:
+                if cost > capacity:
+                    wait = math.inf
+                    continue
+                row = connection.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * refill_rate)
+                if tokens < cost:
+                    wait = max(wait, (cost - tokens) / refill_rate)
+                    continue
+                tokens -= cost
+                connection.execute(
+                    'INSERT INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (key) DO UPDATE SET '
+                    'tokens = excluded.tokens, updated = excluded.updated, full_at = excluded.full_at',
+                    (key, tokens, now, now + (capacity - tokens) / refill_rate),
+                )
+            connection.execute('ROLLBACK' if wait else 'COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+        if now - self.pruned_at > PRUNE_INTERVAL_SECONDS:
+            self.pruned_at = now
+            connection.execute('DELETE FROM buckets WHERE full_at <= ?', (now,))
+        return wait
+
+    def clear(self):
+        self.connection.execute('DELETE FROM buckets')
+
+
+bucket_store = TokenBucketStore(getattr(settings, 'THROTTLE_DATABASE', 'throttle.sqlite3'))
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Throttle a request by every bucket returned from `get_buckets`, charged together.
+    Subclasses set `rates`, a mapping of scope to rate, and return (scope, ident) pairs;
+    a pair returned n times costs n tokens.
+    """
+    rates = {}
+
+    def get_buckets(self, request, view):
+        raise NotImplementedError('.get_buckets() must be overridden')
+
+    def allow_request(self, request, view):
+        return self.allow(self.get_buckets(request, view))
+
+    def allow(self, scoped_idents):
+        buckets = []
+        for (scope, ident), cost in Counter(scoped_idents).items():
+            if ident is None or scope not in self.rates:
+                continue
+            capacity, refill_rate = parse_rate(self.rates[scope])
+            buckets.append((f'{self.__class__.__name__}:{scope}:{ident}', capacity, refill_rate, cost))
+        self.wait_seconds = bucket_store.take(buckets) if buckets else 0
+        return not self.wait_seconds
+
+    def wait(self):
+        # Requests over a bucket's capacity never get through, so there is no time to wait
+        return None if math.isinf(self.wait_seconds) else self.wait_seconds
+
+
+class SongRequestThrottle(TokenBucketThrottle):
+    """
+    Limit anonymous song requests per client IP, per device and per event.
+    Devices identify themselves with the X-Device-Id header, which the client sets at will, so the
+    device limit is not one of its own: its buckets are keyed on the IP too, and only split the IP
+    limit between the devices behind an address, where one device cannot spend another's tokens.
+    Requests without the header skip the device limit.
+    """
+    rates = getattr(settings, 'SONG_REQUEST_THROTTLE_RATES', {})
+
+    def get_buckets(self, request, view):
+        return self.song_request_buckets(request, request.data)
+
+    def song_request_buckets(self, request, data):
+        try:
+            event_id = int(data.get('event'))
+        except (AttributeError, TypeError, ValueError):
+            event_id = None
+        ident = self.get_ident(request)
+        device = request.headers.get('X-Device-Id', '')[:64]
+        return [
+            ('ip', ident),
+            ('device', f'{ident}:{device}' if device else None),
+            ('event', event_id),
+        ]
+
+
+class SongRequestBatchThrottle(SongRequestThrottle):
+    """
+    Charge a batch of song requests like its items sent one by one, so batches do not get around the limits.
+    Bodies that are not a list of song requests cost one request.
+    """
+    def get_buckets(self, request, view):
+        items = request.data.get('song_requests') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return self.song_request_buckets(request, {})
+        return [bucket for item in items for bucket in self.song_request_buckets(request, item)]
+
+
+class DailyUserThrottle(TokenBucketThrottle):
+    """
+    Limit each user to three creations per day.
+    """
+    rates = {'user': '3/day'}
+
+    def get_buckets(self, request, view):
+        return [('user', request.user.pk if request.user.is_authenticated else self.get_ident(request))]
@@ -1,18 +1,59 @@
-from django.core.exceptions import ValidationError, ImproperlyConfigured
+import sqlite3
+import threading
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+from django.core.exceptions import ValidationError
+from django.db import DataError, IntegrityError, connection, models
+from rest_framework import exceptions, views
+
+
+FieldPlan = namedtuple('FieldPlan', ['name', 'attname', 'required', 'unique', 'is_relation'])
+
+
+@lru_cache(maxsize=None)
+def get_write_plan(model):
+    """
+    Describe how request data maps onto the writable fields of a model.
+    Computed once per model; auto fields and auto timestamps are left to the database and the model.
+    """
+    plan = []
+    for field in model._meta.concrete_fields:
+        if field.primary_key or not field.editable:
+            continue
+        plan.append(FieldPlan(
+            name=field.name,
+            attname=field.attname,
+            required=not (field.has_default() or field.null or field.blank),
+            unique=field.unique,
+            is_relation=field.is_relation,
+        ))
+    return tuple(plan)
 
 
 def sanitize_fields(data, model):
+    """
+    Build model kwargs from request data in a single pass over the model's write plan.
+    Extra keys are ignored, missing optional fields are left to their defaults and
+    missing required fields are reported together before touching the database.
+    """
     sanitized_data = {}
-    try:
-        for field in model._meta.get_fields():
-            if not field.many_to_many and not field.one_to_many:
-                if field.name in data:
-                    sanitized_data[field.name] = data[field.name]
-                elif field.has_default() or field.null or field.blank:
-                    sanitized_data[field.name] = field.get_default()
-    except ImproperlyConfigured as e:
-        raise ValidationError({"error": f"Missing required field for {model.__name__}"})
-    
+    missing = []
+    for field in get_write_plan(model):
+        if field.name in data:
+            value = data[field.name]
+            if field.is_relation and not isinstance(value, models.Model):
+                # Related rows are referenced by id, so assign the column directly
+                sanitized_data[field.attname] = value
+            else:
+                sanitized_data[field.name] = value
+        elif field.is_relation and field.attname in data:
+            sanitized_data[field.attname] = data[field.attname]
+        elif field.required:
+            missing.append(field.name)
+
+    if missing:
+        raise ValidationError({name: f'This field is required for {model.__name__}.' for name in missing})
     return sanitized_data
 
 
@@ -34,15 +75,228 @@ def create_model_instance(data, model):
 
 def update_or_create_model_instance(data, model):
     """
-    Generic function to create a model instance.
+    Generic function to update a model instance matched on its unique fields, or create it.
     Ignores extra fields and fills in default values for missing non-required fields.
     """
     data = sanitize_fields(data, model)
+    unique_fields = {field.attname for field in get_write_plan(model) if field.unique}
+    lookup = {name: value for name, value in data.items() if name in unique_fields} or data
+    defaults = {name: value for name, value in data.items() if name not in lookup}
+
+    try:
+        instance, _ = model.objects.update_or_create(defaults=defaults, **lookup)
+        return instance
+    except ValidationError as e:
+        raise ValidationError({"error": str(e)})
+    except Exception as e:
+        raise ValidationError({"error": "An error occurred during instance creation: " + str(e)})
+
+
+def upsert_model_instance(data, model, unique_field):
+    """
+    Generic function to insert a model instance, or update the row with the same `unique_field`.
+    Runs as a single INSERT ... ON CONFLICT ... RETURNING statement (PostgreSQL and SQLite),
+    so concurrent upserts of the same row cannot race. Returns the row id, or None when the
+    row is soft deleted, which is left as it is.
+    Other unique fields are never updated, and `unique_field` may be a non-editable field.
+    """
+    data = dict(sanitize_fields(data, model), **{unique_field: data[unique_field]})
+    instance = model(**data)
+
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    values = [field.get_db_prep_save(field.pre_save(instance, True), connection) for field in fields]
+    update_fields = [
+        field for field in fields
+        if not field.unique and (field.name in data or field.attname in data)
+    ] or [model._meta.get_field(unique_field)]
+
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    # A soft deleted row conflicts but is not updated, so RETURNING yields nothing for it
+    where = f'WHERE {table}.{quote("is_active")} ' if any(field.name == 'is_active' for field in fields) else ''
+    sql = (
+        f'INSERT INTO {table} ({", ".join(quote(field.column) for field in fields)}) '
+        f'VALUES ({", ".join(["%s"] * len(fields))}) '
+        f'ON CONFLICT ({quote(model._meta.get_field(unique_field).column)}) DO UPDATE SET '
+        f'{", ".join(f"{quote(field.column)} = EXCLUDED.{quote(field.column)}" for field in update_fields)} '
+        f'{where}RETURNING {quote(model._meta.pk.column)}'
+    )
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, values)
+            row = cursor.fetchone()
+    except (IntegrityError, DataError) as e:
+        raise ValidationError({"error": "An error occurred during instance creation: " + str(e)})
+    return row[0] if row else None
+
+
+def increment_counters(model, unique_fields, rows, overwrite_fields=()):
+    """
+    Add the counters of each row to the row of `model` with the same `unique_fields`, inserting
+    missing rows with their defaults, in one INSERT ... ON CONFLICT DO UPDATE statement
+    (PostgreSQL and SQLite). `rows` are dicts of field names to values; every field that is not
+    unique or in `overwrite_fields` is a counter, and all rows must name the same fields.
+    Rows are written in the order of their unique fields, so concurrent calls lock shared rows
+    in the same order and cannot deadlock.
+    """
+    if not rows:
+        return
+    fields = [field for field in model._meta.concrete_fields if not (field.primary_key and field.auto_created)]
+    keys = [
+        field.attname if field.attname in rows[0] else field.name
+        for field in map(model._meta.get_field, unique_fields)
+    ]
+    rows = sorted(rows, key=lambda row: tuple(row[key] for key in keys))
+    counters = [
+        field for field in map(model._meta.get_field, rows[0])
+        if field.name not in unique_fields and field.name not in overwrite_fields
+    ]
+    values = []
+    for row in rows:
+        instance = model(**row)
+        values += [field.get_db_prep_save(field.pre_save(instance, True), connection) for field in fields]
+
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    updates = [
+        f'{quote(field.column)} = {table}.{quote(field.column)} + EXCLUDED.{quote(field.column)}'
+        for field in counters
+    ] + [
+        f'{quote(field.column)} = EXCLUDED.{quote(field.column)}'
+        for field in map(model._meta.get_field, overwrite_fields)
+    ]
+    placeholders = f'({", ".join(["%s"] * len(fields))})'
+    sql = (
+        f'INSERT INTO {table} ({", ".join(quote(field.column) for field in fields)}) '
+        f'VALUES {", ".join([placeholders] * len(rows))} '
+        f'ON CONFLICT ({", ".join(quote(model._meta.get_field(name).column) for name in unique_fields)}) '
+        f'DO UPDATE SET {", ".join(updates)}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, values)
+
+
+async def acreate_model_instance(data, model):
+    """
+    Async version of create_model_instance for the ASGI views.
+    """
+    data = sanitize_fields(data, model)
 
     try:
-        instance = model.objects.update_or_create(**data)
+        return await model.objects.acreate(**data)
+    except ValidationError as e:
+        raise ValidationError({"error": str(e)})
+    except Exception as e:
+        raise ValidationError({"error": "An error occurred during instance creation: " + str(e)})
+
+
+async def aupdate_or_create_model_instance(data, model):
+    """
+    Async version of update_or_create_model_instance for the ASGI views.
+    """
+    data = sanitize_fields(data, model)
+    unique_fields = {field.attname for field in get_write_plan(model) if field.unique}
+    lookup = {name: value for name, value in data.items() if name in unique_fields} or data
+    defaults = {name: value for name, value in data.items() if name not in lookup}
+
+    try:
+        instance, _ = await model.objects.aupdate_or_create(defaults=defaults, **lookup)
         return instance
     except ValidationError as e:
         raise ValidationError({"error": str(e)})
     except Exception as e:
-        raise ValidationError({"error": "An error occurred during instance creation: " + str(e)})
\ No newline at end of file
+        raise ValidationError({"error": "An error occurred during instance creation: " + str(e)})
+
+
+def bulk_upsert_model_instances(data_list, model, unique_field):
+    """
+    Generic function to insert or update many model instances in one statement.
+    Rows are matched on `unique_field`; returns a mapping of that field's value to the row id.
+    """
+    update_fields = [
+        field.name for field in get_write_plan(model)
+        if not field.unique and field.name != unique_field and field.name in data_list[0]
+    ]
+    instances = [
+        model(**dict(sanitize_fields(data, model), **{unique_field: data[unique_field]})) for data in data_list
+    ]
+
+    try:
+        model.objects.bulk_create(
+            instances,
+            update_conflicts=bool(update_fields),
+            ignore_conflicts=not update_fields,
+            unique_fields=[unique_field] if update_fields else None,
+            update_fields=update_fields or None,
+        )
+    except Exception as e:
+        raise ValidationError({"error": "An error occurred during bulk upsert: " + str(e)})
+
+    keys = [data[unique_field] for data in data_list]
+    return dict(model.objects.filter(**{f'{unique_field}__in': keys}).values_list(unique_field, 'id'))
+
+
+def exception_handler(exc, context):
+    """
+    Return Django validation errors raised by the model helpers as 400 responses.
+    """
+    if isinstance(exc, ValidationError):
+        exc = exceptions.ValidationError(exc.message_dict if hasattr(exc, 'error_dict') else exc.messages)
+    return views.exception_handler(exc, context)
+
+
+class LRUCache:
+    """
+    Thread-safe mapping that keeps at most `max_size` entries, evicting the least recently used.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            if len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+class SharedSQLiteStore:
+    """
+    Small SQLite database shared by the worker processes of a host, for state that must
+    outlive a single process without a round trip to the main database.
+    Connections are per thread, in autocommit mode with WAL so readers never block writers.
+    """
+    schema = []
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in self.schema:
+                connection.execute(statement)
+            self.local.connection = connection
+        return connection
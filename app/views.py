@@ -1,17 +1,40 @@
+import asyncio
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render
 from django.contrib.auth import authenticate
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.http import FileResponse, Http404, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.views import View
 from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed, NotFound
 from rest_framework.response import Response
-from rest_framework.throttling import UserRateThrottle
 from rest_framework.views import APIView
 from rest_framework import status
 
-from app.utils import create_model_instance, update_or_create_model_instance
-from app.models import Location, Event, Song, SongRequest
-
-
-class DailyUserThrottle(UserRateThrottle):
-    rate = '3/day'
+from app.analytics import event_stats, top_songs
+from app.authentication import CachedTokenAuthentication
+from app.conditional import add_validators, dj_profile_version, event_version, make_etag, not_modified
+from app.backends import login_backoff, verify_login
+from app.geo import bounding_box, covering_prefixes, haversine_km, prefix_range
+from app.hub import hub
+from app.images import image_exists, open_image
+from app.listing import EventFieldset, InvalidListParameter, SongFieldset, SongRequestFieldset, keyset_page
+from app.live import live_events
+from app.queue import get_event_queue, get_queue_version
+from app.renderers import dumps, loads
+from app.search import search_songs
+from app.songs import canonical_song_data, upsert_song
+from app.throttling import DailyUserThrottle, SongRequestBatchThrottle, SongRequestThrottle
+from app.utils import bulk_upsert_model_instances, create_model_instance
+from app.votes import CREATED, VOTED, submit_song_requests
+from app.models import CustomUser, DjProfile, Location, Event, Song, SongRequest
 
 
 class LoginView(APIView):
@@ -20,10 +43,18 @@ class LoginView(APIView):
     """
     authentication_classes = []
     permission_classes = []
+    query_budget = 5
 
     def post(self, request, format=None):
         email = request.data.get('email')
         password = request.data.get('password')
+        if not isinstance(email, str) or not isinstance(password, str):
+            return Response({'error': 'Email and password are required.'}, status=status.HTTP_400_BAD_REQUEST)
+        wait = login_backoff(email)
+        if wait:
+            return Response({'error': 'Too many failed logins, try again later.'},
+                            status=status.HTTP_429_TOO_MANY_REQUESTS, headers={'Retry-After': str(math.ceil(wait))})
+
         user = authenticate(request, email=email, password=password)
         if user is not None:
             token, _ = Token.objects.get_or_create(user=user)
@@ -85,16 +116,682 @@ class CreateSongRequestView(APIView):
     """
     authentication_classes = []
     permission_classes = []
+    throttle_classes = [SongRequestThrottle]
+    query_budget = 10
+
+    def post(self, request, format=None):
+        fields, error = song_request_fields(request.data)
+        if error is not None:
+            return Response(error, status=status.HTTP_400_BAD_REQUEST)
+
+        fields['song_id'] = upsert_song(request.data.get('song', {}))
+        [(song_request_id, outcome)] = submit_song_requests([fields])
+
+        return Response(*song_request_outcome(song_request_id, outcome))
+
+
+def song_request_fields(data):
+    """
+    The user, dj and event ids of a song request in request data, as submit_song_requests takes them.
+    Returns (fields, None), or (None, an error dict) unless the event is live and the dj is its DJ.
+    """
+    if not isinstance(data, dict):
+        return None, {"error": "Song request must be an object"}
+    try:
+        fields = {f'{name}_id': int(data.get(name)) for name in ('user', 'dj', 'event')}
+    except (TypeError, ValueError):
+        return None, {"error": "User, dj and event must be ids"}
+    event_dj_id = live_events().get(fields['event_id'])
+    if event_dj_id is None:
+        return None, {"error": "Event does not exist or is not live"}
+    if fields['dj_id'] != event_dj_id:
+        return None, {"error": "Dj is not the DJ of the event"}
+    return fields, None
+
+
+def song_request_outcome(song_request_id, outcome):
+    """
+    Response data and status for a submitted song request; requests for open songs are votes.
+    """
+    if outcome == CREATED:
+        message, status_code = f"Song request {song_request_id} was created successfully", status.HTTP_201_CREATED
+    elif outcome == VOTED:
+        message, status_code = f"Vote added to song request {song_request_id}", status.HTTP_200_OK
+    else:
+        message, status_code = f"Song request {song_request_id} already has your vote", status.HTTP_200_OK
+    return {"success": message, "id": song_request_id}, status_code
+
+
+class CreateSongRequestBatchView(APIView):
+    """
+    Create many songs and song requests in a single transaction.
+    Every item is validated on its own, so one bad item does not fail the whole batch.
+    """
+    authentication_classes = []
+    permission_classes = []
+    throttle_classes = [SongRequestBatchThrottle]
+
+    MAX_BATCH_SIZE = 500
+    SONG_FIELDS = ('spotify_url', 'artist', 'name', 'image_url')
+    SONG_REQUEST_FIELDS = ('user', 'dj', 'event')
 
     def post(self, request, format=None):
-        song_request_data = request.data
-        song_data = request.data.pop('song', {})
-        song = update_or_create_model_instance(song_data, Song)
+        items = request.data.get('song_requests') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return Response({"error": "A non-empty list of song requests is required"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.MAX_BATCH_SIZE:
+            return Response(
+                {"error": f"At most {self.MAX_BATCH_SIZE} song requests can be sent at once"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = [self.validate_item(item) for item in items]
+        self.validate_references(items, results)
+
+        valid = [i for i, result in enumerate(results) if result is None]
+        if valid:
+            with transaction.atomic():
+                songs = {items[i]['song']['spotify_id']: items[i]['song'] for i in valid}
+                song_ids = bulk_upsert_model_instances(list(songs.values()), Song, 'spotify_id')
+
+                submitted = []
+                for i in valid:
+                    song_id = song_ids.get(items[i]['song']['spotify_id'])
+                    if song_id is None:
+                        results[i] = {"error": "Song is no longer available"}
+                        continue
+                    submitted.append((i, {
+                        'song_id': song_id,
+                        'user_id': items[i]['user'],
+                        'dj_id': items[i]['dj'],
+                        'event_id': items[i]['event'],
+                    }))
+                outcomes = submit_song_requests([song_request for _, song_request in submitted]) if submitted else []
+
+            for (i, _), (song_request_id, outcome) in zip(submitted, outcomes):
+                results[i], _ = song_request_outcome(song_request_id, outcome)
+
+        response_data = {"results": [dict(index=i, **result) for i, result in enumerate(results)]}
+        created = sum('success' in result for result in results)
+        if created == len(results):
+            return Response(response_data, status=status.HTTP_201_CREATED)
+        if created:
+            return Response(response_data, status=status.HTTP_207_MULTI_STATUS)
+        return Response(response_data, status=status.HTTP_400_BAD_REQUEST)
+
+    def validate_item(self, item):
+        """
+        Check a single item without touching the database; returns an error dict or None.
+        """
+        if not isinstance(item, dict):
+            return {"error": "Song request must be an object"}
+        missing = [field for field in self.SONG_REQUEST_FIELDS if item.get(field) in (None, '')]
+        song = item.get('song')
+        if not isinstance(song, dict):
+            missing.append('song')
+        else:
+            missing += [f'song.{field}' for field in self.SONG_FIELDS if song.get(field) in (None, '')]
+        if missing:
+            return {"error": f"Missing required fields: {', '.join(missing)}"}
+
+        try:
+            for field in self.SONG_REQUEST_FIELDS:
+                item[field] = int(item[field])
+        except (TypeError, ValueError):
+            return {"error": "User, dj and event must be ids"}
+
+        try:
+            field = 'spotify_url'
+            song = item['song'] = canonical_song_data(song)
+            for field in self.SONG_FIELDS:
+                Song._meta.get_field(field).clean(song[field], None)
+        except ValidationError as e:
+            return {"error": f"Invalid song {field}: {' '.join(e.messages)}"}
+        return None
 
-        song_request_data['song'] = song.id
-        song_request = create_model_instance(song_request_data, SongRequest)
+    def validate_references(self, items, results):
+        """
+        Check that referenced users exist, with one query, and that events are live and
+        of the dj, from the cache.
+        """
+        valid = [i for i, result in enumerate(results) if result is None]
+        user_ids = {items[i][field] for i in valid for field in ('user', 'dj')}
+        existing_users = set(CustomUser.objects.filter(id__in=user_ids).values_list('id', flat=True))
+        event_djs = live_events() if valid else {}
+
+        for i in valid:
+            if items[i]['user'] not in existing_users or items[i]['dj'] not in existing_users:
+                results[i] = {"error": "User or dj does not exist"}
+            elif items[i]['event'] not in event_djs:
+                results[i] = {"error": "Event does not exist or is not live"}
+            elif items[i]['dj'] != event_djs[items[i]['event']]:
+                results[i] = {"error": "Dj is not the DJ of the event"}
+
+
+class TriageSongRequestsView(APIView):
+    """
+    Move many song requests of the DJ to a new state in one statement.
+    Requests whose current state does not allow the transition are reported back as rejected.
+    """
+    MAX_IDS = 500
+
+    def post(self, request, format=None):
+        user = request.user
+        if not user.is_dj:
+            return Response({"error": "User is not a DJ"}, status=status.HTTP_403_FORBIDDEN)
+
+        state = request.data.get('status')
+        targets = {target for targets in SongRequest.ALLOWED_TRANSITIONS.values() for target in targets}
+        if state not in targets:
+            return Response(
+                {"error": f"Status must be one of: {', '.join(sorted(targets))}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not ids or len(ids) > self.MAX_IDS:
+            return Response(
+                {"error": f"Between 1 and {self.MAX_IDS} song request ids are required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            ids = [int(song_request_id) for song_request_id in ids]
+        except (TypeError, ValueError):
+            return Response({"error": "Song request ids must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+
+        song_requests = SongRequest.objects.filter(id__in=ids)
+        if not user.is_staff:
+            song_requests = song_requests.filter(dj_id=user.id)
+        moved = {song_request.id for song_request in song_requests.change_state(state)}
 
         return Response(
-            {"success": f"Song request {song_request.id} was created successfully"}, 
-            status=status.HTTP_201_CREATED
-        )
\ No newline at end of file
+            {
+                "moved": [song_request_id for song_request_id in ids if song_request_id in moved],
+                "rejected": [song_request_id for song_request_id in ids if song_request_id not in moved],
+            },
+            status=status.HTTP_200_OK
+        )
+
+
+class NearbyEventsView(APIView):
+    """
+    Return live events within `radius` km of `latitude`/`longitude`, closest first.
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    DEFAULT_RADIUS_KM = 10
+    MAX_RADIUS_KM = 200
+    MAX_RESULTS = 50
+
+    def get(self, request, format=None):
+        try:
+            latitude = float(request.query_params['latitude'])
+            longitude = float(request.query_params['longitude'])
+            radius = float(request.query_params.get('radius', self.DEFAULT_RADIUS_KM))
+        except (KeyError, ValueError):
+            return Response(
+                {"error": "latitude and longitude are required and must be numbers"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180 and 0 < radius <= self.MAX_RADIUS_KM):
+            return Response({"error": "Coordinates or radius out of range"}, status=status.HTTP_400_BAD_REQUEST)
+
+        box = bounding_box(latitude, longitude, radius)
+        min_lat, max_lat, min_lon, max_lon = box
+        locations = Location.objects.filter(latitude__range=(min_lat, max_lat))
+        if -180 <= min_lon and max_lon <= 180:
+            locations = locations.filter(longitude__range=(min_lon, max_lon))
+        prefix_filter = Q()
+        for prefix in covering_prefixes(box):
+            start, stop = prefix_range(prefix)
+            prefix_filter |= Q(geohash__gte=start, geohash__lt=stop) if stop else Q(geohash__gte=start)
+        locations = locations.filter(prefix_filter)
+
+        now = timezone.now()
+        events = Event.objects.filter(
+            start__lte=now, end__gte=now, location__in=locations.values('id')
+        ).select_related('location')
+
+        nearby = []
+        for event in events:
+            distance = haversine_km(latitude, longitude, event.location.latitude, event.location.longitude)
+            if distance <= radius:
+                nearby.append((distance, event))
+        nearby.sort(key=lambda item: item[0])
+
+        return Response({"events": [
+            {
+                "id": event.id,
+                "name": event.name,
+                "start": event.start,
+                "end": event.end,
+                "distance_km": round(distance, 3),
+                "location": {
+                    "id": event.location.id,
+                    "name": event.location.name,
+                    "latitude": event.location.latitude,
+                    "longitude": event.location.longitude,
+                },
+            }
+            for distance, event in nearby[:self.MAX_RESULTS]
+        ]}, status=status.HTTP_200_OK)
+
+
+class SongSearchView(APIView):
+    """
+    Autocomplete songs already in the catalog by name or artist, most requested first.
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    MIN_QUERY_LENGTH = 2
+    DEFAULT_LIMIT = 10
+    MAX_LIMIT = 50
+
+    def get(self, request, format=None):
+        query = request.query_params.get('q', '').strip()
+        if len(query) < self.MIN_QUERY_LENGTH:
+            return Response(
+                {"error": f"Query must be at least {self.MIN_QUERY_LENGTH} characters long"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            limit = min(int(request.query_params.get('limit', self.DEFAULT_LIMIT)), self.MAX_LIMIT)
+        except ValueError:
+            return Response({"error": "limit must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+
+        songs = search_songs(query).values('id', 'name', 'artist', 'spotify_url', 'image_url', 'request_count')
+        return Response({"songs": list(songs[:max(limit, 1)])}, status=status.HTTP_200_OK)
+
+
+class EventQueueView(APIView):
+    """
+    Return the ranked queue of active song requests for an event.
+    Tagged with the version marker of the queue, so polling clients revalidate with a 304.
+    """
+    CACHE_CONTROL = 'private, no-cache'
+
+    def get(self, request, event_id, format=None):
+        # Read before the queue, so the response is never tagged newer than its content
+        version = get_queue_version(event_id)
+        if version is None:
+            return Response({"error": "Event does not exist"}, status=status.HTTP_404_NOT_FOUND)
+        etag = make_etag('queue', event_id, version)
+        response = not_modified(request, etag, version)
+        if response is None:
+            queue = get_event_queue(event_id, version)
+            response = Response({"event": event_id, "queue": queue}, status=status.HTTP_200_OK)
+        return add_validators(response, etag, version, self.CACHE_CONTROL)
+
+
+class EventDetailView(APIView):
+    """
+    Return an event with its location.
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    CACHE_CONTROL = 'public, max-age=60'
+    query_budget = 2
+
+    def get(self, request, event_id, format=None):
+        version = event_version(event_id)
+        if version is None:
+            return Response({"error": "Event does not exist"}, status=status.HTTP_404_NOT_FOUND)
+        etag = make_etag('event', event_id, version)
+        response = not_modified(request, etag, version)
+        if response is None:
+            event = Event.objects.select_related('location').get(id=event_id)
+            response = Response({
+                "id": event.id,
+                "name": event.name,
+                "dj": event.dj_id,
+                "start": event.start,
+                "end": event.end,
+                "image_url": event.image_url(),
+                "location": {
+                    "id": event.location.id,
+                    "name": event.location.name,
+                    "latitude": event.location.latitude,
+                    "longitude": event.location.longitude,
+                },
+            }, status=status.HTTP_200_OK)
+        return add_validators(response, etag, version, self.CACHE_CONTROL)
+
+
+class DjProfileView(APIView):
+    """
+    Return the profile of a DJ, by the id of the DJ's user as events reference it.
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    CACHE_CONTROL = 'public, max-age=300'
+    query_budget = 2
+
+    def get(self, request, dj_id, format=None):
+        version = dj_profile_version(dj_id)
+        if version is None:
+            return Response({"error": "DJ does not exist"}, status=status.HTTP_404_NOT_FOUND)
+        etag = make_etag('dj', dj_id, version)
+        response = not_modified(request, etag, version)
+        if response is None:
+            profile = DjProfile.objects.get(user_id=dj_id)
+            response = Response({
+                "id": dj_id,
+                "name": profile.name,
+                "image_url": profile.image_url(),
+                "thumbnail_url": profile.image_url('thumbnail'),
+            }, status=status.HTTP_200_OK)
+        return add_validators(response, etag, version, self.CACHE_CONTROL)
+
+
+class EventStatsView(APIView):
+    """
+    Return the song request analytics of an event to its DJ, read from the rollups.
+    """
+    MAX_LIMIT = 50
+
+    def get(self, request, event_id, format=None):
+        events = Event.objects.filter(id=event_id)
+        if not request.user.is_staff:
+            events = events.filter(dj_id=request.user.id)
+        if not events.exists():
+            return Response({"error": "Event does not exist"}, status=status.HTTP_404_NOT_FOUND)
+
+        song_status = request.query_params.get('status')
+        if song_status is not None and song_status not in dict(SongRequest.STATUS_CHOICES):
+            return Response({"error": "Unknown song request status"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), self.MAX_LIMIT)
+        except ValueError:
+            return Response({"error": "Limit must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(
+            {"event": event_id, **event_stats(event_id), "top_songs": top_songs(event_id, limit, song_status)},
+            status=status.HTTP_200_OK
+        )
+
+
+class KeysetListView(APIView):
+    """
+    Base of the keyset-paginated lists: `?cursor=` is the `next` of the previous page,
+    `?fields=` a comma-separated sparse fieldset and `?limit=` the page size. Lists set
+    `queryset`, as with ListAPIView, or override get_queryset().
+    """
+    queryset = None
+    fieldset = None
+    ordering = ()
+    DEFAULT_LIMIT = 50
+    MAX_LIMIT = 200
+
+    def get_queryset(self, request, **kwargs):
+        assert self.queryset is not None, (
+            f"'{self.__class__.__name__}' should either include a `queryset` attribute, "
+            "or override the `get_queryset()` method."
+        )
+        # Evaluated per request, not cached on the class
+        return self.queryset.all()
+
+    def get(self, request, format=None, **kwargs):
+        try:
+            limit = min(int(request.query_params.get('limit', self.DEFAULT_LIMIT)), self.MAX_LIMIT)
+        except ValueError:
+            return Response({"error": "limit must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            fieldset = self.fieldset(request.query_params.get('fields'))
+            queryset = self.get_queryset(request, **kwargs)
+            rows, next_cursor = keyset_page(
+                queryset, self.ordering, fieldset, request.query_params.get('cursor'), max(limit, 1)
+            )
+        except InvalidListParameter as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"results": rows, "next": next_cursor}, status=status.HTTP_200_OK)
+
+
+class EventListView(KeysetListView):
+    """
+    List events, latest start first.
+    """
+    queryset = Event.objects.all()
+    fieldset = EventFieldset
+    # Served by event_start_index
+    ordering = ('-start', '-id')
+    query_budget = 2
+
+
+class EventSongRequestListView(KeysetListView):
+    """
+    List the song requests of an event to its DJ, most recently changed first, optionally in one `status`.
+    """
+    fieldset = SongRequestFieldset
+    # Served by event_time_request_index, or event_status_time_index with a status
+    ordering = ('-last_status_timestamp', '-id')
+    query_budget = 3
+
+    def get_queryset(self, request, event_id):
+        events = Event.objects.filter(id=event_id)
+        if not request.user.is_staff:
+            events = events.filter(dj_id=request.user.id)
+        if not events.exists():
+            raise NotFound("Event does not exist")
+
+        song_requests = SongRequest.objects.filter(event_id=event_id)
+        song_status = request.query_params.get('status')
+        if song_status is not None:
+            if song_status not in dict(SongRequest.STATUS_CHOICES):
+                raise InvalidListParameter("Unknown song request status")
+            song_requests = song_requests.filter(status=song_status)
+        return song_requests
+
+
+class SongListView(KeysetListView):
+    """
+    List the song catalog in id order.
+    """
+    queryset = Song.objects.all()
+    fieldset = SongFieldset
+    ordering = ('id',)
+    query_budget = 2
+
+
+class ImageView(View):
+    """
+    Serve a stored image or rendition.
+    Files are content-addressed, so they never change and can be cached for good.
+    """
+    CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+    def get(self, request, name):
+        etag = f'"{name}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            # Files are never changed, but they can be deleted
+            if not image_exists(name):
+                raise Http404('Image does not exist')
+            response = HttpResponseNotModified()
+        else:
+            image = open_image(name)
+            if image is None:
+                raise Http404('Image does not exist')
+            file, content_type = image
+            response = FileResponse(file, content_type=content_type)
+        response['ETag'] = etag
+        response['Cache-Control'] = self.CACHE_CONTROL
+        return response
+
+
+# Async views, served when the project runs on ASGI (see README).
+# They use Django's async ORM and plain Django views, since DRF views are sync only.
+
+# Password hashing is CPU bound, so it runs in its own pool instead of blocking the event loop
+password_hasher_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'PASSWORD_HASHER_THREADS', 4),
+    thread_name_prefix='password-hasher',
+)
+
+
+async def run_password_hasher(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(password_hasher_executor, func, *args)
+
+
+def parse_json_body(request):
+    try:
+        data = loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def aauthenticate_token(request):
+    """
+    Resolve the token in the Authorization header to a user, or None.
+    """
+    authentication = CachedTokenAuthentication()
+    header = request.headers.get('Authorization', '').split()
+    if len(header) != 2 or header[0] != authentication.keyword:
+        return None
+    try:
+        user, _ = await sync_to_async(authentication.authenticate_credentials)(header[1])
+    except AuthenticationFailed:
+        return None
+    return user
+
+
+class AsyncAPIView(View):
+    """
+    Base for the async views; like DRF's APIView they are exempt from CSRF checks.
+    """
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True
+        return view
+
+
+class AsyncLoginView(AsyncAPIView):
+    """
+    Authenticate user and return a token.
+    """
+    async def post(self, request):
+        data = parse_json_body(request)
+        if data is None:
+            return JsonResponse({'error': 'Invalid JSON body.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        email = data.get('email')
+        password = data.get('password')
+        if not isinstance(email, str) or not isinstance(password, str):
+            return JsonResponse({'error': 'Email and password are required.'}, status=status.HTTP_400_BAD_REQUEST)
+        wait = await sync_to_async(login_backoff)(email)
+        if wait:
+            response = JsonResponse({'error': 'Too many failed logins, try again later.'},
+                                    status=status.HTTP_429_TOO_MANY_REQUESTS)
+            response['Retry-After'] = math.ceil(wait)
+            return response
+
+        user = await CustomUser.objects.filter(email=email).afirst()
+        verified, upgraded = await run_password_hasher(verify_login, user, email, password)
+        if upgraded:
+            await user.asave(update_fields=['password'])
+        if verified and user.is_active:
+            token, _ = await Token.objects.aget_or_create(user=user)
+            return JsonResponse({'token': token.key}, status=status.HTTP_200_OK)
+        return JsonResponse({'error': 'Invalid username or password.'}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncCreateSongRequestView(AsyncAPIView):
+    """
+    Create a new song and song request.
+    """
+    async def post(self, request):
+        song_request_data = parse_json_body(request)
+        if song_request_data is None:
+            return JsonResponse({'error': 'Invalid JSON body.'}, status=status.HTTP_400_BAD_REQUEST)
+        throttle = SongRequestThrottle()
+        if not await sync_to_async(throttle.allow)(throttle.song_request_buckets(request, song_request_data)):
+            response = JsonResponse({'error': 'Request was throttled.'}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+            response['Retry-After'] = math.ceil(throttle.wait())
+            return response
+        fields, error = await sync_to_async(song_request_fields)(song_request_data)
+        if error is not None:
+            return JsonResponse(error, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            fields['song_id'] = await sync_to_async(upsert_song)(song_request_data.get('song', {}))
+            [(song_request_id, outcome)] = await sync_to_async(submit_song_requests)([fields])
+        except ValidationError as e:
+            return JsonResponse(getattr(e, 'message_dict', {'error': e.messages}), status=status.HTTP_400_BAD_REQUEST)
+
+        data, status_code = song_request_outcome(song_request_id, outcome)
+        return JsonResponse(data, status=status_code)
+
+
+class AsyncEventQueueView(AsyncAPIView):
+    """
+    Return the ranked queue of active song requests for an event.
+    """
+    async def get(self, request, event_id):
+        if await aauthenticate_token(request) is None:
+            return JsonResponse({'error': 'Authentication credentials were not provided or are invalid.'},
+                                status=status.HTTP_401_UNAUTHORIZED)
+
+        version = await sync_to_async(get_queue_version)(event_id)
+        if version is None:
+            return JsonResponse({"error": "Event does not exist"}, status=status.HTTP_404_NOT_FOUND)
+        etag = make_etag('queue', event_id, version)
+        response = not_modified(request, etag, version)
+        if response is None:
+            queue = await sync_to_async(get_event_queue)(event_id, version)
+            response = JsonResponse({"event": event_id, "queue": queue}, status=status.HTTP_200_OK)
+        return add_validators(response, etag, version, EventQueueView.CACHE_CONTROL)
+
+
+class AsyncEventStreamView(AsyncAPIView):
+    """
+    Stream song request creates and status changes of an event as server-sent events.
+    Clients resume with the Last-Event-ID header; a `reset` event means they should refetch the queue.
+    """
+    KEEPALIVE_SECONDS = 15
+    # Streams are closed periodically and resumed by the client, so abandoned connections do not linger
+    MAX_STREAM_SECONDS = 300
+    RETRY_MILLISECONDS = 1000
+
+    async def get(self, request, event_id):
+        user = await aauthenticate_token(request)
+        if user is None:
+            return JsonResponse({'error': 'Authentication credentials were not provided or are invalid.'},
+                                status=status.HTTP_401_UNAUTHORIZED)
+        events = Event.objects.filter(id=event_id)
+        if not user.is_staff:
+            events = events.filter(dj_id=user.id)
+        if not await events.aexists():
+            return JsonResponse({"error": "Event does not exist"}, status=status.HTTP_404_NOT_FOUND)
+
+        last_event_id = request.headers.get('Last-Event-ID')
+        response = StreamingHttpResponse(self.stream(event_id, last_event_id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def format_message(self, message_id, name, data):
+        lines = [f'id: {message_id}'] if message_id else []
+        lines += [f'event: {name}', f'data: {dumps(data).decode()}']
+        return '\n'.join(lines) + '\n\n'
+
+    async def stream(self, event_id, last_event_id):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.MAX_STREAM_SECONDS
+        subscriber, backlog = hub.subscribe(event_id, last_event_id)
+        try:
+            yield f'retry: {self.RETRY_MILLISECONDS}\n\n'
+            for message in backlog:
+                yield self.format_message(*message)
+            while loop.time() < deadline:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), timeout=self.KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield self.format_message(*message)
+        finally:
+            hub.unsubscribe(event_id, subscriber)
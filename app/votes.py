@@ -0,0 +1,155 @@
+"""
+Song requests coalesced into votes.
+
+A request for a song that is already requested or pending at an event becomes a vote on
+that open song request instead of a new row. open_song_request_unique allows one open
+song request per (event, song) and song_request_vote_unique one vote per user, so
+concurrent requests can neither split a song nor count a user twice. A batch of requests
+takes three statements whatever its size: an upsert of the open song requests, an insert
+of the votes and an atomic increment of the vote counters.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DataError, IntegrityError, connection, transaction
+from django.db.models import Case, F, When
+from django.utils import timezone
+
+from app.models import SongRequest, SongRequestVote
+from app.signals import song_requests_created
+
+CREATED = 'created'
+VOTED = 'voted'
+ALREADY_VOTED = 'already_voted'
+
+OPEN_STATUSES = (SongRequest.REQUESTED, SongRequest.PENDING)
+RETURNED_FIELDS = ('id', 'event_id', 'song_id', 'user_id', 'dj_id', 'status', 'created_at', 'last_status_timestamp',
+                   'votes')
+
+
+def from_db(field_name, value):
+    field = SongRequest._meta.get_field(field_name)
+    value = field.to_python(value)
+    if settings.USE_TZ and field.get_internal_type() == 'DateTimeField' and timezone.is_naive(value):
+        # SQLite hands back UTC timestamps as naive strings
+        value = timezone.make_aware(value, timezone.utc)
+    return value
+
+
+def upsert_open_song_requests(song_requests):
+    """
+    Insert song requests with no votes, or return the open song request of the same event and song.
+    Returns the song requests, keyed by (event_id, song_id); new ones have zero votes.
+    """
+    fields = [field for field in SongRequest._meta.concrete_fields if not field.primary_key]
+    values = []
+    for song_request in song_requests:
+        values += [field.get_db_prep_save(field.pre_save(song_request, True), connection) for field in fields]
+
+    quote = connection.ops.quote_name
+    table = quote(SongRequest._meta.db_table)
+    placeholders = f'({", ".join(["%s"] * len(fields))})'
+    # The conflict target infers the partial unique index, so it repeats its condition as Django writes it
+    statuses = ', '.join(f"'{status}'" for status in OPEN_STATUSES)
+    sql = (
+        f'INSERT INTO {table} ({", ".join(quote(field.column) for field in fields)}) '
+        f'VALUES {", ".join([placeholders] * len(song_requests))} '
+        f'ON CONFLICT ({quote("event_id")}, {quote("song_id")}) '
+        f'WHERE ({quote("is_active")} AND {quote("status")} IN ({statuses})) '
+        f'DO UPDATE SET {quote("votes")} = {table}.{quote("votes")} '
+        f'RETURNING {", ".join(quote(SongRequest._meta.get_field(name).column) for name in RETURNED_FIELDS)}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, values)
+        rows = cursor.fetchall()
+
+    upserted = {}
+    for row in rows:
+        song_request = SongRequest(**{name: from_db(name, value) for name, value in zip(RETURNED_FIELDS, row)})
+        song_request._state.adding = False
+        upserted[song_request.event_id, song_request.song_id] = song_request
+    return upserted
+
+
+def insert_votes(votes):
+    """
+    Insert (song_request_id, user_id) votes mapped to their time, skipping the ones that exist.
+    Returns the inserted votes.
+    """
+    quote = connection.ops.quote_name
+    created_at = SongRequestVote._meta.get_field('created_at')
+    values = []
+    for (song_request_id, user_id), voted_at in votes.items():
+        values += [song_request_id, user_id, created_at.get_db_prep_save(voted_at, connection)]
+    sql = (
+        f'INSERT INTO {quote(SongRequestVote._meta.db_table)} '
+        f'({quote("song_request_id")}, {quote("user_id")}, {quote("created_at")}) '
+        f'VALUES {", ".join(["(%s, %s, %s)"] * len(votes))} '
+        f'ON CONFLICT ({quote("song_request_id")}, {quote("user_id")}) DO NOTHING '
+        f'RETURNING {quote("song_request_id")}, {quote("user_id")}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, values)
+        return set(cursor.fetchall())
+
+
+def submit_song_requests(requests):
+    """
+    Record `requests`, dicts with song_id, user_id, dj_id and event_id, as song requests or votes.
+    Returns a (song_request_id, outcome) pair per request, outcome being CREATED, VOTED or ALREADY_VOTED.
+    """
+    now = timezone.now()
+    first_requests = {}
+    for request in requests:
+        first_requests.setdefault((request['event_id'], request['song_id']), request)
+
+    try:
+        # No savepoint: a failure here fails the whole request, so an outer transaction is not resumed
+        with transaction.atomic(savepoint=False):
+            song_requests = upsert_open_song_requests([
+                SongRequest(
+                    song_id=request['song_id'], user_id=request['user_id'], dj_id=request['dj_id'],
+                    event_id=request['event_id'], status=SongRequest.REQUESTED, votes=0,
+                )
+                for request in first_requests.values()
+            ])
+            created = {key for key, song_request in song_requests.items() if song_request.votes == 0}
+
+            votes = {}
+            for request in requests:
+                song_request = song_requests[request['event_id'], request['song_id']]
+                votes.setdefault((song_request.id, request['user_id']), now)
+            accepted = insert_votes(votes)
+            counts = Counter(song_request_id for song_request_id, _ in accepted)
+            if counts:
+                SongRequest.objects.filter(id__in=counts).update(votes=F('votes') + Case(
+                    *(When(id=song_request_id, then=count) for song_request_id, count in counts.items())
+                ))
+
+            results = []
+            gained = Counter()
+            seen = set()
+            for request in requests:
+                key = request['event_id'], request['song_id']
+                song_request = song_requests[key]
+                vote = song_request.id, request['user_id']
+                if vote not in accepted or vote in seen:
+                    results.append((song_request.id, ALREADY_VOTED))
+                    continue
+                seen.add(vote)
+                results.append((song_request.id, CREATED if key in created and request is first_requests[key] else VOTED))
+                song_request.votes += 1
+                gained[song_request.id] += 1
+
+            if gained:
+                # Sent in the transaction, so the read models change with the rows
+                instances = [song_request for song_request in song_requests.values() if song_request.id in gained]
+                song_requests_created.send(sender=SongRequest, instances=instances, votes=dict(gained))
+    except IntegrityError as e:
+        raise ValidationError({"error": "An error occurred during song request creation: " + str(e)})
+    except (ValueError, TypeError, DataError) as e:
+        # Ids that are not integers, or out of the range of their columns
+        raise ValidationError({"error": "Invalid song request: " + str(e)})
+
+    return results
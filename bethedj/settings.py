@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -54,6 +55,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Brotli or gzip, as the client accepts; see app.compression
+    'app.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -62,6 +65,23 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per-view query count, DB time and total time, read back with `manage.py view_stats`
+if os.environ.get('PROFILE_VIEWS'):
+    MIDDLEWARE.insert(0, 'app.profiling.ProfilingMiddleware')
+PROFILE_DATABASE = os.path.join(tempfile.gettempdir(), 'bethedj_profile.sqlite3')
+
+# Views that run more queries than their budget are logged, or fail with 'raise'.
+# Our views declare `query_budget`; this sets it for views we do not own.
+QUERY_BUDGET_ACTION = 'log'
+QUERY_BUDGETS = {
+    'admin:app_customuser_changelist': 6,
+    'admin:app_djprofile_changelist': 5,
+    'admin:app_location_changelist': 5,
+    'admin:app_event_changelist': 5,
+    'admin:app_song_changelist': 5,
+    'admin:app_songrequest_changelist': 5,
+}
+
 ROOT_URLCONF = 'bethedj.urls'
 
 TEMPLATES = [
@@ -84,11 +104,24 @@ WSGI_APPLICATION = 'bethedj.wsgi.application'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'app.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'EXCEPTION_HANDLER': 'app.utils.exception_handler',
+    # Proxies in front of the app that append to X-Forwarded-For. Throttles key on the address
+    # the last of them saw; with none, on REMOTE_ADDR, as the header is the client's to set
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
+    'DEFAULT_RENDERER_CLASSES': [
+        'app.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'app.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 # Database
@@ -106,6 +139,63 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Per-event request queues are served from this cache and rebuilt after the timeout.
+# Entries are checked against the version of the queue in the database, so a cache of
+# each worker is correct, only each worker builds its own copies.
+EVENT_QUEUE_CACHE = 'default'
+EVENT_QUEUE_TIMEOUT = 300
+
+# Token -> user and role snapshots used by app.authentication.CachedTokenAuthentication.
+# Changes the signals miss, or that a per-process cache misses, show after the timeout.
+TOKEN_CACHE = 'default'
+TOKEN_CACHE_TIMEOUT = 30
+
+# Threads used by the async views to hash passwords off the event loop
+PASSWORD_HASHER_THREADS = 4
+
+# Per-event history kept by the song request hub for clients resuming a stream,
+# dropped when the event has had no subscribers for SONG_REQUEST_HUB_IDLE_SECONDS
+SONG_REQUEST_HUB_HISTORY = 500
+SONG_REQUEST_HUB_QUEUE_SIZE = 1000
+SONG_REQUEST_HUB_IDLE_SECONDS = 60
+
+# Requested and pending song requests expire after this many minutes without a status change
+SONG_REQUEST_MAX_AGE_MINUTES = 120
+
+# `manage.py archive` moves the song requests of events that ended this many days ago out of the live tables
+ARCHIVE_FINISHED_EVENT_DAYS = 30
+
+# Events live now or within the horizon are kept in a per-process interval index, rebuilt
+# when their version in LIVE_EVENTS_CACHE changes, and at least on this period
+LIVE_EVENTS_CACHE = 'default'
+LIVE_EVENTS_REFRESH_SECONDS = 60
+LIVE_EVENTS_HORIZON_HOURS = 24
+
+# Lifetime of the in-process song search index used when the database is not PostgreSQL
+SONG_SEARCH_INDEX_TTL = 60
+
+# Spotify track ids resolved to song ids per process
+SONG_ID_CACHE_SIZE = 10000
+
+# Token buckets shared by the worker processes of a host, and the anonymous song request limits.
+# The device limit is a share of the IP limit, see app.throttling.SongRequestThrottle
+THROTTLE_DATABASE = os.path.join(tempfile.gettempdir(), 'bethedj_throttle.sqlite3')
+SONG_REQUEST_THROTTLE_RATES = {
+    'ip': '30/min',
+    'device': '10/min',
+    'event': '1200/min',
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -131,10 +221,24 @@ SOCIAL_AUTH_JSONFIELD_ENABLED = True
 
 AUTHENTICATION_BACKENDS = (
     'social_core.backends.google.GoogleOAuth2',
-    'django.contrib.auth.backends.ModelBackend',
     'app.backends.EmailBackend',
 )
 
+# Stored hashes are upgraded to the first hasher on the next successful login. Only hashers
+# needing no extra package: Argon2 and BCrypt would need argon2-cffi and bcrypt installed
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# Failed email/password pairs answered without hashing, and per-account exponential backoff
+FAILED_LOGIN_CACHE_SIZE = 10000
+FAILED_LOGIN_CACHE_SECONDS = 300
+LOGIN_BACKOFF_CACHE = 'default'
+LOGIN_BACKOFF_FREE_ATTEMPTS = 5
+LOGIN_BACKOFF_MAX_SECONDS = 900
+
 SOCIAL_AUTH_JSONFIELD_ENABLED = True
 
 SOCIAL_AUTH_ADMIN_USER_SEARCH_FIELDS = ['email', 'name']
@@ -18,12 +18,44 @@ from django.contrib import admin
 from django.urls import include, path
 from django.views.generic.base import RedirectView
 
-from app.views import CreateEventView, CreateLocationView, HomeView, LoginView, LogoutView, CreateSongRequestView
+from app.views import (
+    AsyncCreateSongRequestView,
+    AsyncEventQueueView,
+    AsyncEventStreamView,
+    AsyncLoginView,
+    CreateEventView,
+    CreateLocationView,
+    CreateSongRequestBatchView,
+    CreateSongRequestView,
+    DjProfileView,
+    EventDetailView,
+    EventListView,
+    EventQueueView,
+    EventSongRequestListView,
+    EventStatsView,
+    HomeView,
+    ImageView,
+    LoginView,
+    LogoutView,
+    NearbyEventsView,
+    SongListView,
+    SongSearchView,
+    TriageSongRequestsView,
+)
 
 create_patterns = [
     path('location/', CreateLocationView.as_view(), name='create_location'),
     path('event/', CreateEventView.as_view(), name='create_event'),
     path('song_request/', CreateSongRequestView.as_view(), name='create_song_request'),
+    path('song_requests/', CreateSongRequestBatchView.as_view(), name='create_song_requests'),
+]
+
+# Async versions of the hot paths, for when the project is served over ASGI
+async_patterns = [
+    path('accounts/login/', AsyncLoginView.as_view(), name='login'),
+    path('create/song_request/', AsyncCreateSongRequestView.as_view(), name='create_song_request'),
+    path('event/<int:event_id>/queue/', AsyncEventQueueView.as_view(), name='event_queue'),
+    path('event/<int:event_id>/stream/', AsyncEventStreamView.as_view(), name='event_stream'),
 ]
 
 urlpatterns = [
@@ -36,4 +68,18 @@ urlpatterns = [
 
     # Create -> the path included here will be /create/<pattern>
     path('create/', include((create_patterns, 'app'), namespace='create')),
+    path('song/search/', SongSearchView.as_view(), name='song_search'),
+    path('songs/', SongListView.as_view(), name='song_list'),
+    path('events/', EventListView.as_view(), name='event_list'),
+    path('song_requests/triage/', TriageSongRequestsView.as_view(), name='triage_song_requests'),
+    path('dj/<int:dj_id>/', DjProfileView.as_view(), name='dj_profile'),
+    path('images/<str:name>', ImageView.as_view(), name='image'),
+    path('event/nearby/', NearbyEventsView.as_view(), name='nearby_events'),
+    path('event/<int:event_id>/', EventDetailView.as_view(), name='event_detail'),
+    path('event/<int:event_id>/queue/', EventQueueView.as_view(), name='event_queue'),
+    path('event/<int:event_id>/stats/', EventStatsView.as_view(), name='event_stats'),
+    path('event/<int:event_id>/song_requests/', EventSongRequestListView.as_view(), name='event_song_requests'),
+
+    # Async -> the path included here will be /async/<pattern>
+    path('async/', include((async_patterns, 'app'), namespace='async')),
 ]